@@ -0,0 +1,105 @@
+"""
+Offline decoding of a packet capture, vectorized and packet by packet
+
+Writes a pcap of messages sent by several senders over all carriers and interleaved with other
+traffic, then decodes it with and without NumPy and checks every message comes back.
+
+    python benchmarks/capture.py [messages] [noise packets per message]
+"""
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from packet_buddy.base import CaptureDecoder
+from packet_buddy.base.capture import np, LINKTYPE_ETHERNET
+from packet_buddy.base.ip import PROTO_FUNC_MAP
+from packet_buddy.base.ip_utils import Shifter, SEQUENCED_BPO_MAX
+
+SECRET = b'super duper secret key! Encrypt!'
+TARGET = '127.0.0.1'
+FRAME = 1444
+SENDERS = 8
+ETHERNET = bytes(12) + b'\x08\x00'
+TCP = 6
+
+
+def noise(size: int) -> bytes:
+    """
+    TCP packet with a random header and payload
+    """
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 40 + size, 0, 0, 64, TCP, 0, os.urandom(4), os.urandom(4))
+    return ip + os.urandom(20 + size)
+
+
+def packets(count: int) -> Tuple[List[bytes], Dict[int, List[bytes]]]:
+    """
+    Packets of all messages in the order they are sent and the messages by sender
+    """
+    sent = {}
+    queues = []
+    for i in range(count):
+        sender = i % SENDERS + 1
+        carrier = random.choice(list(PROTO_FUNC_MAP))
+        data = os.urandom(random.randint(16, 4096))
+        payload = carrier == 'icmp-pl'
+        frames = Shifter.encode_message(
+            data, sender,
+            secret=SECRET,
+            bytes_per_option=FRAME if payload else SEQUENCED_BPO_MAX,
+            serial=i // SENDERS % 256,
+            payload=payload,
+        )
+        sent.setdefault(sender, []).append(data)
+        queues.append([PROTO_FUNC_MAP[carrier](TARGET, bytes(f)) for f in frames])
+    # Senders interleave, messages of one sender go out one after another
+    pending = [[p for q in queues[sender::SENDERS] for p in q][::-1] for sender in range(SENDERS)]
+    ordered = []
+    while any(pending):
+        ordered.append(random.choice([q for q in pending if q]).pop())
+    return ordered, sent
+
+
+def write(path: str, count: int, others: int) -> Dict[int, List[bytes]]:
+    ordered, sent = packets(count)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 0xffff, LINKTYPE_ETHERNET))
+        now = time.time()
+        for packet in ordered:
+            for _ in range(random.randint(0, 2 * others)):
+                other = ETHERNET + noise(random.randint(0, 1400))
+                f.write(struct.pack('<IIII', int(now), int(now % 1 * 1e6), len(other), len(other)) + other)
+            packet = ETHERNET + packet
+            f.write(struct.pack('<IIII', int(now), int(now % 1 * 1e6), len(packet), len(packet)) + packet)
+            now += 1e-4
+    return sent
+
+
+def decode(path: str, vectorized: bool) -> Tuple[float, CaptureDecoder, Dict[int, List[bytes]]]:
+    decoder = CaptureDecoder(SECRET, vectorized=vectorized)
+    start = time.perf_counter()
+    received = {}
+    for m in decoder.messages(path):
+        received.setdefault(m.sender, []).append(m.data)
+    return time.perf_counter() - start, decoder, received
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    others = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'capture.pcap')
+        sent = write(path, count, others)
+        size = os.path.getsize(path)
+        print(f"{count} messages, {size / 2 ** 20:.1f} MiB")
+        print(f"{'decoder':>10} {'packets':>9} {'frames':>8} {'messages':>9} {'seconds':>8} {'packets/s':>11} {'intact':>7}")
+        for vectorized in ((False, True) if np is not None else (False,)):
+            elapsed, decoder, received = decode(path, vectorized)
+            print(
+                f"{'numpy' if vectorized else 'python':>10} {decoder.packets:>9} {decoder.frames:>8} "
+                f"{decoder.decoded:>9} {elapsed:>8.2f} {decoder.packets / elapsed:>11.0f} "
+                f"{str(received == sent):>7}"
+            )
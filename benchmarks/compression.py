@@ -0,0 +1,52 @@
+"""
+Fragments per message with and without compression
+
+Trains a dictionary on one set of generated ``Data`` payloads and frames another set with each
+codec over an option carrier, where the bytes per option decide the fragments. Payloads that would
+not save a fragment are sent as they are.
+
+    python benchmarks/compression.py
+"""
+import random
+
+from packet_buddy.base import IPMessager, Data, message, train
+from packet_buddy.base.ip_utils import SEQUENCED_BPO_MAX
+
+SECRET = b'super duper secret key! Encrypt!'
+# icmp-pl fills whole packets whatever the bytes per option, so every message would be one fragment
+CARRIER = 'ip-udp'
+MESSAGES = 500
+SENDERS = ['node-1', 'node-2', 'node-3', 'gateway']
+TOPICS = ['telemetry', 'alerts', 'control', 'status']
+WORDS = 'status ok temperature sensor reading alert battery low heartbeat node online offline restart'.split()
+
+
+def payloads(seed: int):
+    r = random.Random(seed)
+    m = IPMessager[Data](1, SECRET, 16)
+    return [
+        bytes(m.message[message(r.choice(SENDERS), r.choice(TOPICS), ' '.join(r.choices(WORDS, k=r.randint(1, 12))))])
+        for _ in range(MESSAGES)
+    ]
+
+
+def fragments(data, bpo: int, compression: bool, dictionary=None) -> float:
+    m = IPMessager[Data](1, SECRET, bpo, CARRIER, compression=compression, dictionary=dictionary)
+    total = 0
+    for d in data:
+        msg = m.message[d]
+        msg.target = ('127.0.0.1', 0)
+        total += len(m.packets(msg))
+    return total / len(data)
+
+
+if __name__ == '__main__':
+    dictionary = train(payloads(0))
+    data = payloads(1)
+    print(f"average payload {sum(map(len, data)) / len(data):.0f} bytes, dictionary {len(dictionary)} bytes")
+    print(f"{'bpo':>4} {'none':>6} {'zlib':>6} {'dict':>6} {'saved':>6}")
+    for bpo in range(8, SEQUENCED_BPO_MAX + 1, 4):
+        none = fragments(data, bpo, False)
+        deflate = fragments(data, bpo, True)
+        preset = fragments(data, bpo, True, dictionary)
+        print(f"{bpo:>4} {none:>6.2f} {deflate:>6.2f} {preset:>6.2f} {none - preset:>6.2f}")
@@ -0,0 +1,65 @@
+"""
+Congestion window and send rate behind a bottleneck
+
+A reliable messager sends large messages over an in-process link that forwards a fixed number of
+packets per second through a short queue. The window and rate of the path are sampled while
+sending, the rate settles around the capacity of the link instead of overflowing the queue.
+
+    python benchmarks/congestion.py [capacity] [seconds]
+"""
+import os
+import sys
+import threading
+import time
+
+# The link lives next to this file, wherever it is run from
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from lossy import Link, LinkedMessager
+from packet_buddy.base import Data, message, Pacer
+from packet_buddy.base.interface import Target
+
+SECRET = b'super duper secret key! Encrypt!'
+SIZE = 1 << 17
+SENDERS = 2
+INTERVAL = .25
+
+
+def sender(m: LinkedMessager, stop: threading.Event, sent: list):
+    content = 'x' * SIZE
+    while not stop.is_set():
+        out = m.message[message('a', 'b', content)]
+        out.target = Target(('10.0.0.2', 0))
+        m.deliver(out)
+        sent.append(SIZE)
+
+
+if __name__ == '__main__':
+    capacity = float(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    link = Link(0., rate=capacity)
+    options = dict(pacer=Pacer(), reliable=True, mtu=1500, window=256)
+    a = LinkedMessager[Data](link, '10.0.0.1', 1, SECRET, 0, 'icmp-pl', **options)
+    b = LinkedMessager[Data](link, '10.0.0.2', 2, SECRET, 0, 'icmp-pl', **options)
+    stop = threading.Event()
+    sent = []
+    for _ in range(SENDERS):
+        threading.Thread(target=sender, args=(a, stop, sent), daemon=True).start()
+    print(f"capacity {capacity:.0f} packets/s")
+    print(f"{'time':>5} {'window':>7} {'rate':>8} {'srtt ms':>8} {'link pps':>10} {'dropped':>8}")
+    start = time.monotonic()
+    last = 0
+    while time.monotonic() - start < seconds:
+        time.sleep(INTERVAL)
+        path = a.path('10.0.0.2')
+        if path is None:
+            continue
+        delivered = link.count
+        rate = path.rate or 0.
+        print(
+            f"{time.monotonic() - start:>5.2f} {path.window:>7.1f} {rate:>8.0f} {path.srtt * 1000:>8.1f} "
+            f"{(delivered - last) / INTERVAL:>10.0f} {link.dropped:>8}"
+        )
+        last = delivered
+    stop.set()
+    print(f"{len(sent)} messages, {a.retransmitter.retransmitted} fragments resent")
@@ -0,0 +1,59 @@
+"""
+Throughput of the datagram transport over loopback UDP and Unix sockets
+
+Runs without root. Every message is sent with ``deliver`` so that nothing is lost to a full socket
+buffer, the receiver checks that every message arrived intact.
+
+    python benchmarks/datagram.py [messages] [size]
+"""
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from packet_buddy.base import DatagramMessager, Data, message
+
+SECRET = b'super duper secret key! Encrypt!'
+
+
+def run(family: int, count: int, size: int):
+    if family == socket.AF_UNIX:
+        directory = tempfile.mkdtemp()
+        a, b = os.path.join(directory, 'a'), os.path.join(directory, 'b')
+        target = (b, 0)
+    else:
+        a, b = ('127.0.0.2', 0), ('127.0.0.3', 0)
+    options = dict(reliable=True, family=family)
+    tx = DatagramMessager[Data](1, SECRET, a, **options)
+    rx = DatagramMessager[Data](2, SECRET, b, **options)
+    if family != socket.AF_UNIX:
+        target = rx.address
+    received = []
+    threading.Thread(target=rx.receive, args=(lambda m: received.append(m.payload.content),), daemon=True).start()
+    threading.Thread(target=tx.receive, args=(lambda m: None,), daemon=True).start()
+    contents = [f'{i:06}' + 'x' * (size - 6) for i in range(count)]
+    start = time.perf_counter()
+    for content in contents:
+        m = tx.message[message('a', 'b', content)]
+        m.target = target
+        tx.deliver(m, 10)
+    elapsed = time.perf_counter() - start
+    # Fragments are acknowledged before the message is opened
+    deadline = time.monotonic() + 1
+    while len(received) < count and time.monotonic() < deadline:
+        time.sleep(.001)
+    frames = tx.frame_size(target[0])
+    print(f"{family.name:>8} {count:>6} {size:>8} {frames:>6} {elapsed:>7.2f} {count * size / elapsed / 2 ** 20:>8.1f} "
+          f"{tx.retransmitter.retransmitted:>7} {sorted(received) == contents!s:>6}")
+    tx.close()
+    rx.close()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 1 << 18
+    print(f"{'family':>8} {'msgs':>6} {'size':>8} {'frame':>6} {'seconds':>7} {'MiB/s':>8} {'resent':>7} {'intact':>6}")
+    for family in (socket.AF_INET, socket.AF_UNIX):
+        run(family, count, size)
@@ -0,0 +1,71 @@
+"""
+Frame encoding throughput for 1 KiB to 1 MiB payloads
+
+Compares the per fragment bytes concatenation used before with the single buffer encoder, both
+without sequencing as a sequenced message is limited to 4095 fragments, and the full
+``encode_message``/``decode_message`` round including encryption.
+
+    python benchmarks/framing.py
+"""
+import os
+import struct
+import time
+from typing import List
+
+from packet_buddy.base.ip_utils import (
+    Utils, Shifter, Protocol, Status, MessageType, OPTION_HEADER_SIZE, CUSTOM_HEADER_SIZE, TIMESTAMP_OPTION,
+)
+
+SECRET = b'super duper secret key! Encrypt!'
+BPO = 28
+SIZES = [1 << 10, 1 << 14, 1 << 17, 1 << 20]
+
+
+def legacy(data: bytes, size: int) -> List[bytes]:
+    """
+    The frame encoding before the single buffer
+    """
+    pre = ((Protocol.PREFIX | Protocol.TRANSMISSION | MessageType.DATA) << 24 | size).to_bytes(4, byteorder='big')
+    rem = len(data) % size
+    if rem != 0:
+        data = data + (size - rem) * b'\x00'
+    parts = [data[i:i + size] for i in range(0, len(data), size)]
+    length = struct.pack("!B", CUSTOM_HEADER_SIZE + size + OPTION_HEADER_SIZE)
+    pointer = struct.pack("!B", CUSTOM_HEADER_SIZE + size + OPTION_HEADER_SIZE + 1)
+    options = [TIMESTAMP_OPTION.to_bytes(1, byteorder='big') + length + pointer + b'\x03' + pre + p for p in parts]
+    for i in (0, -1):
+        flag = Status.START if i == 0 else Status.END
+        options[i] = options[i][:OPTION_HEADER_SIZE] + (
+                (options[i][OPTION_HEADER_SIZE] | flag) ^ Protocol.TRANSMISSION
+        ).to_bytes(1, byteorder='big') + options[i][OPTION_HEADER_SIZE + 1:]
+    return options
+
+
+def single(data: bytes, size: int) -> List[memoryview]:
+    option = Utils.option_size(size, False)
+    buffer = bytearray(Utils.parts(len(data), size=size) * option)
+    Utils.encode_into(buffer, 0, data, _type=MessageType.DATA, _id=0, size=size)
+    view = memoryview(buffer)
+    return Utils.set_start_end([view[i:i + option] for i in range(0, len(buffer), option)])
+
+
+def rate(f, size: int) -> float:
+    n = max(1, (1 << 22) // size)
+    start = time.perf_counter()
+    for _ in range(n):
+        f()
+    return n * size / (time.perf_counter() - start) / (1 << 20)
+
+
+if __name__ == '__main__':
+    print(f"{'payload':>8} {'legacy MiB/s':>13} {'buffer MiB/s':>13} {'encode MiB/s':>13} {'decode MiB/s':>13}")
+    for size in SIZES:
+        data = os.urandom(size)
+        encoded = [bytes(o) for o in Shifter.encode_message(data, 1, secret=SECRET, bytes_per_option=BPO)]
+        print(
+            f"{size >> 10:>5} KiB"
+            f" {rate(lambda: legacy(data, BPO), size):>13.1f}"
+            f" {rate(lambda: single(data, BPO), size):>13.1f}"
+            f" {rate(lambda: Shifter.encode_message(data, 1, secret=SECRET, bytes_per_option=BPO), size):>13.1f}"
+            f" {rate(lambda: Shifter.decode_message(encoded, secret=SECRET), size):>13.1f}"
+        )
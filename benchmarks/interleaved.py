@@ -0,0 +1,57 @@
+"""
+Reassembly of many messages in flight at once
+
+The fragments of every message are scattered over a window of the messages sent around it and some
+are repeated, so about ``overlap`` messages per sender are being reassembled at any time. Every
+message has to come out intact, no raw sockets or root are needed.
+
+    python benchmarks/interleaved.py [messages] [overlap]
+"""
+import random
+import sys
+import time
+
+from packet_buddy.base import IPMessager, Data, message, Pacer
+from packet_buddy.base.interface import Target
+
+SECRET = b'super duper secret key! Encrypt!'
+SENDERS = 4
+
+
+def run(count: int, overlap: int, protocol: str, bpo: int):
+    rng = random.Random(1)
+    rx = IPMessager[Data](0, SECRET, bpo, protocol, pacer=Pacer(), mtu=1500)
+    senders = [IPMessager[Data](i, SECRET, bpo, protocol, pacer=Pacer(), mtu=1500) for i in range(1, SENDERS + 1)]
+    timeline = []
+    contents = []
+    for i in range(count):
+        tx = senders[i % SENDERS]
+        content = f'{i:06}' + 'x' * rng.randint(0, 6000)
+        contents.append(content)
+        m = tx.message[message('a', 'b', content)]
+        m.target = Target(('10.0.0.2', 0))
+        packets = tx.packets(m)
+        packets += rng.sample(packets, len(packets) // 4)
+        # Sent around the same time as the other messages of the window
+        timeline += [(i + rng.uniform(0, overlap * SENDERS), bytes(p)) for p in packets]
+    timeline.sort(key=lambda e: e[0])
+    received = []
+    start = time.perf_counter()
+    for _, p in timeline:
+        m = rx.handle(memoryview(p), ('10.0.0.1', 0))
+        if m is not None:
+            received.append(m.payload.content)
+    elapsed = time.perf_counter() - start
+    r = rx.reassembler
+    intact = sorted(received) == sorted(contents)
+    print(f"{protocol:>8} {count:>6} {overlap:>7} {len(timeline):>8} {len(received):>8} "
+          f"{r.duplicates:>6} {r.evicted:>7} {len(timeline) / elapsed:>9.0f} {intact!s:>6}")
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    overlap = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    print(f"{'carrier':>8} {'msgs':>6} {'overlap':>7} {'packets':>8} {'received':>8} "
+          f"{'dupes':>6} {'evicted':>7} {'packets/s':>9} {'intact':>6}")
+    for protocol, bpo in (('icmp-pl', 0), ('ip-udp', 24)):
+        run(count if protocol == 'icmp-pl' else count // 4, overlap, protocol, bpo)
@@ -0,0 +1,136 @@
+"""
+Throughput of reliable delivery over a lossy link
+
+Two messagers are connected by an in-process link that drops the given share of packets and delays
+the rest, so no raw sockets or root are needed. Every message is sent with ``deliver`` which returns
+once the peer acknowledged all of it, the receiver checks that every message arrived intact.
+
+    python benchmarks/lossy.py [messages] [size]
+"""
+import heapq
+import random
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, Generic, List, Optional, Tuple
+
+from packet_buddy.base import IPMessager, Data, message, Pacer
+from packet_buddy.base.interface import PT, Target
+
+SECRET = b'super duper secret key! Encrypt!'
+LOSSES = [0., .01, .05, .1, .2]
+DELAY = .005
+
+
+class Link:
+    """
+    Delivers packets to the messager bound to the target address after a delay unless dropped
+
+    A link with a rate is a bottleneck that forwards that many packets per second and drops what
+    does not fit in its queue.
+    """
+
+    def __init__(
+            self,
+            loss: float,
+            delay: float = DELAY,
+            seed: int = 1,
+            rate: Optional[float] = None,
+            queue: int = 32,
+    ):
+        self.loss = loss
+        self.delay = delay
+        self.rate = rate
+        self.limit = queue
+        self.departures: Deque[float] = deque()
+        self.random = random.Random(seed)
+        self.endpoints = dict()
+        self.queue: List[Tuple[float, int, bytes, str, str]] = []
+        self.count = 0
+        self.sent = 0
+        self.dropped = 0
+        self.condition = threading.Condition()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def send(self, packet: bytes, source: str, target: str):
+        with self.condition:
+            self.sent += 1
+            if self.random.random() < self.loss:
+                self.dropped += 1
+                return
+            now = time.monotonic()
+            departure = now
+            if self.rate is not None:
+                while self.departures and self.departures[0] <= now:
+                    self.departures.popleft()
+                if len(self.departures) >= self.limit:
+                    self.dropped += 1
+                    return
+                departure = max(now, self.departures[-1] if self.departures else now) + 1 / self.rate
+                self.departures.append(departure)
+            self.count += 1
+            heapq.heappush(self.queue, (departure + self.delay, self.count, packet, source, target))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue or self.queue[0][0] > time.monotonic():
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                _, _, packet, source, target = heapq.heappop(self.queue)
+            m = self.endpoints[target]
+            r = m.handle(memoryview(packet), (source, 0))
+            if r is not None:
+                m.on_message(r)
+
+
+class LinkedMessager(IPMessager, Generic[PT]):
+
+    def __init__(self, link: Link, address: str, *args, **kwargs):
+        super(LinkedMessager, self).__init__(*args, **kwargs)
+        self.link = link
+        self.address = address
+        self.received: List[str] = []
+        link.endpoints[address] = self
+
+    def emit(self, packets: List[bytes], target: Tuple[str, int], protocol: Optional[int] = None):
+        for packet in packets:
+            self.link.send(bytes(packet), self.address, target[0])
+
+    def on_message(self, m):
+        self.received.append(m.payload.content)
+
+
+def run(loss: float, count: int, size: int, protocol: str, bpo: int):
+    link = Link(loss)
+    options = dict(pacer=Pacer(), reliable=True, mtu=1500)
+    a = LinkedMessager[Data](link, '10.0.0.1', 1, SECRET, bpo, protocol, **options)
+    b = LinkedMessager[Data](link, '10.0.0.2', 2, SECRET, bpo, protocol, **options)
+    contents = [f'{i:06}' + 'x' * (size - 6) for i in range(count)]
+    start = time.perf_counter()
+    for content in contents:
+        m = a.message[message('a', 'b', content)]
+        m.target = Target(('10.0.0.2', 0))
+        a.deliver(m)
+    elapsed = time.perf_counter() - start
+    intact = sorted(b.received) == contents
+    r = a.retransmitter
+    print(
+        f"{protocol:>8} {loss:>5.0%} {count:>6} {elapsed:>7.2f} {count * size / elapsed / 1024:>8.1f} "
+        f"{link.sent:>7} {link.dropped:>7} {r.retransmitted:>7} {r.failed:>6} {intact!s:>6}"
+    )
+    a.close()
+    b.close()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    print(
+        f"{'carrier':>8} {'loss':>5} {'msgs':>6} {'seconds':>7} {'KiB/s':>8} "
+        f"{'packets':>7} {'dropped':>7} {'resent':>7} {'failed':>6} {'intact':>6}"
+    )
+    for protocol, bpo in (('icmp-pl', 0), ('ip-udp', 24)):
+        for loss in LOSSES:
+            run(loss, count if protocol == 'icmp-pl' else max(count // 10, 1), size, protocol, bpo)
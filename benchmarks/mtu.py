@@ -0,0 +1,30 @@
+"""
+Packets per message with option frames and MTU sized payload frames
+
+The IP option carriers fit at most SEQUENCED_BPO_MAX bytes into a packet, ``icmp-pl`` fills every
+packet up to the MTU and carries the frame header in the ICMP identifier and sequence fields.
+
+    python benchmarks/mtu.py
+"""
+from packet_buddy.base import IPMessager, Data, message
+from packet_buddy.base.ip_utils import Shifter, SEQUENCED_BPO_MAX
+
+SECRET = b'super duper secret key! Encrypt!'
+CONTENTS = ['hi', 'hello' * 20, 'hello' * 200, 'hello' * 2000]
+MTUS = [576, 1500, 9000]
+
+
+def count(data: bytes, bpo: int, payload: bool) -> int:
+    return len(Shifter.encode_message(data, 1, secret=SECRET, bytes_per_option=bpo, serial=1, payload=payload))
+
+
+if __name__ == '__main__':
+    m = IPMessager[Data](1, SECRET, SEQUENCED_BPO_MAX, 'ip-udp')
+    print(f"{'bytes':>6} {'mtu':>5} {'options':>8} {'payload':>8} {'ratio':>6}")
+    for content in CONTENTS:
+        data = bytes(m.message[message('a', 'b', content)])
+        options = count(data, SEQUENCED_BPO_MAX, False)
+        for mtu in MTUS:
+            p = IPMessager[Data](1, SECRET, SEQUENCED_BPO_MAX, 'icmp-pl', mtu=mtu)
+            payload = count(data, p.frame_size('127.0.0.1'), True)
+            print(f"{len(data):>6} {mtu:>5} {options:>8} {payload:>8} {options / payload:>6.1f}")
@@ -0,0 +1,31 @@
+"""
+Packets per message with random and implicit nonces
+
+Random nonces travel as ENCRYPTION fragments ahead of the ciphertext, implicit ones are derived from
+the message counter on both sides and cost no packets at all.
+
+    python benchmarks/nonce.py
+"""
+import os
+
+from packet_buddy.base import IPMessager, Data, message
+from packet_buddy.base.ip_utils import Shifter, SEQUENCED_BPO_MAX, NONCE_SIZE
+
+SECRET = b'super duper secret key! Encrypt!'
+CONTENTS = ['hi', 'hello' * 20, 'hello' * 200]
+
+
+def count(data: bytes, bpo: int, implicit: bool) -> int:
+    nonce = os.urandom(NONCE_SIZE) if implicit else None
+    return len(Shifter.encode_message(data, 1, secret=SECRET, bytes_per_option=bpo, serial=1, nonce=nonce))
+
+
+if __name__ == '__main__':
+    m = IPMessager[Data](1, SECRET, 16)
+    print(f"{'bytes':>6} {'bpo':>4} {'random':>7} {'implicit':>9} {'saved':>6}")
+    for content in CONTENTS:
+        data = bytes(m.message[message('a', 'b', content)])
+        for bpo in range(4, SEQUENCED_BPO_MAX + 1, 4):
+            random = count(data, bpo, False)
+            implicit = count(data, bpo, True)
+            print(f"{len(data):>6} {bpo:>4} {random:>7} {implicit:>9} {1 - implicit / random:>6.0%}")
@@ -0,0 +1,47 @@
+"""
+Receive side payload handling per message
+
+Compares the former ``parse_raw_as`` call per message with the cached parser, and a lazy messager
+whose callback drops every message but one topic by looking at the topic only.
+
+    python benchmarks/parse.py
+"""
+import timeit
+
+from pydantic import parse_raw_as
+
+from packet_buddy.base import IPMessager, Data, message, BINARY
+
+SECRET = b'super duper secret key! Encrypt!'
+NUMBER = 20000
+TOPICS = ['telemetry', 'alerts', 'control', 'status']
+
+
+def routed(m: IPMessager, data) -> int:
+    """
+    Callback keeping one topic out of four and reading its content
+    """
+    kept = 0
+    for raw in data:
+        msg = m.message[raw]
+        if msg.topic == 'alerts':
+            kept += len(msg.payload.content)
+    return kept
+
+
+if __name__ == '__main__':
+    print(f"{'codec':<7} {'path':<15} {'us/msg':>7}")
+    for name, codec in (('json', None), ('binary', BINARY)):
+        m = IPMessager[Data](1, SECRET, 16, payload_codec=codec)
+        data = [bytes(m.message[message('node-1', TOPICS[i % 4], 'temperature reading %d' % i)]) for i in range(100)]
+        n = NUMBER // len(data)
+        if codec is None:
+            t = timeit.timeit(lambda: [parse_raw_as(Data, raw) for raw in data], number=n)
+            print(f"{name:<7} {'parse_raw_as':<15} {t / n / len(data) * 1e6:>7.2f}")
+        t = timeit.timeit(lambda: [m.message[raw] for raw in data], number=n)
+        print(f"{name:<7} {'cached parser':<15} {t / n / len(data) * 1e6:>7.2f}")
+        t = timeit.timeit(lambda: routed(m, data), number=n)
+        print(f"{name:<7} {'eager routed':<15} {t / n / len(data) * 1e6:>7.2f}")
+        lazy = IPMessager[Data](1, SECRET, 16, payload_codec=codec, lazy=True)
+        t = timeit.timeit(lambda: routed(lazy, data), number=n)
+        print(f"{name:<7} {'lazy routed':<15} {t / n / len(data) * 1e6:>7.2f}")
@@ -0,0 +1,29 @@
+"""
+Encoded payload size and encode/decode time of the JSON and binary codecs
+
+    python benchmarks/payload.py
+"""
+import timeit
+
+from packet_buddy.base import IPMessager, Data, message, BINARY
+from packet_buddy.base.ip_utils import Utils, TAG_SIZE
+
+SECRET = b'super duper secret key! Encrypt!'
+NUMBER = 20000
+PAYLOADS = [
+    message('a', 'b', 'hi'),
+    message('node-1', 'telemetry', 'temperature sensor reading ok'),
+    message('gateway', 'control', 'restart ' * 40),
+]
+
+
+if __name__ == '__main__':
+    print(f"{'codec':<7} {'bytes':>6} {'frags':>6} {'encode us':>10} {'decode us':>10}")
+    for payload in PAYLOADS:
+        for name, codec in (('json', None), ('binary', BINARY)):
+            m = IPMessager[Data](1, SECRET, 16, payload_codec=codec)
+            data = bytes(m.message[payload])
+            encode = timeit.timeit(lambda: bytes(m.message[payload]), number=NUMBER) / NUMBER * 1e6
+            decode = timeit.timeit(lambda: m.message[data], number=NUMBER) / NUMBER * 1e6
+            frags = Utils.parts(len(data) + TAG_SIZE, size=16)
+            print(f"{name:<7} {len(data):>6} {frags:>6} {encode:>10.2f} {decode:>10.2f}")
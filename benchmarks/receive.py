@@ -0,0 +1,84 @@
+"""
+Receive path allocations per packet
+
+Replays carrier packets over a loopback UDP socket pair so that no root is needed, the UDP payload
+is the full IP packet exactly as a raw socket would return it.
+
+    python benchmarks/receive.py
+"""
+import socket
+import time
+import tracemalloc
+
+from packet_buddy.base import IPMessager, Data, message
+from packet_buddy.base.ip import PROTO_FUNC_MAP
+from packet_buddy.base.ip_utils import Shifter
+from packet_buddy.base.utils import BufferPool, PACKET_MAX
+
+SECRET = b'super duper secret key! Encrypt!'
+MESSAGES = 200
+
+
+def packets(protocol: str, bpo: int):
+    data = bytes(IPMessager[Data](1, SECRET, bpo, protocol).message[message('a', 'b', 'hello' * 20)])
+    return [
+        PROTO_FUNC_MAP[protocol]('127.0.0.1', p)
+        for p in Shifter.encode_message(data, 1, secret=SECRET, bytes_per_option=bpo)
+    ]
+
+
+def legacy(m: IPMessager, s: socket.socket) -> int:
+    """
+    The receive loop body before the buffer pool
+    """
+    raw_bytes, _, _, addr = s.recvmsg(PACKET_MAX)
+    m.handle(raw_bytes, addr)
+    return 1
+
+
+def pooled(m: IPMessager, s: socket.socket, pool: BufferPool) -> int:
+    count = 0
+    for raw_bytes, addr in m.read(s, pool):
+        m.handle(raw_bytes, addr)
+        count += 1
+    return count
+
+
+def run(protocol: str, bpo: int, use_pool: bool, trace: bool):
+    m = IPMessager[Data](2, SECRET, bpo, protocol)
+    pool = BufferPool(IPMessager.RECEIVE_BATCH)
+    ps = packets(protocol, bpo)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as r, socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as w:
+        r.bind(('127.0.0.1', 0))
+        r.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        peak = 0
+        elapsed = 0.
+        if trace:
+            tracemalloc.start()
+        for _ in range(MESSAGES):
+            for p in ps:
+                w.sendto(p, r.getsockname())
+            received = 0
+            while received < len(ps):
+                if trace:
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                start = time.perf_counter()
+                received += pooled(m, r, pool) if use_pool else legacy(m, r)
+                elapsed += time.perf_counter() - start
+                if trace:
+                    peak += tracemalloc.get_traced_memory()[1] - before
+        if trace:
+            tracemalloc.stop()
+    count = MESSAGES * len(ps)
+    return peak / count, elapsed / count * 1e9
+
+
+if __name__ == '__main__':
+    print(f"{'carrier':<8} {'bpo':>4} {'path':<7} {'peak B/pkt':>11} {'ns/pkt':>9}")
+    for protocol in PROTO_FUNC_MAP:
+        for bpo in (16, 28):
+            for use_pool in (False, True):
+                b, _ = run(protocol, bpo, use_pool, True)
+                _, ns = run(protocol, bpo, use_pool, False)
+                print(f"{protocol:<8} {bpo:>4} {'pooled' if use_pool else 'recvmsg':<7} {b:>11.0f} {ns:>9.0f}")
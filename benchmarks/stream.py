@@ -0,0 +1,82 @@
+"""
+Streaming a file over the datagram transport
+
+Sends a file of random data as a stream to a receiver writing it to disk, over loopback UDP and a
+Unix socket with reliable delivery, for a few sizes of the encryption pool. The received file is
+compared to the sent one and the peak memory of the process shows that neither side holds the file.
+
+    python benchmarks/stream.py [MiB]
+"""
+import hashlib
+import os
+import resource
+import socket
+import sys
+import tempfile
+import time
+from threading import Thread
+from typing import Tuple
+
+from packet_buddy.base import DatagramMessager, Data, FileSink, CHUNK_SIZE
+
+SECRET = b'super duper secret key! Encrypt!'
+WORKERS = [1, 2, 4]
+TIMEOUT = 10
+
+
+def digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def run(source: str, directory: str, family: int, a, b, workers: int) -> Tuple[float, bool, int]:
+    done = []
+
+    def opener(peer, sender, stream):
+        done.append(os.path.join(directory, stream.hex()))
+        return FileSink(done[-1])
+
+    rx = DatagramMessager[Data](2, SECRET, b, family, reliable=True, streams=opener)
+    tx = DatagramMessager[Data](1, SECRET, a, family, reliable=True)
+    try:
+        for m in (rx, tx):
+            Thread(target=m.receive, args=(lambda _: None,), daemon=True).start()
+        target = b if family == socket.AF_INET else (b, 0)
+        start = time.perf_counter()
+        with open(source, 'rb') as f:
+            tx.stream(f, target, workers=workers, timeout=TIMEOUT)
+        deadline = time.monotonic() + TIMEOUT
+        while rx.incoming.completed + rx.incoming.failed == 0 and time.monotonic() < deadline:
+            time.sleep(.001)
+        elapsed = time.perf_counter() - start
+        intact = rx.incoming.completed == 1 and digest(done[0]) == digest(source)
+        return elapsed, intact, min(CHUNK_SIZE, tx.chunk_size(target[0]))
+    finally:
+        tx.close()
+        rx.close()
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) << 20 if len(sys.argv) > 1 else 64 << 20
+    with tempfile.TemporaryDirectory() as d:
+        source = os.path.join(d, 'source')
+        with open(source, 'wb') as f:
+            for offset in range(0, size, 1 << 20):
+                f.write(os.urandom(min(1 << 20, size - offset)))
+        print(f"{size >> 20} MiB")
+        print(f"{'socket':>7} {'workers':>8} {'chunk':>10} {'MiB/s':>8} {'intact':>7}")
+        for family, a, b in (
+                (socket.AF_INET, ('127.0.0.2', 7300), ('127.0.0.3', 7300)),
+                (socket.AF_UNIX, os.path.join(d, 'a'), os.path.join(d, 'b')),
+        ):
+            for workers in WORKERS:
+                elapsed, intact, chunk = run(source, d, family, a, b, workers)
+                name = 'udp' if family == socket.AF_INET else 'unix'
+                print(f"{name:>7} {workers:>8} {chunk:>10} {size / elapsed / 2 ** 20:>8.1f} {str(intact):>7}")
+                for name in os.listdir(d):
+                    if name not in ('source', 'a', 'b'):
+                        os.unlink(os.path.join(d, name))
+        print(f"peak memory {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss >> 10} MiB")
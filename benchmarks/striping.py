@@ -0,0 +1,82 @@
+"""
+Throughput of striping messages over several carriers
+
+Every carrier gets its own in-process link with a bottleneck and a pacer matching it, so no raw
+sockets or root are needed. Messages are sent over each carrier alone and then striped over both,
+the striped rate should come close to the sum of the others.
+
+    python benchmarks/striping.py [messages] [size]
+"""
+import sys
+import threading
+import time
+from typing import Dict, Generic, List, Optional, Tuple
+
+from packet_buddy.base import IPMessager, Data, message, Pacer
+from packet_buddy.base.interface import PT, Target
+from packet_buddy.base.ip import PROTO_MAP
+
+from lossy import Link, SECRET
+
+# Packets per second of the bottleneck of every carrier
+RATES = {'icmp-pl': 200, 'ip-udp': 4000}
+BPO = 24
+
+
+class StripedMessager(IPMessager, Generic[PT]):
+
+    def __init__(self, links: Dict[int, Link], address: str, *args, **kwargs):
+        super(StripedMessager, self).__init__(*args, **kwargs)
+        self.links = links
+        self.address = address
+        self.received: List[str] = []
+        # The links deliver from a thread each, the receiver reads all its sockets from one
+        self.lock = threading.Lock()
+        for link in links.values():
+            link.endpoints[address] = self
+
+    def emit(self, packets: List[bytes], target: Tuple[str, int], protocol: Optional[int] = None):
+        link = self.links[protocol if protocol is not None else self.protocol]
+        for packet in packets:
+            link.send(bytes(packet), self.address, target[0])
+
+    def handle(self, raw_bytes: memoryview, addr: Tuple[str, int]):
+        with self.lock:
+            return super(StripedMessager, self).handle(raw_bytes, addr)
+
+    def on_message(self, m):
+        self.received.append(m.payload.content)
+
+
+def run(carriers: List[str], count: int, size: int):
+    links = {PROTO_MAP[c]: Link(0., rate=RATES[c], queue=RATES[c]) for c in carriers}
+    pacers = {c: Pacer(packets_per_second=RATES[c]) for c in carriers}
+    options = dict(mtu=1500, pacer=pacers[carriers[0]], pacers=pacers)
+    if len(carriers) > 1:
+        options['stripes'] = carriers
+    a = StripedMessager[Data](links, '10.0.0.1', 1, SECRET, BPO, carriers[0], **options)
+    b = StripedMessager[Data](links, '10.0.0.2', 2, SECRET, BPO, carriers[0], **options)
+    contents = [f'{i:06}' + 'x' * (size - 6) for i in range(count)]
+    start = time.perf_counter()
+    for content in contents:
+        m = a.message[message('a', 'b', content)]
+        m.target = Target(('10.0.0.2', 0))
+        a.send(m)
+    while len(b.received) < count and time.perf_counter() - start < 60:
+        time.sleep(.001)
+    elapsed = time.perf_counter() - start
+    intact = sorted(b.received) == contents
+    dropped = sum(link.dropped for link in links.values())
+    shares = ' '.join(f'{c.name}={c.measured or 0:.0f}' for c in a.stripes or ())
+    print(f"{'+'.join(carriers):>16} {count:>6} {elapsed:>7.2f} {count * size / elapsed / 1024:>8.1f} "
+          f"{dropped:>7} {intact!s:>6}  {shares}")
+    a.close()
+    b.close()
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 16384
+    print(f"{'carriers':>16} {'msgs':>6} {'seconds':>7} {'KiB/s':>8} {'dropped':>7} {'intact':>6}  packets/s")
+    for carriers in (['icmp-pl'], ['ip-udp'], ['icmp-pl', 'ip-udp']):
+        run(carriers, count, size)
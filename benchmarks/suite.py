@@ -0,0 +1,239 @@
+"""
+Microbenchmarks of the framing, crypto and serialization hot paths
+
+Every stage runs for every ``BPO`` and for payloads from 16 B to 1 MiB, without root or network.
+For each it reports the nanoseconds per operation, the packets per message and the peak memory one
+operation allocates. Results are written as JSON so that runs of two commits can be compared:
+
+    python benchmarks/suite.py [--out results.json] [--quick] [--stage encode_message ...]
+    python benchmarks/suite.py --compare before.json after.json
+
+Messages of more than 4095 fragments cannot be sequenced, the sequenced stages skip them.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, get_args
+
+from packet_buddy.base import IPMessager, Data, message, BINARY
+from packet_buddy.base.ip import PROTO_FUNC_MAP, SCAPY_FUNC_MAP
+from packet_buddy.base.ip_utils import (
+    BPO, NONCE_SIZE, SEQUENCE_MAX, SEQUENCED_BPO_MAX, TAG_SIZE, MessageType, Shifter, Utils, cipher,
+)
+
+SECRET = b'super duper secret key! Encrypt!'
+SIZES = [16, 64, 256, 1 << 10, 1 << 12, 1 << 14, 1 << 16, 1 << 18, 1 << 20]
+QUICK_SIZES = [16, 1 << 10, 1 << 16, 1 << 20]
+BPOS = list(get_args(BPO))
+FRAME = 1444  # Data bytes of an icmp-pl frame with a 1500 byte MTU
+TARGET = '127.0.0.1'
+MIN_TIME = .2
+QUICK_TIME = .02
+THRESHOLD = .1  # Relative change reported as a regression or improvement
+
+# Stage, BPO or None, payload size or None, the operation and the packets it makes
+Case = Tuple[str, Optional[int], Optional[int], Callable[[], object], Optional[int]]
+
+
+def payload(size: int) -> bytes:
+    return os.urandom(size)
+
+
+def framing(sizes: List[int]) -> Iterator[Case]:
+    for size in sizes:
+        data = payload(size)
+        for bpo in BPOS:
+            count = Utils.parts(len(data), size=bpo)
+            option = Utils.option_size(bpo, False)
+            buffer = bytearray(count * option)
+            Utils.encode_into(buffer, 0, data, _type=MessageType.DATA, _id=1, size=bpo)
+            options = [bytes(buffer[i:i + option]) for i in range(0, len(buffer), option)]
+            yield (
+                'encode_options', bpo, size,
+                lambda d=data, b=buffer, o=bpo: Utils.encode_into(b, 0, d, _type=MessageType.DATA, _id=1, size=o),
+                count,
+            )
+            yield 'decode_options', bpo, size, lambda o=options: Utils.decode(o), count
+
+
+def messages(sizes: List[int]) -> Iterator[Case]:
+    for size in sizes:
+        data = payload(size)
+        for bpo in BPOS:
+            encoded = Shifter.encode_message(data, 1, secret=SECRET, bytes_per_option=bpo)
+            yield (
+                'encode_message', bpo, size,
+                lambda d=data, o=bpo: Shifter.encode_message(d, 1, secret=SECRET, bytes_per_option=o),
+                len(encoded),
+            )
+            yield 'decode_message', bpo, size, lambda e=encoded: Shifter.decode_message(e, secret=SECRET), len(encoded)
+            parts = Utils.parts(NONCE_SIZE, size=min(NONCE_SIZE, bpo)) + Utils.parts(size + TAG_SIZE, size=bpo)
+            if parts > SEQUENCE_MAX or bpo > SEQUENCED_BPO_MAX:
+                continue
+            sequenced = Shifter.encode_message(data, 1, secret=SECRET, bytes_per_option=bpo, serial=1)
+            yield (
+                'encode_sequenced', bpo, size,
+                lambda d=data, o=bpo: Shifter.encode_message(d, 1, secret=SECRET, bytes_per_option=o, serial=1),
+                len(sequenced),
+            )
+            yield 'decode_sequenced', bpo, size, lambda e=sequenced: Shifter.decode_message(e, secret=SECRET), parts
+        frames = Shifter.encode_message(data, 1, secret=SECRET, bytes_per_option=FRAME, payload=True)
+        yield (
+            'encode_frames', None, size,
+            lambda d=data: Shifter.encode_message(d, 1, secret=SECRET, bytes_per_option=FRAME, payload=True),
+            len(frames),
+        )
+        yield 'decode_frames', None, size, lambda f=frames: Shifter.decode_message(f, secret=SECRET), len(frames)
+
+
+def crypto(sizes: List[int]) -> Iterator[Case]:
+    aead = cipher(SECRET)
+    nonce = os.urandom(NONCE_SIZE)
+    aad = (1).to_bytes(4, byteorder='big')
+    for size in sizes:
+        data = payload(size)
+        sealed = aead.encrypt(nonce, data, aad)
+        yield 'encrypt', None, size, lambda d=data: aead.encrypt(nonce, d, aad), None
+        yield 'decrypt', None, size, lambda s=sealed: aead.decrypt(nonce, s, aad), None
+
+
+def serialization(sizes: List[int]) -> Iterator[Case]:
+    for name, codec in (('json', None), ('binary', BINARY)):
+        m = IPMessager[Data](1, SECRET, 16, payload_codec=codec)
+        for size in sizes:
+            p = message('sender', 'topic', 'x' * size)
+            data = bytes(m.message[p])
+            yield f'message_{name}_encode', None, size, lambda p=p, m=m: bytes(m.message[p]), None
+            yield f'message_{name}_decode', None, size, lambda d=data, m=m: m.message[d].payload, None
+
+
+def wrappers(_: List[int]) -> Iterator[Case]:
+    """
+    A single packet per call, the size is the frame handed to the wrapper
+    """
+    for bpo in BPOS:
+        option = bytes(Shifter.encode_message(b'x' * bpo, 1, secret=SECRET, bytes_per_option=bpo)[-1])
+        for carrier in ('ip-icmp', 'ip-udp'):
+            yield f'wrap_{carrier}', bpo, len(option), lambda p=option, f=PROTO_FUNC_MAP[carrier]: f(TARGET, p), 1
+            yield f'scapy_{carrier}', bpo, len(option), lambda p=option, f=SCAPY_FUNC_MAP[carrier]: f(TARGET, p), 1
+    frame = bytes(Shifter.encode_message(b'x' * FRAME, 1, secret=SECRET, bytes_per_option=FRAME, payload=True)[0])
+    yield 'wrap_icmp-pl', None, len(frame), lambda: PROTO_FUNC_MAP['icmp-pl'](TARGET, frame), 1
+    yield 'scapy_icmp-pl', None, len(frame), lambda: SCAPY_FUNC_MAP['icmp-pl'](TARGET, frame), 1
+
+
+STAGES = {
+    'framing': framing,
+    'messages': messages,
+    'crypto': crypto,
+    'serialization': serialization,
+    'wrappers': wrappers,
+}
+
+
+def measure(op: Callable[[], object], min_time: float) -> Tuple[float, int]:
+    """
+    Nanoseconds per call, doubling the calls until a round takes at least the minimum time
+    """
+    op()
+    number = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            op()
+        elapsed = time.perf_counter_ns() - start
+        if elapsed >= min_time * 1e9:
+            return elapsed / number, number
+        number *= 2
+
+
+def allocated(op: Callable[[], object]) -> int:
+    """
+    Peak bytes allocated by a single call
+    """
+    tracemalloc.start()
+    try:
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        op()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - current
+
+
+def commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(groups: List[str], sizes: List[int], min_time: float) -> Dict:
+    results = []
+    print(f"{'stage':<24} {'bpo':>4} {'size':>8} {'ns/op':>14} {'packets':>8} {'peak bytes':>11}")
+    for group in groups:
+        for stage, bpo, size, op, packets in STAGES[group](sizes):
+            ns, number = measure(op, min_time)
+            peak = allocated(op)
+            results.append(dict(stage=stage, bpo=bpo, size=size, ns=ns, number=number, packets=packets, peak=peak))
+            print(f"{stage:<24} {bpo or '-':>4} {size or '-':>8} {ns:>14.0f} {packets or '-':>8} {peak:>11}")
+    return dict(
+        commit=commit(),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        min_time=min_time,
+        results=results,
+    )
+
+
+def compare(before: Dict, after: Dict):
+    """
+    Prints the change of every case present in both runs, regressions are marked
+    """
+    key = lambda r: (r['stage'], r['bpo'], r['size'])
+    old = {key(r): r for r in before['results']}
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    print(f"{'stage':<24} {'bpo':>4} {'size':>8} {'before ns':>14} {'after ns':>14} {'change':>8}")
+    regressions = 0
+    for r in after['results']:
+        b = old.get(key(r))
+        if b is None:
+            continue
+        change = r['ns'] / b['ns'] - 1
+        mark = ''
+        if change > THRESHOLD:
+            mark = ' slower'
+            regressions += 1
+        elif change < -THRESHOLD:
+            mark = ' faster'
+        print(f"{r['stage']:<24} {r['bpo'] or '-':>4} {r['size'] or '-':>8} {b['ns']:>14.0f} {r['ns']:>14.0f} "
+              f"{change:>+8.1%}{mark}")
+    print(f"{regressions} slower by more than {THRESHOLD:.0%}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', help="JSON file for the results")
+    parser.add_argument('--quick', action='store_true', help="fewer sizes and shorter rounds")
+    parser.add_argument('--stage', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args()
+    if args.compare:
+        with open(args.compare[0]) as a, open(args.compare[1]) as b:
+            compare(json.load(a), json.load(b))
+        sys.exit(0)
+    report = run(args.stage, QUICK_SIZES if args.quick else SIZES, QUICK_TIME if args.quick else MIN_TIME)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=1)
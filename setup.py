@@ -25,6 +25,9 @@ setuptools.setup(
         "cryptography",
         "pydantic"
     ],
+    extras_require={
+        "capture": ["numpy"],
+    },
     package_dir={"": "src"},
     packages=setuptools.find_packages(where="src"),
     python_requires=">=3.9",
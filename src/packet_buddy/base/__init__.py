@@ -1,3 +1,11 @@
 from .ip import *
+from .aio import *
+from .datagram import *
+from .capture import *
+from .stream import *
+from .metrics import *
+from .pacing import *
+from .compression import *
+from .binary import *
 from .interface import *
 from .message import *
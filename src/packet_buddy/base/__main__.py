@@ -31,8 +31,7 @@ server.start()
 
 time.sleep(1)
 
-m = IPMessager[Data](1, SECRET, 64, 'icmp-pl')
-m.message[message('a', 'b', 'hello')] >> ('127.0.0.1', IPMessager.DUMMY_UDP)
+m = IPMessager[Data](1, SECRET, 32, 'icmp-pl')
 
 
 def on_message(d):
@@ -40,6 +39,12 @@ def on_message(d):
     sys.exit()
 
 
-m.receive(on_message)
+# Listen before sending, the reply can arrive before send returns
+client = Thread(target=m.receive, args=(on_message,), daemon=True)
+client.start()
+
+m.message[message('a', 'b', 'hello')] >> ('127.0.0.1', IPMessager.DUMMY_UDP)
+
+client.join()
 
 time.sleep(1)
@@ -0,0 +1,233 @@
+import asyncio
+import inspect
+import socket
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, AsyncIterator, Union, Awaitable, List, Tuple, Set, Deque
+
+from .bpf import attach
+from .interface import *
+from .ip import IPMessager
+from .reliability import Delivery
+from .stream import Source, chunks, new_stream, stream_nonce
+from .utils import BufferPool, make_socket, report_overflow
+
+
+class AsyncIPMessager(IPMessager, Generic[PT]):
+    """
+    IPMessager running on an asyncio event loop
+
+    The raw receive sockets are registered with ``loop.add_reader`` so any number of messagers can
+    share a single loop. Packets go out over a non-blocking send socket of its own, a full send
+    buffer suspends the sending task instead of the loop. Incoming messages are read by iterating
+    the messager:
+
+        async with AsyncIPMessager[Data](1, SECRET, 16) as m:
+            await (m.message[message('a', 'b', 'hello')] >> target)
+            async for reply in m:
+                ...
+    """
+    QUEUE_SIZE = 1024
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncIPMessager, self).__init__(*args, **kwargs)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._sockets: List[socket.socket] = []
+        self._sender: Optional[socket.socket] = None
+        self._dummy: Optional[socket.socket] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._pool = BufferPool(IPMessager.RECEIVE_BATCH)
+        self._tasks: Set[asyncio.Task] = set()
+        self._send_lock: Optional[asyncio.Lock] = None
+
+    async def __aenter__(self):
+        self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self):
+        if self._queue is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(AsyncIPMessager.QUEUE_SIZE)
+        self._dummy = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        if socket.IPPROTO_UDP in self.demux:
+            try:
+                self._dummy.bind(('0.0.0.0', IPMessager.DUMMY_UDP))
+            except OSError:
+                pass
+        for protocol, program in self.programs.items():
+            s = make_socket(protocol)
+            s.setblocking(False)
+            if program is not None:
+                attach(s, program)
+            report_overflow(s)
+            self._sockets.append(s)
+            self._loop.add_reader(s.fileno(), self._on_readable, s)
+        self._sender = make_socket(self.protocol)
+        self._sender.setblocking(False)
+        if self.sockets.sndbuf is not None:
+            self._sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sockets.sndbuf)
+
+    def close(self):
+        if self._sockets:
+            for s in self._sockets:
+                self._loop.remove_reader(s.fileno())
+                s.close()
+            self._dummy.close()
+            self._sender.close()
+            self._sockets = []
+            self._sender = None
+            self._dummy = None
+            if self._queue.full():
+                self._queue.get_nowait()
+                self.dropped += 1
+            self._queue.put_nowait(None)
+        super(AsyncIPMessager, self).close()
+
+    def _on_readable(self, s: socket.socket):
+        for raw_bytes, addr in self.read(s, self._pool):
+            try:
+                m = self.handle(raw_bytes, addr)
+            except ValueError:
+                self.invalid += 1
+                continue
+            if m is not None:
+                try:
+                    self._queue.put_nowait(m)
+                except asyncio.QueueFull:
+                    self.dropped += 1
+
+    async def transmit(self, packets: List[bytes], target: Tuple[str, int]) -> Optional[Delivery]:
+        if self.retransmitter is not None:
+            return super(AsyncIPMessager, self).transmit(packets, target)
+        if self.stripes is not None:
+            # The carriers are sent over in parallel by the striping threads
+            await asyncio.get_running_loop().run_in_executor(None, self.stripe, packets, target)
+            return None
+        if self.sequenced:
+            await self._transmit(packets, target)
+            return None
+        if self._send_lock is None:
+            self._send_lock = asyncio.Lock()
+        # One message at a time, unsequenced fragments of concurrent messages would mix on the wire
+        async with self._send_lock:
+            await self._transmit(packets, target)
+        return None
+
+    async def _transmit(self, packets: List[bytes], target: Tuple[str, int]):
+        async for batch in self.pacer.abatches(packets):
+            for packet in batch:
+                await self._sendto(packet, target)
+            self.sent_packets.inc(len(batch))
+
+    async def _sendto(self, packet: bytes, target: Tuple[str, int]):
+        s = self._sender
+        if hasattr(self._loop, 'sock_sendto'):
+            # Python 3.11 and later
+            await self._loop.sock_sendto(s, packet, target)
+            return
+        while True:
+            try:
+                s.sendto(packet, target)
+                return
+            except (BlockingIOError, InterruptedError):
+                pass
+            writable = self._loop.create_future()
+            self._loop.add_writer(s.fileno(), lambda: writable.done() or writable.set_result(None))
+            try:
+                await writable
+            finally:
+                self._loop.remove_writer(s.fileno())
+
+    async def send(self, m: Message[PT]):
+        start = time.monotonic()
+        for packets, target in self.outgoing(m):
+            await self.transmit(packets, target)
+        self.send_time.observe(time.monotonic() - start)
+
+    async def deliver(self, m: Message[PT], timeout: Optional[float] = None):
+        if self.retransmitter is None:
+            raise ValueError("Delivery needs a reliable messager")
+        start = time.monotonic()
+        for packets, target in self.outgoing(m):
+            d = await self.transmit(packets, target)
+            if not await asyncio.get_running_loop().run_in_executor(None, d.wait, timeout):
+                raise TimeoutError("Message not acknowledged")
+        self.delivery_time.observe(time.monotonic() - start)
+
+    async def stream(
+            self,
+            source: Source,
+            target: Tuple[str, int],
+            chunk_size: Optional[int] = None,
+            workers: int = 4,
+            timeout: Optional[float] = None,
+    ) -> bytes:
+        """
+        Sends a stream like ``IPMessager.stream``, the chunks are sealed on a pool of worker threads
+        and sent from the loop
+        """
+        key, chunk_size = self.stream_key(target, chunk_size)
+        stream = new_stream()
+        loop = asyncio.get_running_loop()
+        ahead: Deque[asyncio.Future] = deque()
+        pending: Deque[Delivery] = deque()
+
+        async def wait(d: Delivery):
+            if not await loop.run_in_executor(None, d.wait, timeout):
+                raise TimeoutError("Chunk not acknowledged")
+
+        async def send(packets: List[bytes]):
+            delivery = await self.transmit(packets, target)
+            if delivery is None:
+                return
+            pending.append(delivery)
+            if len(pending) > 2 * workers:
+                await wait(pending.popleft())
+
+        with ThreadPoolExecutor(workers, 'seal') as pool:
+            try:
+                for index, (data, last) in enumerate(chunks(source, chunk_size)):
+                    nonce = stream_nonce(stream, index, last)
+                    counter = self.next_counter(target[0])
+                    ahead.append(loop.run_in_executor(pool, self.seal, data, target[0], key, nonce, counter))
+                    if len(ahead) > 2 * workers:
+                        await send(await ahead.popleft())
+                while ahead:
+                    await send(await ahead.popleft())
+            finally:
+                for f in ahead:
+                    f.cancel()
+        while pending:
+            await wait(pending.popleft())
+        return stream
+
+    def dispatch(self, packets: List[bytes], target: Tuple[str, int]):
+        task = self._loop.create_task(self.transmit(packets, target))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def __aiter__(self) -> AsyncIterator[Message[PT]]:
+        return self
+
+    async def __anext__(self) -> Message[PT]:
+        self.open()
+        m = await self._queue.get()
+        if m is None:
+            # Wake up the next iterator waiting on a closed messager
+            self._queue.put_nowait(None)
+            raise StopAsyncIteration
+        return m
+
+    async def receive(self, callback: Callable[[Message[PT]], Union[NoReturn, Awaitable]]):
+        async for m in self:
+            r = callback(m)
+            if inspect.isawaitable(r):
+                await r
+
+
+__all__ = ['AsyncIPMessager']
@@ -0,0 +1,292 @@
+"""
+Compact binary payload codec derived from the pydantic model fields
+
+Fields are written in declaration order without names:
+
+    str, bytes  varint length followed by the raw (utf-8) bytes
+    int         zigzag varint
+    bool        single byte
+    float       8 byte double
+    enums       the value, if all members have values of one of the types above
+    models      fields of the nested model
+    lists       varint count followed by the items
+
+Subclasses of these types are written as their base type. Decoded payloads are validated by the
+model like JSON ones, so validators and coercions apply the same whichever codec sent them.
+
+Optional fields get a bit in a presence bitmap in front of the fields and cost nothing when unset.
+Encoded payloads start with a zero byte which JSON never does, so JSON payloads are still decoded and
+models with field types not listed above are sent as JSON.
+"""
+import struct
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Callable, List, Optional, Tuple, Type
+
+from pydantic.fields import ModelField, SHAPE_LIST, SHAPE_SINGLETON
+
+from .interface import PayloadCodec, BaseModel, PT
+
+MARKER = 0
+
+Encoder = Callable[[Any, bytearray], None]
+Decoder = Callable[[bytes, int], Tuple[Any, int]]
+
+_DOUBLE = struct.Struct('!d')
+
+
+def write_varint(n: int, out: bytearray):
+    while n > 0x7f:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    n = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _encode_int(v: int, out: bytearray):
+    write_varint(v << 1 if v >= 0 else (~v << 1) | 1, out)
+
+
+def _decode_int(data: bytes, pos: int) -> Tuple[int, int]:
+    n, pos = read_varint(data, pos)
+    return (n >> 1) ^ -(n & 1), pos
+
+
+def _encode_bytes(v: bytes, out: bytearray):
+    write_varint(len(v), out)
+    out += v
+
+
+def _decode_bytes(data: bytes, pos: int) -> Tuple[bytes, int]:
+    n, pos = read_varint(data, pos)
+    if pos + n > len(data):
+        raise ValueError("Truncated payload")
+    return bytes(data[pos:pos + n]), pos + n
+
+
+def _encode_str(v: str, out: bytearray):
+    _encode_bytes(v.encode('utf-8'), out)
+
+
+def _decode_str(data: bytes, pos: int) -> Tuple[str, int]:
+    v, pos = _decode_bytes(data, pos)
+    return v.decode('utf-8'), pos
+
+
+def _encode_bool(v: bool, out: bytearray):
+    out.append(1 if v else 0)
+
+
+def _decode_bool(data: bytes, pos: int) -> Tuple[bool, int]:
+    return data[pos] != 0, pos + 1
+
+
+def _encode_float(v: float, out: bytearray):
+    out += _DOUBLE.pack(v)
+
+
+def _decode_float(data: bytes, pos: int) -> Tuple[float, int]:
+    return _DOUBLE.unpack_from(data, pos)[0], pos + _DOUBLE.size
+
+
+SCALARS = {
+    bool: (_encode_bool, _decode_bool),
+    int: (_encode_int, _decode_int),
+    float: (_encode_float, _decode_float),
+    str: (_encode_str, _decode_str),
+    bytes: (_encode_bytes, _decode_bytes),
+}
+
+
+def _enum(_type: Type[Enum]) -> Tuple[Encoder, Decoder]:
+    kinds = {type(member.value) for member in _type}
+    if len(kinds) != 1:
+        raise TypeError(f"No binary encoding for {_type}")
+    encode, decode = _scalar(kinds.pop())
+
+    def encode_enum(v: Any, out: bytearray):
+        # Models that use enum values hold the value already
+        encode(v.value if isinstance(v, Enum) else v, out)
+
+    return encode_enum, decode
+
+
+def _scalar(_type: Any) -> Tuple[Encoder, Decoder]:
+    if _type in SCALARS:
+        return SCALARS[_type]
+    if isinstance(_type, type):
+        if issubclass(_type, BaseModel):
+            s = schema(_type)
+            return s.write, s.read
+        if issubclass(_type, Enum):
+            return _enum(_type)
+        # bool comes before int in SCALARS
+        for base, codec in SCALARS.items():
+            if issubclass(_type, base):
+                return codec
+    raise TypeError(f"No binary encoding for {_type}")
+
+
+def _field(field: ModelField) -> Tuple[Encoder, Decoder]:
+    encode, decode = _scalar(field.type_)
+    if field.shape == SHAPE_SINGLETON:
+        return encode, decode
+    if field.shape != SHAPE_LIST:
+        raise TypeError(f"No binary encoding for {field.outer_type_}")
+
+    def encode_list(v: List[Any], out: bytearray):
+        write_varint(len(v), out)
+        for item in v:
+            encode(item, out)
+
+    def decode_list(data: bytes, pos: int) -> Tuple[List[Any], int]:
+        n, pos = read_varint(data, pos)
+        items = []
+        for _ in range(n):
+            item, pos = decode(data, pos)
+            items.append(item)
+        return items, pos
+
+    return encode_list, decode_list
+
+
+class Schema:
+    """
+    Field layout of a model, built once per model type
+    """
+
+    def __init__(self, model: Type[BaseModel]):
+        self.model = model
+        self.fields: List[Tuple[str, bool, Encoder, Decoder]] = []
+        # Models take their fields by alias unless they allow population by field name
+        self.aliases: List[str] = []
+        for name, field in model.__fields__.items():
+            self.fields.append((name, field.allow_none, *_field(field)))
+            self.aliases.append(field.alias)
+        self.optional = [name for name, optional, _, _ in self.fields if optional]
+        self.bitmap_size = (len(self.optional) + 7) // 8
+
+    def write(self, payload: BaseModel, out: bytearray):
+        values = [getattr(payload, name) for name, _, _, _ in self.fields]
+        bitmap = 0
+        bit = 0
+        for (_, optional, _, _), v in zip(self.fields, values):
+            if optional:
+                if v is not None:
+                    bitmap |= 1 << bit
+                bit += 1
+        out += bitmap.to_bytes(self.bitmap_size, byteorder='little')
+        for (_, optional, encode, _), v in zip(self.fields, values):
+            if v is not None or not optional:
+                encode(v, out)
+
+    def read(self, data: bytes, pos: int) -> Tuple[BaseModel, int]:
+        bitmap = int.from_bytes(data[pos:pos + self.bitmap_size], byteorder='little')
+        pos += self.bitmap_size
+        values = {}
+        bit = 0
+        for (_, optional, _, decode), alias in zip(self.fields, self.aliases):
+            if optional:
+                present = bitmap >> bit & 1
+                bit += 1
+                if not present:
+                    values[alias] = None
+                    continue
+            values[alias], pos = decode(data, pos)
+        return self.model(**values), pos
+
+    def peek(self, data: bytes, pos: int, name: str) -> Any:
+        """
+        Decodes fields up to the named one only
+        """
+        bitmap = int.from_bytes(data[pos:pos + self.bitmap_size], byteorder='little')
+        pos += self.bitmap_size
+        bit = 0
+        for field, optional, _, decode in self.fields:
+            if optional:
+                present = bitmap >> bit & 1
+                bit += 1
+                if not present:
+                    if field == name:
+                        return None
+                    continue
+            v, pos = decode(data, pos)
+            if field == name:
+                return v
+        return None
+
+
+@lru_cache(maxsize=None)
+def schema(model: Type[BaseModel]) -> Schema:
+    return Schema(model)
+
+
+@lru_cache(maxsize=None)
+def supported(model: Type[BaseModel]) -> Optional[Schema]:
+    try:
+        return schema(model)
+    except TypeError:
+        return None
+
+
+class BinaryCodec(PayloadCodec):
+    """
+    Binary encoding for models it can describe and JSON for everything else
+    """
+
+    def encode(self, payload: BaseModel) -> bytes:
+        s = supported(type(payload))
+        if s is None:
+            return super(BinaryCodec, self).encode(payload)
+        out = bytearray((MARKER,))
+        s.write(payload, out)
+        return bytes(out)
+
+    def parser(self, payload_type: Type[PT]) -> Callable[[bytes], PT]:
+        fallback = super(BinaryCodec, self).parser(payload_type)
+        s = supported(payload_type)
+
+        def parse(data: bytes) -> PT:
+            if not data or data[0] != MARKER:
+                return fallback(data)
+            if s is None:
+                raise ValueError("No binary encoding for payload")
+            try:
+                payload, pos = s.read(data, 1)
+            except (IndexError, UnicodeDecodeError, struct.error):
+                raise ValueError("Malformed payload")
+            if pos != len(data):
+                raise ValueError("Trailing payload data")
+            return payload
+
+        return parse
+
+    def peek(self, payload_type: Type[PT], data: bytes, name: str) -> Any:
+        if not data or data[0] != MARKER:
+            return super(BinaryCodec, self).peek(payload_type, data, name)
+        s = supported(payload_type)
+        if s is None:
+            raise ValueError("No binary encoding for payload")
+        try:
+            return s.peek(data, 1, name)
+        except (IndexError, UnicodeDecodeError, struct.error):
+            raise ValueError("Malformed payload")
+
+
+BINARY = BinaryCodec()
+
+__all__ = [
+    'BinaryCodec',
+    'BINARY',
+]
@@ -0,0 +1,110 @@
+"""
+Classic BPF programs for the raw receive sockets
+
+Raw IPv4 sockets run the attached filter on the packet starting from the IP header, so the
+programs below only let through packets that carry the custom timestamp option prelude followed by
+a header with the ``Protocol.PREFIX`` bit set. Everything else is dropped in the kernel before it
+wakes the receiving thread.
+"""
+import ctypes
+import socket
+import struct
+from typing import List, Tuple
+
+from .ip_utils import Protocol, TIMESTAMP_OPTION, OPTION_HEADER_SIZE
+from .packets import IP_HEADER_SIZE, ICMP_HEADER_SIZE, ICMP_ECHO_REQUEST
+
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+
+# Instruction classes
+BPF_LD = 0x00
+BPF_LDX = 0x01
+BPF_ALU = 0x04
+BPF_JMP = 0x05
+BPF_RET = 0x06
+
+# Sizes and modes
+BPF_B = 0x10
+BPF_K = 0x00
+BPF_ABS = 0x20
+BPF_IND = 0x40
+BPF_MSH = 0xa0
+
+# Operations
+BPF_AND = 0x50
+BPF_JEQ = 0x10
+BPF_JGT = 0x20
+BPF_JSET = 0x40
+
+ACCEPT = 0xffff
+REJECT = 0
+
+Instruction = Tuple[int, int, int, int]
+
+_INSTRUCTION = struct.Struct('HBBI')
+_PROGRAM = struct.Struct('HP')
+
+
+def stmt(code: int, k: int) -> Instruction:
+    return code, 0, 0, k
+
+
+def jump(code: int, k: int, jt: int, jf: int) -> Instruction:
+    return code, jt, jf, k
+
+
+def option_program() -> List[Instruction]:
+    """
+    IP option carriers, the prelude sits right after the fixed IP header
+    """
+    return [
+        stmt(BPF_LD | BPF_B | BPF_ABS, 0),
+        stmt(BPF_ALU | BPF_AND | BPF_K, 0x0f),
+        jump(BPF_JMP | BPF_JGT | BPF_K, IP_HEADER_SIZE >> 2, 0, 5),
+        stmt(BPF_LD | BPF_B | BPF_ABS, IP_HEADER_SIZE),
+        jump(BPF_JMP | BPF_JEQ | BPF_K, TIMESTAMP_OPTION, 0, 3),
+        stmt(BPF_LD | BPF_B | BPF_ABS, IP_HEADER_SIZE + OPTION_HEADER_SIZE),
+        jump(BPF_JMP | BPF_JSET | BPF_K, Protocol.PREFIX, 0, 1),
+        stmt(BPF_RET | BPF_K, ACCEPT),
+        stmt(BPF_RET | BPF_K, REJECT),
+    ]
+
+
+def payload_program() -> List[Instruction]:
+    """
+    ICMP payload carrier, the prelude slot of the frame is the identifier and sequence of the ICMP header
+
+    Echo replies generated by the kernel carry a copy of our own payload and are dropped too.
+    """
+    return [
+        stmt(BPF_LDX | BPF_B | BPF_MSH, 0),
+        stmt(BPF_LD | BPF_B | BPF_IND, 0),
+        jump(BPF_JMP | BPF_JEQ | BPF_K, ICMP_ECHO_REQUEST, 0, 5),
+        stmt(BPF_LD | BPF_B | BPF_IND, ICMP_HEADER_SIZE - OPTION_HEADER_SIZE),
+        jump(BPF_JMP | BPF_JEQ | BPF_K, TIMESTAMP_OPTION, 0, 3),
+        stmt(BPF_LD | BPF_B | BPF_IND, ICMP_HEADER_SIZE),
+        jump(BPF_JMP | BPF_JSET | BPF_K, Protocol.PREFIX, 0, 1),
+        stmt(BPF_RET | BPF_K, ACCEPT),
+        stmt(BPF_RET | BPF_K, REJECT),
+    ]
+
+
+def attach(s: socket.socket, program: List[Instruction]):
+    """
+    Attaches the program to the socket, raises OSError if the platform does not support it
+    """
+    code = ctypes.create_string_buffer(b''.join(_INSTRUCTION.pack(*i) for i in program))
+    s.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, _PROGRAM.pack(len(program), ctypes.addressof(code)))
+
+
+def detach(s: socket.socket):
+    s.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
+
+
+__all__ = [
+    'option_program',
+    'payload_program',
+    'attach',
+    'detach',
+]
@@ -0,0 +1,296 @@
+"""
+Offline decoder for packet captures
+
+    for m in CaptureDecoder(SECRET).messages('traffic.pcap'):
+        print(m.time, m.source, m.sender, m.data)
+
+The pcap file is memory mapped and read in chunks of packets. The record headers are walked once
+to find where every packet starts, then the IP and frame headers of the whole chunk are checked at
+once with NumPy: option frames of ``ip-icmp`` and ``ip-udp``, payload frames of ``icmp-pl`` and of
+the UDP datagram transport. Only the packets that carry frames reach Python, where they are
+reassembled by the capture time and decrypted with the static secret. Pages of the file are only
+touched once so captures larger than memory stream through. Frames never reach past the bytes
+captured of their packet, whatever their option length says.
+
+The records still have to be walked one by one in Python, which takes most of the time, so NumPy
+only makes decoding a little faster.
+
+NumPy is optional, without it every packet is checked in Python. Session messages can not be
+opened afterwards as their keys never leave the peers, they are counted as ``skipped``.
+"""
+import mmap
+import socket
+import struct
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from .compression import Compressor
+from .ip_utils import Protocol, MessageType, Shifter, TIMESTAMP_OPTION, OPTION_HEADER_SIZE, CUSTOM_HEADER_SIZE
+from .packets import IP_HEADER_SIZE, ICMP_HEADER_SIZE, UDP_HEADER_SIZE, ICMP_ECHO_REQUEST
+from .pipeline import open_message
+from .reassembly import Reassembler
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e-6),
+    b'\xa1\xb2\xc3\xd4': ('>', 1e-6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e-9),
+    b'\xa1\xb2\x3c\x4d': ('>', 1e-9),
+}
+_FILE_HEADER_SIZE = 24
+_RECORD_HEADER_SIZE = 16
+
+# Bytes in front of the IP header per link type
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_LINUX_SLL2 = 276
+LINK_OFFSETS = {
+    LINKTYPE_NULL: 4,
+    LINKTYPE_ETHERNET: 14,
+    LINKTYPE_RAW: 0,
+    LINKTYPE_LINUX_SLL: 16,
+    LINKTYPE_IPV4: 0,
+    LINKTYPE_LINUX_SLL2: 20,
+}
+ETHERTYPE_VLAN = 0x8100
+VLAN_TAG_SIZE = 4
+
+CHUNK = 1 << 16
+_MIN_FRAME = OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE
+
+
+class Captured(NamedTuple):
+    time: float
+    source: str
+    target: str
+    sender: int
+    data: bytes
+
+
+class Capture:
+    """
+    Memory mapped pcap file, hands out the packets in chunks of record positions
+    """
+
+    def __init__(self, path: str, chunk: int = CHUNK):
+        self.chunk = chunk
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self.map, 'madvise'):
+            self.map.madvise(mmap.MADV_SEQUENTIAL)
+        header = self.map[:_FILE_HEADER_SIZE]
+        if len(header) < _FILE_HEADER_SIZE or header[:4] not in _MAGIC:
+            self.map.close()
+            raise ValueError("Not a pcap file")
+        order, self.resolution = _MAGIC[header[:4]]
+        self.record = struct.Struct(order + 'IIII')
+        self.link = struct.unpack_from(order + 'I', header, 20)[0] & 0xffff
+        if self.link not in LINK_OFFSETS:
+            self.map.close()
+            raise ValueError(f"Unsupported link type {self.link}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.map.close()
+
+    def chunks(self) -> Iterator[Tuple[List[int], List[int], List[float]]]:
+        """
+        Start of the IP header, bytes captured from there on and time of the packets in a chunk
+
+        The records have to be walked one by one as each one tells where the next starts, this is
+        the only part of the decoder that looks at every packet in Python.
+        """
+        size = len(self.map)
+        unpack = self.record.unpack_from
+        data = self.map
+        link = LINK_OFFSETS[self.link]
+        ethernet = self.link == LINKTYPE_ETHERNET
+        resolution = self.resolution
+        offset = _FILE_HEADER_SIZE
+        while offset + _RECORD_HEADER_SIZE <= size:
+            starts, lengths, times = [], [], []
+            while offset + _RECORD_HEADER_SIZE <= size and len(starts) < self.chunk:
+                seconds, fraction, captured, _ = unpack(data, offset)
+                offset += _RECORD_HEADER_SIZE
+                skip = link
+                if ethernet and captured >= link and data[offset + 12] << 8 | data[offset + 13] == ETHERTYPE_VLAN:
+                    skip += VLAN_TAG_SIZE
+                starts.append(offset + skip)
+                lengths.append(min(captured, size - offset) - skip)
+                times.append(seconds + fraction * resolution)
+                offset += captured
+            yield starts, lengths, times
+
+
+def _frame(data, start: int, length: int) -> Optional[Tuple[int, int]]:
+    """
+    Position of the frame in an IP packet, one packet at a time
+    """
+    if length < IP_HEADER_SIZE + _MIN_FRAME or data[start] >> 4 != 4:
+        return None
+    ihl = (data[start] & 0x0f) << 2
+    end = start + min(length, data[start + 2] << 8 | data[start + 3])
+    if (
+            ihl > IP_HEADER_SIZE
+            and ihl <= length
+            and data[start + IP_HEADER_SIZE] == TIMESTAMP_OPTION
+            and data[start + IP_HEADER_SIZE + OPTION_HEADER_SIZE] & Protocol.PREFIX
+    ):
+        return start + IP_HEADER_SIZE, min(start + IP_HEADER_SIZE + data[start + IP_HEADER_SIZE + 1], end)
+    protocol = data[start + 9]
+    if protocol == socket.IPPROTO_ICMP:
+        if data[start + ihl] != ICMP_ECHO_REQUEST:
+            return None
+        at = start + ihl + ICMP_HEADER_SIZE - OPTION_HEADER_SIZE
+    elif protocol == socket.IPPROTO_UDP:
+        at = start + ihl + UDP_HEADER_SIZE
+    else:
+        return None
+    if end - at < _MIN_FRAME or data[at] != TIMESTAMP_OPTION or not data[at + OPTION_HEADER_SIZE] & Protocol.PREFIX:
+        return None
+    return at, end
+
+
+def _frames(data, starts: List[int], lengths: List[int]) -> Iterator[Tuple[int, int, int]]:
+    """
+    Index, start and end of the frames in a chunk, checking all packets at once
+    """
+    start = np.asarray(starts, dtype=np.int64)
+    length = np.asarray(lengths, dtype=np.int64)
+    last = len(data) - 1
+
+    def at(index):
+        return data[np.minimum(index, last)]
+
+    first = at(start)
+    ihl = (first & 0x0f).astype(np.int64) << 2
+    total = at(start + 2).astype(np.int64) << 8 | at(start + 3)
+    end = start + np.minimum(length, total)
+    ip = (length >= IP_HEADER_SIZE + _MIN_FRAME) & (first >> 4 == 4)
+
+    option = (
+            ip
+            & (ihl > IP_HEADER_SIZE)
+            & (ihl <= length)
+            & (at(start + IP_HEADER_SIZE) == TIMESTAMP_OPTION)
+            & (at(start + IP_HEADER_SIZE + OPTION_HEADER_SIZE) & Protocol.PREFIX != 0)
+    )
+    protocol = at(start + 9)
+    icmp = ip & ~option & (protocol == socket.IPPROTO_ICMP) & (at(start + ihl) == ICMP_ECHO_REQUEST)
+    udp = ip & ~option & (protocol == socket.IPPROTO_UDP)
+    payload = np.where(icmp, start + ihl + ICMP_HEADER_SIZE - OPTION_HEADER_SIZE, start + ihl + UDP_HEADER_SIZE)
+    framed = (
+            (icmp | udp)
+            & (end - payload >= _MIN_FRAME)
+            & (at(payload) == TIMESTAMP_OPTION)
+            & (at(payload + OPTION_HEADER_SIZE) & Protocol.PREFIX != 0)
+    )
+
+    frame_start = np.where(option, start + IP_HEADER_SIZE, payload)
+    frame_end = np.where(option, np.minimum(start + IP_HEADER_SIZE + at(start + IP_HEADER_SIZE + 1), end), end)
+    index = np.flatnonzero(option | framed)
+    return zip(index.tolist(), frame_start[index].tolist(), frame_end[index].tolist())
+
+
+class CaptureDecoder:
+    """
+    Extracts the messages sent with the static secret from pcap files
+    """
+
+    def __init__(
+            self,
+            secret: bytes,
+            dictionary: Optional[bytes] = None,
+            timeout: float = 5.,
+            chunk: int = CHUNK,
+            vectorized: Optional[bool] = None,
+    ):
+        """
+        Messages are reassembled per sender the same way a messager does, transactions are dropped
+        ``timeout`` seconds of capture time after their last fragment. Vectorized unless NumPy is
+        missing or turned off.
+        """
+        if vectorized and np is None:
+            raise ValueError("Vectorized decoding needs NumPy")
+        self.secret = secret
+        self.compressor = Compressor(True, dictionary)
+        self.timeout = timeout
+        self.chunk = chunk
+        self.vectorized = np is not None if vectorized is None else vectorized
+        self.packets = 0
+        self.frames = 0
+        self.decoded = 0
+        self.invalid = 0
+        self.skipped = 0
+
+    def locate(self, capture: Capture) -> Iterator[Tuple[float, int, int, int]]:
+        """
+        Time, start of the IP header and position of every frame in the capture
+        """
+        data = np.frombuffer(capture.map, dtype=np.uint8) if self.vectorized else capture.map
+        try:
+            for starts, lengths, times in capture.chunks():
+                self.packets += len(starts)
+                if self.vectorized:
+                    found = _frames(data, starts, lengths)
+                else:
+                    found = (
+                        (i, *f) for i, f in ((i, _frame(data, s, n)) for i, (s, n) in enumerate(zip(starts, lengths)))
+                        if f is not None
+                    )
+                for i, start, end in found:
+                    self.frames += 1
+                    yield times[i], starts[i], start, end
+        finally:
+            # The map can only be closed once nothing points into it
+            del data
+
+    def messages(self, path: str) -> Iterator[Captured]:
+        """
+        Messages in the order they completed, with the time of the packet that completed them
+        """
+        reassembler = Reassembler(-1, timeout=self.timeout, max_transactions=1 << 16, max_bytes=1 << 30)
+        with Capture(path, self.chunk) as capture:
+            view = memoryview(capture.map)
+            located = self.locate(capture)
+            try:
+                for time, ip, start, end in located:
+                    source = socket.inet_ntoa(view[ip + 12:ip + 16])
+                    # Serials are counted per peer, a sender talking to several hosts reuses them
+                    destination = int.from_bytes(view[ip + 16:ip + 20], byteorder='big')
+                    fragments = reassembler.add(view[start:end], (source, destination), now=time)
+                    if fragments is None:
+                        continue
+                    if Shifter.get_message_type(fragments) != MessageType.DATA:
+                        self.skipped += 1
+                        continue
+                    try:
+                        data, _ = open_message(fragments, self.secret, None, self.compressor)
+                    except ValueError:
+                        self.invalid += 1
+                        continue
+                    self.decoded += 1
+                    yield Captured(
+                        time,
+                        source,
+                        socket.inet_ntoa(view[ip + 16:ip + 20]),
+                        Shifter.get_id(fragments[0]),
+                        data,
+                    )
+            finally:
+                located.close()
+                view.release()
+
+
+__all__ = ['CaptureDecoder', 'Capture', 'Captured']
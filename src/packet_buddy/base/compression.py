@@ -0,0 +1,133 @@
+"""
+Compression of message payloads before encryption
+
+The codec of a message is carried in the top bits of the length byte of every data fragment so the
+receiver knows how to decompress it. Both codecs are raw deflate streams, the dictionary codec
+primes the window with a preset dictionary that both sides have to share. ``train`` builds one
+from sample payloads by keeping the parts that have the most in common with the other samples.
+"""
+import heapq
+import zlib
+from collections import Counter
+from typing import Iterable, Optional, Tuple, Set
+
+from .ip_utils import Utils, TAG_SIZE, BPO
+
+DICTIONARY_SIZE = 1024
+DECOMPRESSED_MAX = 1 << 20
+
+
+class Codec:
+    """
+    0 - 3
+    """
+    NONE: int = 0
+    ZLIB: int = 1
+    DICTIONARY: int = 2
+
+
+def train(samples: Iterable[bytes], size: int = DICTIONARY_SIZE, segment: int = 32, length: int = 6) -> bytes:
+    """
+    Preset dictionary from the segments of the samples that cover the most common substrings
+
+    Every substring of the given length is scored by the number of samples containing it and
+    segments are picked greedily by the score of the substrings they cover that no earlier pick
+    covers yet. The best segments end up last where deflate reaches them with the shortest
+    distances.
+    """
+    samples = list(samples)
+    counts: Counter = Counter()
+    for s in samples:
+        counts.update(dict.fromkeys((s[i:i + length] for i in range(len(s) - length + 1)), 1))
+    covered = set()
+
+    def grams(seg: bytes) -> Set[bytes]:
+        return {seg[i:i + length] for i in range(len(seg) - length + 1)}
+
+    def score(seg: bytes) -> int:
+        return sum(counts[g] for g in grams(seg) if counts[g] > 1 and g not in covered)
+
+    segments = dict.fromkeys(s[i:i + segment] for s in samples for i in range(max(len(s) - segment, 0) + 1))
+    heap = [(-score(seg), n, seg) for n, seg in enumerate(segments)]
+    heapq.heapify(heap)
+    picked = []
+    used = 0
+    # Scores only drop as more is covered so a segment that still beats the next best is the best
+    while heap and used < size:
+        _, n, seg = heapq.heappop(heap)
+        current = score(seg)
+        if current == 0:
+            continue
+        if heap and current < -heap[0][0]:
+            heapq.heappush(heap, (-current, n, seg))
+            continue
+        picked.append(seg)
+        used += len(seg)
+        covered.update(grams(seg))
+    return b''.join(reversed(picked))[-size:]
+
+
+class Compressor:
+    """
+    Picks a codec for outgoing payloads and decompresses incoming ones
+
+    Payloads are sent compressed only when that saves at least one fragment, and never when they
+    are larger than receivers decompress.
+    """
+
+    def __init__(self, enabled: bool = False, dictionary: Optional[bytes] = None, level: int = 9):
+        self.enabled = enabled
+        self.dictionary = dictionary
+        self.level = level
+        self.skipped = 0
+
+    def _compressor(self, codec: int):
+        if codec == Codec.DICTIONARY:
+            return zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=self.dictionary)
+        return zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+    def _decompressor(self, codec: int):
+        if codec == Codec.DICTIONARY:
+            if self.dictionary is None:
+                raise ValueError("No dictionary for compressed message")
+            return zlib.decompressobj(-zlib.MAX_WBITS, zdict=self.dictionary)
+        if codec == Codec.ZLIB:
+            return zlib.decompressobj(-zlib.MAX_WBITS)
+        raise ValueError("Unknown codec")
+
+    def compress(self, data: bytes, bpo: BPO) -> Tuple[int, bytes]:
+        """
+        Codec and payload to send
+        """
+        if not self.enabled:
+            return Codec.NONE, data
+        if len(data) > DECOMPRESSED_MAX:
+            self.skipped += 1
+            return Codec.NONE, data
+        codec = Codec.DICTIONARY if self.dictionary is not None else Codec.ZLIB
+        c = self._compressor(codec)
+        compressed = c.compress(data) + c.flush()
+        if Utils.parts(len(compressed) + TAG_SIZE, size=bpo) < Utils.parts(len(data) + TAG_SIZE, size=bpo):
+            return codec, compressed
+        self.skipped += 1
+        return Codec.NONE, data
+
+    def decompress(self, codec: int, data: bytes) -> bytes:
+        if codec == Codec.NONE:
+            return data
+        d = self._decompressor(codec)
+        try:
+            out = d.decompress(data, DECOMPRESSED_MAX)
+        except zlib.error:
+            raise ValueError("Failed to decompress")
+        if d.unconsumed_tail or not d.eof:
+            # Output that stops at the limit may leave nothing of the input unconsumed
+            raise ValueError("Decompressed message too large")
+        return out
+
+
+__all__ = [
+    'Codec',
+    'Compressor',
+    'train',
+]
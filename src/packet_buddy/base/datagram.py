@@ -0,0 +1,182 @@
+"""
+Unprivileged transport over UDP or Unix datagram sockets
+
+The frames are the payload frames of the ``icmp-pl`` carrier sent as bare datagrams from a single
+bound socket, so no root is needed and a frame fills up a whole datagram. Encryption, sessions,
+reliable delivery and the receive pipeline work the same as over the raw carriers.
+"""
+import os
+import socket
+from threading import Lock
+from typing import Callable, Iterator, List, NoReturn, Optional, Tuple, Union
+
+from .interface import *
+from .ip import IPMessager, Carrier
+from .ip_utils import Protocol, CUSTOM_HEADER_SIZE, OPTION_HEADER_SIZE, SEQUENCE_SIZE, TIMESTAMP_OPTION
+from .pacing import Pacer
+from .packets import IP_HEADER_SIZE, UDP_HEADER_SIZE, path_mtu
+from .pipeline import Pipeline
+from .utils import BufferPool, PACKET_MAX, report_overflow
+
+Address = Union[Tuple[str, int], str]
+
+
+def datagram_wrap(target: str, frame: bytes) -> bytes:
+    return frame
+
+
+def datagram_frame(raw_bytes: bytes) -> bytes:
+    return raw_bytes
+
+
+def frame_filter(raw_bytes: bytes) -> bool:
+    return (
+            len(raw_bytes) > OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE
+            and raw_bytes[0] == TIMESTAMP_OPTION
+            and raw_bytes[OPTION_HEADER_SIZE] & Protocol.PREFIX != 0
+    )
+
+
+class DatagramCarrier(Carrier):
+    """
+    Payload frames as they are, the protocol is the address family of the socket
+    """
+    __slots__ = []
+
+    def __init__(self, family: int, pacer: Pacer):
+        self.name = 'unix' if family == socket.AF_UNIX else 'udp'
+        self.protocol = family
+        self.payload = True
+        self.wrap = datagram_wrap
+        self.reverse = datagram_frame
+        self.accept = frame_filter
+        self.pacer = pacer
+        self.measured = None
+
+
+class DatagramMessager(IPMessager, Generic[PT]):
+    """
+    IPMessager over a bound UDP or Unix datagram socket
+
+        with DatagramMessager[Data](1, SECRET, ('127.0.0.2', 7000)) as m:
+            m.message[message('a', 'b', 'hello')] >> ('127.0.0.3', 7000)
+
+    Unix sockets are bound to a path and their targets are ``(path, 0)``. Peers are told apart by
+    their host like with the raw carriers, so UDP peers on the same machine bind distinct loopback
+    addresses. Both sides have to be bound as replies go to the address a message came from.
+    """
+    CLOSE_TIMEOUT = 1
+
+    def __init__(
+            self,
+            _id: int,
+            secret: bytes,
+            address: Address,
+            family: int = socket.AF_INET,
+            pacer: Optional[Pacer] = None,
+            rcvbuf: Optional[int] = None,
+            **kwargs,
+    ):
+        """
+        Unpaced unless a pacer is given, the frames fill the MTU of the route to the peer over UDP,
+        or the given ``mtu``, and whole datagrams over Unix sockets. Takes the other options of
+        ``IPMessager`` except for those of the raw carriers.
+        """
+        for option in ('protocol', 'kernel_filter', 'stripes', 'pacers', 'socket_per_thread'):
+            if option in kwargs:
+                raise ValueError(f"Datagram messagers do not take {option}")
+        pacer = pacer if pacer is not None else Pacer()
+        super(DatagramMessager, self).__init__(_id, secret, 0, 'icmp-pl', pacer=pacer, **kwargs)
+        self.family = family
+        self.wrap = datagram_wrap
+        self.reverse = datagram_frame
+        self.accept = frame_filter
+        self.protocol = family
+        self.link = DatagramCarrier(family, self.pacer)
+        self.carriers = {self.link.name: self.link}
+        self.demux = dict()
+        self.programs = dict()
+        self.socket = socket.socket(family, socket.SOCK_DGRAM)
+        self.receiving = Lock()
+        if rcvbuf is not None:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        if self.sockets.sndbuf is not None:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sockets.sndbuf)
+        self.socket.bind(address)
+        self.address = self.socket.getsockname()
+        report_overflow(self.socket)
+
+    def close(self):
+        super(DatagramMessager, self).close()
+        if self.socket.fileno() != -1:
+            # Wakes up a thread blocked in receive, which holds on to the socket until it returns
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.socket.close()
+            # The address is free once receive returned
+            if self.receiving.acquire(timeout=DatagramMessager.CLOSE_TIMEOUT):
+                self.receiving.release()
+            if self.family == socket.AF_UNIX and self.address:
+                try:
+                    os.unlink(self.address)
+                except OSError:
+                    pass
+
+    def frame_size(self, target: str, payload: Optional[bool] = None) -> int:
+        """
+        Data bytes per datagram to the target
+        """
+        if self.family == socket.AF_UNIX:
+            size = self.mtu if self.mtu is not None else PACKET_MAX
+        else:
+            mtu = self.mtu if self.mtu is not None else path_mtu(target)
+            size = min(mtu, PACKET_MAX) - IP_HEADER_SIZE - UDP_HEADER_SIZE
+        return size - OPTION_HEADER_SIZE - CUSTOM_HEADER_SIZE - (SEQUENCE_SIZE if self.sequenced else 0)
+
+    def emit(self, packets: List[bytes], target: Tuple[str, int], protocol: Optional[int] = None):
+        peer = target[0] if self.family == socket.AF_UNIX else target
+        for packet in packets:
+            self.socket.sendto(packet, peer)
+        self.sent_packets.inc(len(packets))
+
+    def carrier(self, raw_bytes: bytes) -> Optional[Carrier]:
+        return self.link if frame_filter(raw_bytes) else None
+
+    def read(self, s: socket.socket, pool: BufferPool) -> Iterator[Tuple[memoryview, Tuple[str, int]]]:
+        """
+        Unix addresses are paths, they are handed on as ``(path, 0)`` like a raw carrier's hosts
+        """
+        if self.family != socket.AF_UNIX:
+            yield from super(DatagramMessager, self).read(s, pool)
+            return
+        for view, addr in super(DatagramMessager, self).read(s, pool):
+            yield view, (addr, 0)
+
+    def receive(
+            self,
+            callback: Callable[[Message[PT]], NoReturn],
+            workers: int = 0,
+            processes: bool = False,
+            queue_size: int = Pipeline.QUEUE_SIZE,
+            block: bool = False,
+    ):
+        """
+        Hands every received message to the callback until the messager is closed, see ``IPMessager``
+        """
+        pipeline = Pipeline(self, callback, workers, processes, queue_size, block) if workers else None
+        pool = BufferPool(IPMessager.RECEIVE_BATCH)
+        with self.receiving:
+            try:
+                while self.socket.fileno() != -1:
+                    self.consume(self.socket, pool, callback, pipeline)
+            except OSError:
+                if self.socket.fileno() != -1:
+                    raise
+            finally:
+                if pipeline is not None:
+                    pipeline.close()
+
+
+__all__ = ['DatagramMessager']
@@ -1,5 +1,7 @@
+import json
 from abc import abstractmethod, ABCMeta
-from typing import TypeVar, Type, cast, Tuple, NewType, Generic, NoReturn, Union, Callable
+from functools import partial
+from typing import TypeVar, Type, cast, Tuple, NewType, Generic, NoReturn, Union, Callable, Optional, Awaitable, Any
 
 from pydantic import BaseModel, parse_raw_as
 
@@ -9,6 +11,41 @@ ST = TypeVar('ST', bound='TypedMessager')
 Target = NewType('Target', Tuple[str, int])
 
 
+class PayloadCodec:
+    """
+    Turns payload models into bytes and back, the default is pydantic JSON
+    """
+
+    def encode(self, payload: BaseModel) -> bytes:
+        return payload.json().encode('utf-8')
+
+    def parser(self, payload_type: Type[PT]) -> Callable[[bytes], PT]:
+        """
+        Parser for a payload type, messagers build the one for their type once and keep it
+        """
+        if isinstance(payload_type, type) and issubclass(payload_type, BaseModel):
+            return payload_type.parse_raw
+        return partial(parse_raw_as, payload_type)
+
+    def decode(self, payload_type: Type[PT], data: bytes) -> PT:
+        return self.parser(payload_type)(data)
+
+    def peek(self, payload_type: Type[PT], data: bytes, name: str) -> Any:
+        """
+        Single field of an encoded payload without validating the payload, None if it is missing
+        """
+        values = json.loads(data)
+        if not isinstance(values, dict):
+            return None
+        field = payload_type.__fields__.get(name) if hasattr(payload_type, '__fields__') else None
+        if name not in values and field is not None:
+            return values.get(field.alias)
+        return values.get(name)
+
+
+JSON = PayloadCodec()
+
+
 class _InitWrapper:
     __slots__ = ['_cls', '_type']
 
@@ -23,29 +60,60 @@ class _InitWrapper:
 
 
 class Message(Generic[PT]):
-    __slots__ = ['target', 'payload', '_payload_type', '_parent']
+    """
+    Payload with its target
+
+    Messages created from bytes keep them as ``raw``. Lazy messagers decode the payload only once it
+    is first accessed, so errors in the payload surface there, and single fields can be looked at
+    with ``peek`` before that.
+    """
+    __slots__ = ['target', 'raw', '_payload', '_payload_type', '_parent']
 
     target: Target
-    payload: PT
+    raw: Optional[bytes]
     _payload_type: Type[PT]
     _parent: ST
 
     def __init__(self, parent: ST):
         self._parent = parent
+        self._payload = None
+        self.raw = None
 
     def __getitem__(self, payload_data: Union[bytes, BaseModel]) -> 'Message[PT]':
         if isinstance(payload_data, BaseModel):
-            self.payload = payload_data
+            self._payload = payload_data
+            self.raw = None
         else:
-            self.payload = parse_raw_as(self._payload_type, payload_data)
+            self.raw = payload_data
+            self._payload = None if self._parent.lazy else self._parent.parser(payload_data)
         return self
 
-    def __rshift__(self, target: Tuple[str, int]) -> NoReturn:
+    @property
+    def payload(self) -> PT:
+        if self._payload is None and self.raw is not None:
+            self._payload = self._parent.parser(self.raw)
+        return self._payload
+
+    @payload.setter
+    def payload(self, payload: PT):
+        self._payload = payload
+        self.raw = None
+
+    def peek(self, name: str) -> Any:
+        if self._payload is not None or self.raw is None:
+            return getattr(self._payload, name, None)
+        return self._parent.payload_codec.peek(self._payload_type, self.raw, name)
+
+    @property
+    def topic(self) -> Optional[str]:
+        return self.peek('topic')
+
+    def __rshift__(self, target: Tuple[str, int]) -> Optional[Awaitable]:
         self.target = Target(target)
-        self._parent.send(self)
+        return self._parent.send(self)
 
     def __bytes__(self) -> bytes:
-        return self.payload.json().encode('utf-8')
+        return self._parent.payload_codec.encode(self.payload)
 
     def __repr__(self):
         return f"Message{self.target}:\n{self.payload.json(indent=4) if self.payload is not None else 'no content'}"
@@ -56,6 +124,15 @@ class Message(Generic[PT]):
 
 class TypedMessager(Generic[PT], metaclass=ABCMeta):
     _message_type: Type[PT]
+    payload_codec: PayloadCodec = JSON
+    lazy: bool = False
+
+    @property
+    def parser(self) -> Callable[[bytes], PT]:
+        p = self.__dict__.get('_parser')
+        if p is None:
+            p = self.__dict__['_parser'] = self.payload_codec.parser(self._message_type)
+        return p
 
     @property
     def message(self) -> Message[PT]:
@@ -81,6 +158,7 @@ class TypedMessager(Generic[PT], metaclass=ABCMeta):
 __all__ = [
     'Message',
     'TypedMessager',
+    'PayloadCodec',
     'BaseModel',
     'PT',
     'ST',
@@ -1,14 +1,47 @@
+import selectors
 import socket
 import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import count
+from threading import Lock
+from typing import Callable, Deque, Optional, Iterator, Tuple, List, Dict, Sequence
 
 from scapy.layers.inet import IP, UDP, ICMP
 
 from .interface import *
+from .metrics import *
+from .metrics import FRAGMENT_BUCKETS
 from .ip_utils import *
+from .packets import *
+from .bpf import *
+from .bpf import Instruction
+from .compression import *
+from .pacing import *
+from .pipeline import Pipeline, open_message
+from .reassembly import *
+from .reliability import *
+from .reliability import encode_ack, decode_ack, ack_key, ACK_EVERY, ACK_HEADER_SIZE, ACK_RANGES_MAX, RANGE_SIZE
+from .session import *
+from .session import Session, PUBLIC_KEY_SIZE, COUNTER_SIZE
+from .stream import *
+from .stream import Source, chunks, new_stream, stream_nonce
 from .utils import *
 
 
 def udp_wrap(target: str, data: bytes):
+    return option_udp(target, data, IPMessager.DUMMY_UDP, IPMessager.DUMMY_UDP)
+
+
+def icmp_wrap(target: str, data: bytes):
+    return option_icmp(target, data, ICMP_DEST_UNREACHABLE, ICMP_PORT_UNREACHABLE)
+
+
+def icmp_payload(target: str, data: bytes):
+    return frame_icmp(target, data, ICMP_ECHO_REQUEST)
+
+
+def scapy_udp_wrap(target: str, data: bytes):
     return bytes(
         IP(
             dst=target,
@@ -17,8 +50,7 @@ def udp_wrap(target: str, data: bytes):
     )
 
 
-def icmp_wrap(target: str, data: bytes):
-    time.sleep(0.5)
+def scapy_icmp_wrap(target: str, data: bytes):
     return bytes(
         IP(
             dst=target,
@@ -27,9 +59,15 @@ def icmp_wrap(target: str, data: bytes):
     )
 
 
-def icmp_payload(target: str, data: bytes):
-    time.sleep(0.5)
-    return bytes(IP(dst=target) / ICMP(type=8) / data)
+def scapy_icmp_payload(target: str, data: bytes):
+    data = bytes(data)
+    return bytes(
+        IP(dst=target) / ICMP(
+            type=8,
+            id=int.from_bytes(data[0:2], byteorder='big'),
+            seq=int.from_bytes(data[2:4], byteorder='big'),
+        ) / data[OPTION_HEADER_SIZE:]
+    )
 
 
 def ip_option(raw_bytes: bytes) -> bytes:
@@ -37,7 +75,27 @@ def ip_option(raw_bytes: bytes) -> bytes:
 
 
 def recover_icmp_payload(raw_bytes: bytes) -> bytes:
-    return raw_bytes[28:]
+    # The frame starts at the identifier of the ICMP header
+    return raw_bytes[IP_HEADER_SIZE + ICMP_HEADER_SIZE - OPTION_HEADER_SIZE:]
+
+
+def option_filter(raw_bytes: bytes) -> bool:
+    return (
+            len(raw_bytes) > IP_HEADER_SIZE + OPTION_HEADER_SIZE
+            and raw_bytes[0] & 0x0f > IP_HEADER_SIZE >> 2
+            and raw_bytes[IP_HEADER_SIZE] == TIMESTAMP_OPTION
+            and raw_bytes[IP_HEADER_SIZE + OPTION_HEADER_SIZE] & Protocol.PREFIX != 0
+    )
+
+
+def icmp_payload_filter(raw_bytes: bytes) -> bool:
+    offset = ((raw_bytes[0] & 0x0f) << 2) + ICMP_HEADER_SIZE - OPTION_HEADER_SIZE
+    return (
+            len(raw_bytes) > offset + OPTION_HEADER_SIZE
+            and raw_bytes[offset - OPTION_HEADER_SIZE] == ICMP_ECHO_REQUEST
+            and raw_bytes[offset] == TIMESTAMP_OPTION
+            and raw_bytes[offset + OPTION_HEADER_SIZE] & Protocol.PREFIX != 0
+    )
 
 
 PROTO_FUNC_MAP = {
@@ -46,12 +104,44 @@ PROTO_FUNC_MAP = {
     'ip-udp': udp_wrap,
 }
 
+# Reference builders, slow but obviously correct
+SCAPY_FUNC_MAP = {
+    'icmp-pl': scapy_icmp_payload,
+    'ip-icmp': scapy_icmp_wrap,
+    'ip-udp': scapy_udp_wrap,
+}
+
 PROTO_REVERSE_MAP = {
     'icmp-pl': recover_icmp_payload,
     'ip-icmp': ip_option,
     'ip-udp': ip_option,
 }
 
+PROTO_FILTER_MAP = {
+    'icmp-pl': icmp_payload_filter,
+    'ip-icmp': option_filter,
+    'ip-udp': option_filter,
+}
+
+PROTO_BPF_MAP = {
+    'icmp-pl': payload_program,
+    'ip-icmp': option_program,
+    'ip-udp': option_program,
+}
+
+# Default pacing per carrier, ICMP carriers used to sleep 0.5 seconds per packet
+PROTO_PACER_MAP = {
+    'icmp-pl': lambda: Pacer(packets_per_second=2),
+    'ip-icmp': lambda: Pacer(packets_per_second=2),
+    'ip-udp': lambda: Pacer(),
+}
+
+# Carriers embedding the frames in the IP options, limited to OPTION_MAX bytes per packet
+OPTION_CARRIERS = {'ip-icmp', 'ip-udp'}
+
+# Carriers sending payload frames sized to the path MTU, see Shifter
+PAYLOAD_CARRIERS = {'icmp-pl'}
+
 PROTO_MAP = {
     'icmp-pl': socket.IPPROTO_ICMP,
     'ip-icmp': socket.IPPROTO_ICMP,
@@ -59,9 +149,57 @@ PROTO_MAP = {
 }
 
 
+class Carrier:
+    """
+    Framing, pacing and measured send rate of a carrier
+
+    Messagers striping messages over several carriers weigh the share of every carrier by the
+    packets per second it managed to send, see ``measure``.
+    """
+    __slots__ = ['name', 'protocol', 'payload', 'wrap', 'reverse', 'accept', 'pacer', 'measured']
+    SMOOTHING = .25
+    UNPACED = 100000  # Packets per second assumed for an unpaced carrier before it sent anything
+
+    def __init__(self, name: str, pacer: Optional[Pacer] = None):
+        self.name = name
+        self.protocol = PROTO_MAP[name]
+        self.payload = name in PAYLOAD_CARRIERS
+        self.wrap = PROTO_FUNC_MAP[name]
+        self.reverse = PROTO_REVERSE_MAP[name]
+        self.accept = PROTO_FILTER_MAP[name]
+        self.pacer = pacer if pacer is not None else PROTO_PACER_MAP[name]()
+        self.measured: Optional[float] = None
+
+    def weight(self, size: int) -> float:
+        """
+        Data bytes per second expected with the given bytes per packet, from the pacer until measured
+        """
+        if self.measured is not None:
+            return self.measured * size
+        rates = [Carrier.UNPACED]
+        if self.pacer.packets is not None:
+            rates.append(self.pacer.packets.rate)
+        if self.pacer.bytes is not None:
+            rates.append(self.pacer.bytes.rate / size)
+        return min(rates) * size
+
+    def measure(self, packets: int, elapsed: float):
+        """
+        Smooths the send rate of a run of packets, the first one went out right away
+        """
+        if packets < 2 or elapsed <= 0:
+            return
+        sample = (packets - 1) / elapsed
+        if self.measured is None:
+            self.measured = sample
+        else:
+            self.measured += Carrier.SMOOTHING * (sample - self.measured)
+
+
 class IPMessager(TypedMessager, Generic[PT]):
     DUMMY_UDP = 1021
     CLEAN_TIME = 5
+    RECEIVE_BATCH = 16
 
     def __init__(
             self,
@@ -69,64 +207,753 @@ class IPMessager(TypedMessager, Generic[PT]):
             secret: bytes,
             bpo: int,
             protocol: str = 'icmp-pl',
+            kernel_filter: bool = False,
+            pacer: Optional[Pacer] = None,
+            sndbuf: Optional[int] = None,
+            socket_per_thread: bool = False,
+            sequenced: Optional[bool] = None,
+            max_transactions: int = Reassembler.MAX_TRANSACTIONS,
+            max_buffered: int = Reassembler.MAX_BYTES,
+            sessions: bool = False,
+            session_lifetime: float = SessionTable.LIFETIME,
+            implicit_nonce: bool = False,
+            compression: bool = False,
+            dictionary: Optional[bytes] = None,
+            payload_codec: Optional[PayloadCodec] = None,
+            lazy: bool = False,
+            mtu: Optional[int] = None,
+            reliable: bool = False,
+            window: int = Retransmitter.WINDOW,
+            ack_every: int = ACK_EVERY,
+            stripes: Optional[Sequence[str]] = None,
+            pacers: Optional[Dict[str, Pacer]] = None,
+            streams: Optional[Callable[[Tuple[str, int], int, bytes], StreamSink]] = None,
+            stream_window: int = StreamTable.WINDOW,
     ):
+        """
+        Messages are sequenced unless told otherwise, except over option carriers with more than
+        ``SEQUENCED_BPO_MAX`` bytes per option as the sequence word would not fit into the option.
+
+        Implicit nonces leave the nonce fragments out of session messages and derive the nonce from
+        the message counter instead, which needs both sessions and sequenced framing. All peers share
+        the static secret and count on their own, so it always uses random nonces.
+
+        Compression uses the preset dictionary if one is given, see ``compression.train``. Compressed
+        messages are decoded regardless of the setting but the dictionary has to match the sender's.
+
+        Payloads are JSON unless another codec is given, ``BINARY`` also reads JSON payloads. Lazy
+        messagers hand out received messages with the payload still encoded, see ``Message``.
+
+        Payload carriers ignore ``bpo`` and fill every packet up to the MTU of the route to the peer,
+        or the given one.
+
+        Reliable messagers acknowledge the fragments they receive and retransmit the fragments of
+        their own messages that were lost. The fragments in flight per peer are limited by a
+        congestion window of at most ``window`` fragments, see ``Path``. Both sides have to enable
+        it and ``window`` should be larger than the peer's ``ack_every``.
+
+        Striping messagers spread every message over all the given carriers at once, each carrier
+        takes a share in proportion to the data it was measured to send per second. Handshakes still
+        go over ``protocol`` and the messager receives on all of them. Carriers other than
+        ``protocol`` are paced with the ones given in ``pacers`` or their defaults.
+
+        Messagers given a stream opener receive streams, see ``stream``. It is called with the peer,
+        the sender and the stream id for every new stream and gives the sink the stream is written
+        to. At most ``stream_window`` chunks that arrived ahead of the next one are held per stream.
+        """
+        if protocol not in PAYLOAD_CARRIERS and bpo > LENGTH_MASK:
+            raise ValueError(f"At most {LENGTH_MASK} bytes per option")
+        if sequenced is None:
+            sequenced = not (protocol in OPTION_CARRIERS and bpo > SEQUENCED_BPO_MAX)
+        if sequenced and protocol in OPTION_CARRIERS and bpo > SEQUENCED_BPO_MAX:
+            raise ValueError(f"Sequenced {protocol} messages allow at most {SEQUENCED_BPO_MAX} bytes per option")
+        if implicit_nonce and not (sessions and sequenced):
+            raise ValueError("Implicit nonces need sessions and sequenced framing")
+        if reliable and not sequenced:
+            raise ValueError("Reliable delivery needs sequenced framing")
+        if stripes is not None and not stripes:
+            raise ValueError("Striping needs carriers")
+        if stripes is not None and not sequenced:
+            raise ValueError("Striping needs sequenced framing")
+        if stripes is not None and reliable:
+            raise ValueError("Striping does not support reliable delivery")
+        if any(p in OPTION_CARRIERS for p in stripes or ()) and bpo > SEQUENCED_BPO_MAX:
+            raise ValueError(f"Sequenced option carriers allow at most {SEQUENCED_BPO_MAX} bytes per option")
         self.id = _id
         self.secret = secret
         self.bpo = bpo
+        self.mtu = mtu
+        self.payload = protocol in PAYLOAD_CARRIERS
+        self.sequenced = sequenced
+        self.implicit_nonce = implicit_nonce
+        self.counters: Dict[str, Iterator[int]] = dict()
+        self.compressor = Compressor(compression, dictionary)
+        if payload_codec is not None:
+            self.payload_codec = payload_codec
+        self.lazy = lazy
         self.protocol = PROTO_MAP[protocol]
         self.wrap = PROTO_FUNC_MAP[protocol]
         self.reverse = PROTO_REVERSE_MAP[protocol]
-        self.data_cache = {}
+        self.accept = PROTO_FILTER_MAP[protocol]
+        self.pacer = pacer if pacer is not None else PROTO_PACER_MAP[protocol]()
+        self.carriers: Dict[str, Carrier] = {protocol: Carrier(protocol, self.pacer)}
+        for name in stripes or ():
+            if name not in self.carriers:
+                self.carriers[name] = Carrier(name, (pacers or {}).get(name))
+        self.stripes = [self.carriers[name] for name in stripes] if stripes is not None else None
+        self.striper = ThreadPoolExecutor(len(self.stripes), 'stripe') if self.stripes is not None else None
+        # Received packets are matched against the carriers of their IP protocol
+        self.demux: Dict[int, List[Carrier]] = dict()
+        for c in self.carriers.values():
+            self.demux.setdefault(c.protocol, []).append(c)
+        # Kernel filters only fit sockets serving a single carrier
+        self.programs: Dict[int, Optional[List[Instruction]]] = {
+            p: PROTO_BPF_MAP[carriers[0].name]() if kernel_filter and len(carriers) == 1 else None
+            for p, carriers in self.demux.items()
+        }
+        self.sockets = SocketPool(per_thread=socket_per_thread, sndbuf=sndbuf)
+        self.send_lock = Lock()
+        self.reassembler = Reassembler(
+            _id,
+            timeout=IPMessager.CLEAN_TIME,
+            max_transactions=max_transactions,
+            max_bytes=max_buffered,
+        )
+        self.data_cache = self.reassembler.cache
+        self.sessions = SessionTable(_id, secret, lifetime=session_lifetime) if sessions else None
+        self.rejected = 0
+        self.replayed = 0
+        self.dropped = 0
+        self.invalid = 0
+        self.overflowed = 0
+        self.ack_every = ack_every
+        self.retransmitter = Retransmitter(self.emit, self.pacer, window) if reliable else None
+        self.ack_key = ack_key(secret) if reliable else None
+        self.incoming = StreamTable(streams, stream_window) if streams is not None else None
+        self.metrics = self.register(Registry({'id': str(_id)}))
+
+    def register(self, metrics: Registry) -> Registry:
+        """
+        Metrics of the messager, the counters kept elsewhere are read when collected
+        """
+        r = self.reassembler
+        self.sent_packets = metrics.counter('packets_sent', "Packets sent, retransmissions included")
+        self.received_packets = metrics.counter('packets_received', "Packets received")
+        metrics.counter('packets_rejected', "Received packets of no carrier", lambda: self.rejected)
+        metrics.counter('packets_overflowed', "Packets the kernel dropped on the socket", lambda: self.overflowed)
+        self.sent_fragments = metrics.histogram('fragments_sent', "Fragments per message sent", FRAGMENT_BUCKETS)
+        self.received_fragments = metrics.histogram(
+            'fragments_received',
+            "Fragments per message received",
+            FRAGMENT_BUCKETS,
+        )
+        self.send_time = metrics.histogram('send_seconds', "Seconds to send a message")
+        self.delivery_time = metrics.histogram('delivery_seconds', "Seconds until a message was acknowledged")
+        r.timing = metrics.histogram('reassembly_seconds', "Seconds from the first to the last fragment of a message")
+        self.unverified = metrics.counter('failed_verification', "Messages that failed to decrypt")
+        metrics.counter('invalid', "Messages that could not be opened, failed ones included", lambda: self.invalid)
+        metrics.counter('replayed', "Messages dropped as replays", lambda: self.replayed)
+        metrics.counter('dropped', "Messages dropped on a full receive queue", lambda: self.dropped)
+        metrics.counter('transactions_expired', "Incomplete messages that timed out", lambda: r.expired)
+        metrics.counter('transactions_evicted', "Incomplete messages evicted over the limits", lambda: r.evicted)
+        metrics.counter('fragments_duplicate', "Duplicate fragments received", lambda: r.duplicates)
+        metrics.gauge('transactions_cached', "Incomplete messages being reassembled", lambda: len(r.cache))
+        metrics.gauge('transactions_buffered_bytes', "Bytes of incomplete messages", lambda: r.buffered)
+        if self.retransmitter is not None:
+            t = self.retransmitter
+            metrics.counter('retransmitted', "Fragments retransmitted", lambda: t.retransmitted)
+            metrics.counter('delivered', "Messages acknowledged by the peer", lambda: t.delivered)
+            metrics.counter('delivery_failed', "Messages given up on", lambda: t.failed)
+        if self.incoming is not None:
+            i = self.incoming
+            metrics.counter('streams_completed', "Streams received completely", lambda: i.completed)
+            metrics.counter('streams_failed', "Streams aborted", lambda: i.failed)
+            metrics.counter('streams_stale', "Streams refused as too old", lambda: i.stale)
+        return metrics
+
+    def stats(self) -> Dict:
+        """
+        Current value of every metric by name, see ``metrics``
+        """
+        return self.metrics.stats()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        if self.retransmitter is not None:
+            self.retransmitter.close()
+        if self.striper is not None:
+            self.striper.shutdown()
+        if self.incoming is not None:
+            self.incoming.close()
+        self.metrics.close()
+        self.sockets.close()
+
+    def next_counter(self, target: str) -> int:
+        """
+        Counts messages per peer, the low byte is the serial of sequenced messages
+
+        Counting starts from the time in microseconds so that the counters of a restarted messager
+        are still newer than the ones the peer saw before, see ``SessionTable.replayed``.
+        """
+        c = self.counters.get(target)
+        if c is None:
+            c = self.counters.setdefault(target, count(time.time_ns() // 1000))
+        return next(c)
+
+    def frame_size(self, target: str, payload: Optional[bool] = None) -> int:
+        """
+        Data bytes per packet to the target, for the carrier of the messager unless told the framing
+        """
+        if not (self.payload if payload is None else payload):
+            return self.bpo
+        mtu = min(self.mtu if self.mtu is not None else path_mtu(target), PACKET_MAX)
+        overhead = IP_HEADER_SIZE + ICMP_HEADER_SIZE + CUSTOM_HEADER_SIZE + (SEQUENCE_SIZE if self.sequenced else 0)
+        return mtu - overhead
+
+    def frames(
+            self,
+            data: bytes,
+            target: str,
+            _type: int,
+            secret: Secret,
+            counter: Optional[int] = None,
+            session: Optional[Session] = None,
+            codec: int = Codec.NONE,
+    ) -> List[bytes]:
+        if counter is None:
+            counter = self.next_counter(target)
+        nonce = session.send_nonce(counter) if session is not None and self.implicit_nonce else None
+        # Now and then the nonce is sent along so that receivers that lost track of the counter catch up
+        explicit = counter % Session.RESYNC == 0
+        if self.stripes is not None and _type in (MessageType.DATA, MessageType.SESSION):
+            sizes = [self.frame_size(target, c.payload) for c in self.stripes]
+            stripes = Shifter.encode_stripes(
+                data,
+                self.id,
+                secret=secret,
+                stripes=[(c.weight(size), size, c.payload) for c, size in zip(self.stripes, sizes)],
+                serial=counter & 0xff,
+                _type=_type,
+                nonce=nonce,
+                codec=codec,
+                explicit=explicit,
+            )
+            packets = [c.wrap(target, part) for c, parts in zip(self.stripes, stripes) for part in parts]
+            self.sent_fragments.observe(len(packets))
+            return packets
+        packets = [
+            self.wrap(target, part)
+            for part in Shifter.encode_message(
+                data,
+                self.id,
+                bytes_per_option=self.frame_size(target),
+                secret=secret,
+                serial=counter & 0xff if self.sequenced else None,
+                _type=_type,
+                nonce=nonce,
+                codec=codec,
+                payload=self.payload,
+                explicit=explicit,
+            )
+        ]
+        self.sent_fragments.observe(len(packets))
+        return packets
+
+    def handshake(self, public: bytes, target: str, _type: int) -> List[bytes]:
+        """
+        Frames a handshake message, the public key is followed by the counter of the message itself
+        """
+        counter = self.next_counter(target)
+        data = public + counter.to_bytes(COUNTER_SIZE, byteorder='big')
+        return self.frames(data, target, _type, self.secret, counter)
+
+    def packets(self, m: Message[PT]) -> List[bytes]:
+        codec, data = self.compressor.compress(bytes(m), self.frame_size(m.target[0]))
+        if self.sessions is None:
+            return self.frames(data, m.target[0], MessageType.DATA, self.secret, codec=codec)
+        session = self.sessions.route(m.target[0])
+        if session is None:
+            raise ValueError("No session with peer")
+        return self.frames(data, m.target[0], MessageType.SESSION, session.cipher, session=session, codec=codec)
+
+    def outgoing(self, m: Message[PT]) -> List[Tuple[List[bytes], Tuple[str, int]]]:
+        """
+        Packets to send for a message
+
+        With sessions enabled and no session with the peer yet the message is queued and a handshake
+        request is sent instead.
+        """
+        if self.sessions is not None:
+            h, new = self.sessions.enqueue(m.target[0], m)
+            if h is not None:
+                if new:
+                    return [(
+                        self.handshake(public_bytes(h.key), m.target[0], MessageType.EC_PUB_REQ),
+                        m.target,
+                    )]
+                return []
+        return [(self.packets(m), m.target)]
+
+    def emit(self, packets: List[bytes], target: Tuple[str, int], protocol: Optional[int] = None):
+        with self.sockets.acquire(protocol if protocol is not None else self.protocol) as s:
+            for packet in packets:
+                s.sendto(packet, target)
+        self.sent_packets.inc(len(packets))
+
+    def carrier(self, raw_bytes: bytes) -> Optional[Carrier]:
+        """
+        Carrier of a packet, the IP protocol narrows it down to the carriers sharing a socket
+        """
+        for c in self.demux.get(raw_bytes[9], ()):
+            if c.accept(raw_bytes):
+                return c
+        return None
+
+    def send_over(self, carrier: Carrier, packets: List[bytes], target: Tuple[str, int]):
+        """
+        Sends packets paced by their carrier and measures the rate it managed
+        """
+        start = time.monotonic()
+        for batch in carrier.pacer.batches(packets):
+            self.emit(batch, target, carrier.protocol)
+        carrier.measure(len(packets), time.monotonic() - start)
+
+    def stripe(self, packets: List[bytes], target: Tuple[str, int]):
+        """
+        Sends the packets of every carrier in parallel
+        """
+        runs: Dict[str, List[bytes]] = dict()
+        for packet in packets:
+            runs.setdefault(self.carrier(packet).name, []).append(packet)
+        if len(runs) == 1:
+            name, run = runs.popitem()
+            self.send_over(self.carriers[name], run, target)
+            return
+        for f in [self.striper.submit(self.send_over, self.carriers[name], run, target) for name, run in runs.items()]:
+            f.result()
+
+    def transmit(self, packets: List[bytes], target: Tuple[str, int]) -> Optional[Delivery]:
+        """
+        Sends the packets of a message, reliable messagers hand them to the retransmitter instead
+        """
+        if self.retransmitter is not None:
+            return self.retransmitter.add(packets, target, Shifter.get_serial(self.reverse(packets[0])))
+        if self.stripes is not None:
+            self.stripe(packets, target)
+            return None
+        if self.sequenced:
+            for batch in self.pacer.batches(packets):
+                self.emit(batch, target)
+            return None
+        # Unsequenced fragments of concurrent messages would mix on the wire
+        with self.send_lock:
+            for batch in self.pacer.batches(packets):
+                self.emit(batch, target)
+        return None
 
     def send(self, m: Message[PT]):
-        with make_socket(self.protocol) as s:
-            for part in Shifter.encode_message(bytes(m), self.id, bytes_per_option=self.bpo, secret=self.secret):
-                s.sendto(self.wrap(m.target[0], part), m.target)
+        start = time.monotonic()
+        for packets, target in self.outgoing(m):
+            self.transmit(packets, target)
+        self.send_time.observe(time.monotonic() - start)
+
+    def path(self, peer: str) -> Optional[Path]:
+        """
+        Round trip time, congestion window and send rate towards a peer of a reliable messager
+        """
+        if self.retransmitter is None:
+            return None
+        return self.retransmitter.paths.get(peer)
+
+    def deliver(self, m: Message[PT], timeout: Optional[float] = None):
+        """
+        Sends a message and waits until the peer acknowledged all of it
+
+        A message waiting for a session handshake is sent once the handshake completes and only the
+        handshake is waited for. Raises TimeoutError if the peer did not acknowledge in time.
+        """
+        if self.retransmitter is None:
+            raise ValueError("Delivery needs a reliable messager")
+        start = time.monotonic()
+        for packets, target in self.outgoing(m):
+            if not self.transmit(packets, target).wait(timeout):
+                raise TimeoutError("Message not acknowledged")
+        self.delivery_time.observe(time.monotonic() - start)
+
+    def chunk_size(self, target: str) -> int:
+        """
+        Largest chunk of a stream that fits into a sequenced message to the target
+        """
+        size = self.frame_size(target)
+        if self.payload:
+            return size * SEQUENCE_MAX - NONCE_SIZE - TAG_SIZE
+        nonce_size = min(NONCE_SIZE, size)
+        return size * (SEQUENCE_MAX - Utils.parts(NONCE_SIZE, size=nonce_size)) - TAG_SIZE
+
+    def seal(self, data: bytes, target: str, key: Secret, nonce: bytes, counter: int) -> List[bytes]:
+        """
+        Packets of a single chunk of a stream
+        """
+        packets = [
+            self.wrap(target, part)
+            for part in Shifter.encode_sealed(
+                Shifter.seal(data, self.id, secret=key, nonce=nonce),
+                self.id,
+                nonce=nonce,
+                bytes_per_option=self.frame_size(target),
+                serial=counter & 0xff,
+                _type=MessageType.STREAM,
+                payload=self.payload,
+            )
+        ]
+        self.sent_fragments.observe(len(packets))
+        return packets
+
+    def stream_key(self, target: Tuple[str, int], chunk_size: Optional[int]) -> Tuple[Secret, int]:
+        """
+        Key and size of the chunks of a stream to the target
+        """
+        if not self.sequenced:
+            raise ValueError("Streams need sequenced framing")
+        if self.sessions is None:
+            key = self.secret
+        else:
+            session = self.sessions.route(target[0])
+            if session is None:
+                raise ValueError("No session with peer")
+            key = session.cipher
+        limit = self.chunk_size(target[0])
+        if chunk_size is None:
+            chunk_size = min(CHUNK_SIZE, limit)
+        elif not 0 < chunk_size <= limit:
+            raise ValueError(f"Chunks of at most {limit} bytes fit into a message")
+        return key, chunk_size
+
+    def stream(
+            self,
+            source: Source,
+            target: Tuple[str, int],
+            chunk_size: Optional[int] = None,
+            workers: int = 4,
+            timeout: Optional[float] = None,
+    ) -> bytes:
+        """
+        Sends a binary file or an iterable of bytes as a stream of chunks, returns the stream id
+
+        Every chunk is a message of its own, encrypted and framed by a pool of worker threads that
+        works at most two chunks per worker ahead of sending. Chunks are as large as fits into a
+        message up to ``CHUNK_SIZE`` unless told. Reliable messagers keep as many chunks waiting for
+        acknowledgement and return once the peer acknowledged all of them, or raise TimeoutError if
+        a chunk was not acknowledged in time.
+        """
+        key, chunk_size = self.stream_key(target, chunk_size)
+        stream = new_stream()
+        ahead: Deque[Future] = deque()
+        pending: Deque[Delivery] = deque()
+
+        def send(packets: List[bytes]):
+            delivery = self.transmit(packets, target)
+            if delivery is None:
+                return
+            pending.append(delivery)
+            if len(pending) > 2 * workers and not pending.popleft().wait(timeout):
+                raise TimeoutError("Chunk not acknowledged")
+
+        with ThreadPoolExecutor(workers, 'seal') as pool:
+            try:
+                for index, (data, last) in enumerate(chunks(source, chunk_size)):
+                    nonce = stream_nonce(stream, index, last)
+                    ahead.append(pool.submit(self.seal, data, target[0], key, nonce, self.next_counter(target[0])))
+                    if len(ahead) > 2 * workers:
+                        send(ahead.popleft().result())
+                while ahead:
+                    send(ahead.popleft().result())
+            finally:
+                for f in ahead:
+                    f.cancel()
+        while pending:
+            if not pending.popleft().wait(timeout):
+                raise TimeoutError("Chunk not acknowledged")
+        return stream
+
+    def dispatch(self, packets: List[bytes], target: Tuple[str, int]):
+        """
+        Sends packets from within the receive path
+        """
+        self.transmit(packets, target)
+
+    def exchange(self, _type: int, fragments: List[bytes], addr: Tuple[str, int]):
+        """
+        Handles a handshake message and flushes the messages that were waiting for it
+        """
+        peer = Shifter.get_id(fragments[0])
+        data = Shifter.decode_message(fragments, secret=self.secret)
+        public = data[:PUBLIC_KEY_SIZE]
+        counter = int.from_bytes(data[PUBLIC_KEY_SIZE:PUBLIC_KEY_SIZE + COUNTER_SIZE], byteorder='big')
+        if self.sessions.replayed(addr[0], peer, counter):
+            self.replayed += 1
+            return
+        if _type == MessageType.EC_PUB_REQ:
+            reply, queue = self.sessions.respond(addr[0], peer, public, counter)
+            if reply is not None:
+                self.dispatch(self.handshake(reply, addr[0], MessageType.EC_CON_REQ), addr)
+        else:
+            queue = self.sessions.complete(addr[0], peer, public, counter)
+        for m in queue:
+            self.dispatch(self.packets(m), m.target)
 
     def clean(self):
-        rem = list()
-        for k, v in self.data_cache.items():
-            if time.time() - v[1] > IPMessager.CLEAN_TIME:
-                rem.append(k)
-        for k in rem:
-            self.data_cache.pop(k)
-
-    def receive(self, callback: Callable[[Message[PT]], NoReturn]):
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as dummy:
+        self.reassembler.expire()
+
+    def handle(self, raw_bytes: memoryview, addr: Tuple[str, int]) -> Optional[Message[PT]]:
+        """
+        Processes a single received packet, returns the message if it completed one
+        """
+        fragments = self.collect(raw_bytes, addr)
+        if fragments is None:
+            return None
+        return self.decode(fragments, addr)
+
+    def collect(self, raw_bytes: memoryview, addr: Tuple[str, int]) -> Optional[List[bytes]]:
+        """
+        Reassembles a received packet, returns the fragments if it completed a message
+
+        Acknowledgements and handshakes are handled right away, what is returned only needs opening.
+        """
+        self.received_packets.inc()
+        carrier = self.carrier(raw_bytes)
+        if carrier is None:
+            self.rejected += 1
+            return None
+        option = carrier.reverse(raw_bytes)
+        if Shifter.get_type(option) == MessageType.ACK:
+            if self.retransmitter is not None:
+                peer, serial, ranges = decode_ack(option, self.ack_key)
+                if peer == self.id:
+                    self.retransmitter.acknowledge(addr[0], serial, ranges)
+            return None
+        fragments = self.reassembler.add(option, addr)
+        if self.retransmitter is not None and Shifter.is_sequenced(option):
+            self.acknowledge(option, addr)
+        if fragments is None:
+            return None
+        self.received_fragments.observe(len(fragments))
+        _type = Shifter.get_message_type(fragments)
+        if _type == MessageType.EC_PUB_REQ or _type == MessageType.EC_CON_REQ:
+            if self.sessions is not None:
+                self.exchange(_type, fragments, addr)
+            return None
+        if _type == MessageType.STREAM:
+            if self.incoming is not None:
+                self.chunk(fragments, addr)
+            return None
+        return fragments
+
+    def chunk(self, fragments: List[bytes], addr: Tuple[str, int]):
+        """
+        Verifies a chunk of a stream and writes it out, streams use the session key if there are sessions
+        """
+        sender = Shifter.get_id(fragments[0])
+        key = self.secret
+        if self.sessions is not None:
+            session = self.sessions.get(addr[0], sender)
+            if session is None:
+                self.invalid += 1
+                return
+            key = session.key
+        try:
+            data = Shifter.decode_message(fragments, secret=key)
+        except VerificationError:
+            self.invalid += 1
+            self.unverified.inc()
+            return
+        self.incoming.add(addr, sender, Shifter.get_nonce(fragments), data)
+
+    def keys(
+            self,
+            fragments: List[bytes],
+            addr: Tuple[str, int],
+    ) -> Optional[Tuple[bytes, Optional[bytes], Optional[Session], int]]:
+        """
+        Key and nonce to open a message with, no nonce if it is part of the message
+
+        Messages with nonces derived from the counter also give the session and the counter that is
+        accepted once the message authenticated, see ``opened``. Replays give None.
+        """
+        if Shifter.get_message_type(fragments) != MessageType.SESSION:
+            return self.secret, None, None, -1
+        session = self.sessions.get(addr[0], Shifter.get_id(fragments[0])) if self.sessions is not None else None
+        if session is None:
+            raise ValueError("No session with peer")
+        if Shifter.has_nonce(fragments):
+            counter = session.counter(Shifter.get_nonce(fragments))
+            if counter is None:
+                return session.key, None, None, -1
+            if not session.fresh(counter):
+                self.replayed += 1
+                return None
+            return session.key, None, session, counter
+        counter = session.expand(Shifter.get_serial(fragments[0]))
+        if not session.fresh(counter):
+            self.replayed += 1
+            return None
+        return session.key, session.receive_nonce(counter), session, counter
+
+    def decode(self, fragments: List[bytes], addr: Tuple[str, int]) -> Optional[Message[PT]]:
+        """
+        Opens a reassembled message, messages that fail to verify are counted and dropped
+        """
+        keys = self.keys(fragments, addr)
+        if keys is None:
+            return None
+        key, nonce, session, counter = keys
+        try:
+            data, _ = open_message(fragments, key, nonce, self.compressor)
+        except VerificationError:
+            self.invalid += 1
+            self.unverified.inc()
+            return None
+        return self.opened(data, addr, session, counter)
+
+    def opened(
+            self,
+            data: bytes,
+            addr: Tuple[str, int],
+            session: Optional[Session] = None,
+            counter: int = -1,
+            payload: Optional[PT] = None,
+    ) -> Optional[Message[PT]]:
+        """
+        Message for an opened payload, parsed already if the payload is given
+        """
+        if session is not None:
+            # Copies of a message may be opened concurrently, only the first one gets through
+            with self.sessions.lock:
+                if not session.fresh(counter):
+                    self.replayed += 1
+                    return None
+                session.accept(counter)
+        if payload is None:
+            m = self.message[data]
+        else:
+            m = self.message[payload]
+            m.raw = data
+        m.target = addr
+        return m
+
+    def acknowledge(self, option: memoryview, addr: Tuple[str, int]):
+        ranges = self.reassembler.acknowledgement(option, addr, self.ack_every)
+        if ranges is None:
+            return
+        frame = encode_ack(
+            self.id,
+            Shifter.get_id(option),
+            Shifter.get_serial(option),
+            ranges[:(self.frame_size(addr[0]) - ACK_HEADER_SIZE) // RANGE_SIZE if self.payload else ACK_RANGES_MAX],
+            self.ack_key,
+            payload=self.payload,
+        )
+        self.retransmitter.reply(self.wrap(addr[0], frame), addr)
+
+    def read(self, s: socket.socket, pool: BufferPool) -> Iterator[Tuple[memoryview, Tuple[str, int]]]:
+        """
+        Blocks for the first packet and then drains whatever else is ready into the pool
+        """
+        count = 0
+        for view in pool.views:
+            try:
+                n, ancillary, _, addr = s.recvmsg_into([view], ANCILLARY_SIZE, socket.MSG_DONTWAIT if count else 0)
+            except BlockingIOError:
+                break
+            if ancillary:
+                dropped = overflow(ancillary)
+                if dropped is not None:
+                    self.overflowed = dropped
+            pool.sizes[count] = n
+            pool.addresses[count] = addr
+            count += 1
+        for i in range(count):
+            yield pool.views[i][:pool.sizes[i]], pool.addresses[i]
+
+    def consume(
+            self,
+            s: socket.socket,
+            pool: BufferPool,
+            callback: Callable[[Message[PT]], NoReturn],
+            pipeline: Optional[Pipeline] = None,
+    ):
+        """
+        Handles a batch of packets from the socket, opening the messages right away or in the pipeline
+
+        Packets that can not be opened are counted as ``invalid`` and do not stop the receiver.
+        """
+        for raw_bytes, addr in self.read(s, pool):
+            if pipeline is None:
+                try:
+                    m = self.handle(raw_bytes, addr)
+                except ValueError:
+                    self.invalid += 1
+                    continue
+                if m is not None:
+                    callback(m)
+                continue
             try:
-                if self.protocol == socket.IPPROTO_UDP:
-                    dummy.bind(('0.0.0.0', IPMessager.DUMMY_UDP))
-            except:
-                pass
-            cleaned_at = time.time()
-            with make_socket(self.protocol) as s:
-                while True:
-                    _raw_bytes, _, _, addr = s.recvmsg(PACKET_MAX)
+                fragments = self.collect(raw_bytes, addr)
+            except ValueError:
+                self.invalid += 1
+                continue
+            if fragments is not None:
+                pipeline.submit(fragments, addr)
+
+    def receive(
+            self,
+            callback: Callable[[Message[PT]], NoReturn],
+            workers: int = 0,
+            processes: bool = False,
+            queue_size: int = Pipeline.QUEUE_SIZE,
+            block: bool = False,
+    ):
+        """
+        Hands every received message to the callback, forever
+
+        Without workers everything runs on the calling thread. With workers the calling thread only
+        reads and reassembles while a pool of threads, or processes, opens the messages and another
+        thread runs the callback, see ``Pipeline``. Messages that do not fit in the queue between
+        them are counted as ``dropped`` unless the reader blocks for room. Packets the kernel dropped
+        because the socket buffer was full are counted as ``overflowed``.
+        """
+        pipeline = Pipeline(self, callback, workers, processes, queue_size, block) if workers else None
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as dummy:
+                try:
+                    if socket.IPPROTO_UDP in self.demux:
+                        dummy.bind(('0.0.0.0', IPMessager.DUMMY_UDP))
+                except:
+                    pass
+                pool = BufferPool(IPMessager.RECEIVE_BATCH)
+                with selectors.DefaultSelector() as selector:
+                    # One socket per protocol, striping messagers listen to all of their carriers
+                    for protocol, program in self.programs.items():
+                        s = make_socket(protocol)
+                        if program is not None:
+                            attach(s, program)
+                        report_overflow(s)
+                        selector.register(s, selectors.EVENT_READ)
                     try:
-                        ts = self.reverse(_raw_bytes)
-                        tid = (Shifter.get_id(ts), *addr)
-                        if Shifter.is_start(ts):
-                            sender = Shifter.get_id(ts)
-                            if sender != self.id:
-                                self.data_cache[tid] = [ts], time.time()
-                        elif tid in self.data_cache:
-                            d = self.data_cache.pop(tid)[0]
-                            d.append(ts)
-                            self.data_cache[tid] = d, time.time()
-                            if Shifter.is_end(ts):
-                                d = Shifter.decode_message(
-                                    self.data_cache.pop(tid)[0],
-                                    secret=self.secret
-                                ).rstrip(b'\x00')
-                                m = self.message[d]
-                                m.target = addr
-                                callback(m)
-                        if time.time() - cleaned_at > IPMessager.CLEAN_TIME:
-                            self.clean()
-                            cleaned_at = time.time()
-                    except Exception as e:
-                        raise e
-                        pass
-
-
-__all__ = ['IPMessager']
+                        while True:
+                            for key, _ in selector.select():
+                                self.consume(key.fileobj, pool, callback, pipeline)
+                    finally:
+                        for key in list(selector.get_map().values()):
+                            key.fileobj.close()
+        finally:
+            if pipeline is not None:
+                pipeline.close()
+
+
+__all__ = ['IPMessager', 'Carrier']
@@ -1,9 +1,27 @@
+import os
 import struct
-from typing import List, Tuple, Literal
+from functools import lru_cache
+from itertools import accumulate
+from typing import List, Tuple, Literal, Optional, Union
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
 
 TIMESTAMP_SIZE = 4
+TIMESTAMP_OPTION = 0x44  # Copy 0 | Class 2 | Number 4 (RFC 791)
 CUSTOM_HEADER_SIZE = 4
 OPTION_HEADER_SIZE = 4
+SEQUENCE_SIZE = 4
+NONCE_SIZE = 12
+TAG_SIZE = 16
+LENGTH_MASK = 0x3f  # Data length, the top two bits of the byte carry the codec
+CODEC_POSITION = 6
+SEQUENCE_MAX = 0xfff  # Fragments in a sequenced message
+OPTION_MAX = 40
+
+_PRELUDE = struct.Struct('!BBBB')
+_WORD = struct.Struct('!I')
+SEQUENCED_BPO_MAX = OPTION_MAX - OPTION_HEADER_SIZE - CUSTOM_HEADER_SIZE - SEQUENCE_SIZE
 BPO = Literal[
     4,
     8,
@@ -20,6 +38,7 @@ BPO = Literal[
 class Protocol:
     PREFIX: int = 0x1 << 7  # Custom timestamp flag (RFC 791)
     TRANSMISSION: int = 0x1 << 6  # Transmission 1 | Message 0
+    SEQUENCE: int = 0x1 << 3  # Sequence word follows the header
     TYPE_POSITION = 24
     ID_POSITION = 8
 
@@ -31,66 +50,207 @@ class Status:
 
 class MessageType:
     """
-    0 - 15
+    0 - 7
     """
     DATA: int = 1  # 0001
     ENCRYPTION: int = 2  # 0010
-    EC_PUB_REQ: int = 4  # 0110
-    EC_CON_REQ: int = 4  # 1010
+    SESSION: int = 3  # 0011 Data encrypted with a session key
+    EC_PUB_REQ: int = 4  # 0100
+    EC_CON_REQ: int = 5  # 0101
+    ACK: int = 6  # 0110 Fragments received, see reliability
+    STREAM: int = 7  # 0111 Chunk of a stream, see stream
+
+
+Secret = Union[bytes, ChaCha20Poly1305]
+
+
+class VerificationError(ValueError):
+    """
+    Message that failed to authenticate, a wrong key or forged or corrupted fragments
+    """
+
+
+@lru_cache(maxsize=64)
+def _cipher(secret: bytes) -> ChaCha20Poly1305:
+    return ChaCha20Poly1305(secret)
+
+
+def cipher(secret: Secret) -> ChaCha20Poly1305:
+    """
+    Ready cipher context for a key, contexts are cached per key
+    """
+    if isinstance(secret, ChaCha20Poly1305):
+        return secret
+    return _cipher(secret)
 
 
 class Utils:
 
     @staticmethod
-    def to_option(header: bytes, data: bytes) -> bytes:
-        length = struct.pack("!B", CUSTOM_HEADER_SIZE + len(data) + OPTION_HEADER_SIZE)
-        pointer = struct.pack("!B", CUSTOM_HEADER_SIZE + len(data) + OPTION_HEADER_SIZE + 1)
-        return b'\x44' + length + pointer + b'\x03' + header + data
+    def option_size(size: BPO, sequenced: bool) -> int:
+        return OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE + (SEQUENCE_SIZE if sequenced else 0) + size
 
     @staticmethod
     def to_data(option: bytes) -> Tuple[bytes, bytes]:
         header = option[OPTION_HEADER_SIZE:OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE]
-        data_length = int.from_bytes(header[3:], byteorder='big', signed=False)
-        data = option[OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE:OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE + data_length]
+        data_length = header[3] & LENGTH_MASK
+        start = OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE
+        if header[0] & Protocol.SEQUENCE:
+            start += SEQUENCE_SIZE
+        data = option[start:start + data_length]
         return header, data
 
     @staticmethod
-    def split(data: bytes, /, size: BPO) -> List[bytes]:
-        rem = len(data) % size
-        if rem != 0:
-            data = data + (size - rem) * b'\x00'
-        return [data[i:i + size] for i in range(0, len(data), size)]
-
-    @staticmethod
-    def set_start_end(data: List[bytes], /) -> List[bytes]:
-        data[0] = data[0][:OPTION_HEADER_SIZE] + (
-                (data[0][OPTION_HEADER_SIZE] | Status.START) ^ Protocol.TRANSMISSION
-        ).to_bytes(1, byteorder='big', signed=False) + data[0][OPTION_HEADER_SIZE + 1:]
-        data[-1] = data[-1][:OPTION_HEADER_SIZE] + (
-                (data[-1][OPTION_HEADER_SIZE] | Status.END) ^ Protocol.TRANSMISSION
-        ).to_bytes(1, byteorder='big', signed=False) + data[-1][OPTION_HEADER_SIZE + 1:]
+    def set_start_end(data: List[memoryview], /) -> List[memoryview]:
+        data[0][OPTION_HEADER_SIZE] = (data[0][OPTION_HEADER_SIZE] | Status.START) ^ Protocol.TRANSMISSION
+        data[-1][OPTION_HEADER_SIZE] = (data[-1][OPTION_HEADER_SIZE] | Status.END) ^ Protocol.TRANSMISSION
         return data
 
     @staticmethod
     def decode(data: List[bytes]) -> bytes:
-        return b''.join(Utils.to_data(e)[1] for e in data)
+        """
+        Data of the options or payload frames in order, striped messages mix both
+        """
+        start = OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE
+        return b''.join([
+            (e[start + SEQUENCE_SIZE:] if e[OPTION_HEADER_SIZE] & Protocol.SEQUENCE else e[start:])
+            if e[1] == 0 else
+            e[start:start + (e[start - 1] & LENGTH_MASK)]
+            if not e[OPTION_HEADER_SIZE] & Protocol.SEQUENCE else
+            e[start + SEQUENCE_SIZE:start + SEQUENCE_SIZE + (e[start - 1] & LENGTH_MASK)]
+            for e in data
+        ])
 
     @staticmethod
-    def encode(data: bytes, /, _type: int, _id: int, size: BPO) -> List[bytes]:
-        pre = (
-                ((Protocol.PREFIX | Protocol.TRANSMISSION | _type) << 24) | (_id << 8) | (size & 0xff)
-        ).to_bytes(4, byteorder='big', signed=False)
-        return [Utils.to_option(pre, part) for part in Utils.split(data, size=size)]
+    def encode_into(
+            buffer: bytearray,
+            offset: int,
+            data: bytes,
+            /,
+            _type: int,
+            _id: int,
+            size: BPO,
+            sequence: Optional[Tuple[int, int, int]] = None,
+            codec: int = 0,
+    ) -> int:
+        """
+        Writes the options for the data into the zeroed buffer from the offset on, returns the end
+
+        Sequence is the message serial, the index of the first part and the total amount of parts.
+        The length in the header is the amount of data in the option, the last one is padded.
+
+        Every byte position of the options is filled with a single strided slice assignment across
+        all options, so the work done in Python depends on the option size and not on the amount of
+        options.
+        """
+        count = Utils.parts(len(data), size=size)
+        if count == 0:
+            return offset
+        if sequence is not None:
+            _type |= Protocol.SEQUENCE
+        option_size = Utils.option_size(size, sequence is not None)
+        start = option_size - size
+        end = offset + count * option_size
+        pre = ((Protocol.PREFIX | Protocol.TRANSMISSION | _type) << 24) | (_id << 8) | (codec << CODEC_POSITION)
+        header = _PRELUDE.pack(TIMESTAMP_OPTION, option_size, option_size + 1, 0x03) + _WORD.pack(pre | size)
+        if sequence is not None:
+            serial, first, total = sequence
+            header += _WORD.pack(((serial & 0xff) << 24) | total)
+        for i, b in enumerate(header):
+            buffer[offset + i:end:option_size] = bytes((b,)) * count
+        if sequence is not None:
+            # The index spans the middle two bytes of the sequence word
+            index = range(first, first + count)
+            at = OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE
+            buffer[offset + at + 1:end:option_size] = bytes(i >> 4 for i in index)
+            buffer[offset + at + 2:end:option_size] = bytes((i & 0x0f) << 4 | total >> 8 for i in index)
+        full = len(data) // size
+        for i in range(size):
+            buffer[offset + start + i:offset + full * option_size:option_size] = data[i:full * size:size]
+        last = offset + (count - 1) * option_size
+        rest = len(data) - (count - 1) * size
+        if rest < size:
+            buffer[last + start:last + start + rest] = data[full * size:]
+        buffer[last + OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE - 1] = (codec << CODEC_POSITION) | rest
+        return end
+
+    @staticmethod
+    def encode_frames(
+            data: bytes,
+            /,
+            _type: int,
+            _id: int,
+            size: int,
+            sequence: Optional[Tuple[int, int, int]] = None,
+            codec: int = 0,
+            nonce_size: int = 0,
+    ) -> List[memoryview]:
+        """
+        Payload frames for the data in a single buffer, see ``Shifter``
+
+        Frames are not padded, the length field of the first one tells how many bytes of it are the
+        nonce leading the data.
+        """
+        if sequence is not None:
+            _type |= Protocol.SEQUENCE
+        start = OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE + (SEQUENCE_SIZE if sequence is not None else 0)
+        count = Utils.parts(len(data), size=size)
+        buffer = bytearray(count * start + len(data))
+        pre = ((Protocol.PREFIX | Protocol.TRANSMISSION | _type) << 24) | (_id << 8) | (codec << CODEC_POSITION)
+        source = memoryview(data)
+        offset = 0
+        frames = []
+        for i in range(count):
+            part = source[i * size:(i + 1) * size]
+            _PRELUDE.pack_into(buffer, offset, TIMESTAMP_OPTION, 0, 0, 0)
+            _WORD.pack_into(buffer, offset + OPTION_HEADER_SIZE, pre | (nonce_size if i == 0 else 0))
+            if sequence is not None:
+                serial, first, total = sequence
+                word = ((serial & 0xff) << 24) | ((first + i) << 12) | total
+                _WORD.pack_into(buffer, offset + start - SEQUENCE_SIZE, word)
+            buffer[offset + start:offset + start + len(part)] = part
+            frames.append(offset)
+            offset += start + len(part)
+        view = memoryview(buffer)
+        return [view[o:e] for o, e in zip(frames, frames[1:] + [offset])]
+
+    @staticmethod
+    def to_sequence(serial: int, index: int, total: int) -> bytes:
+        return (
+                ((serial & 0xff) << 24) | (index << 12) | total
+        ).to_bytes(SEQUENCE_SIZE, byteorder='big', signed=False)
+
+    @staticmethod
+    def parts(length: int, /, size: BPO) -> int:
+        return (length + size - 1) // size
 
 
 class Shifter:
     """
     Message header packing:
 
-        | 0000 | 0000 | 0000 0000 0000 0000 | 0000 0000 |
-        | HEAD | TYPE |         ID          | DATA LEN  |
+        | 0000 | 0000 | 0000 0000 0000 0000 |  00   | 00 0000  |
+        | HEAD | TYPE |         ID          | CODEC | DATA LEN |
+
+    The codec tells how the payload was compressed before encryption, see ``compression.Codec``.
+
+    Carriers with room for whole packets of data use payload frames instead of options. They keep the
+    four prelude bytes with a zero option length, which the ``icmp-pl`` carrier sends as the ICMP
+    identifier and sequence fields, and are not padded as the data runs to the end of the frame. The
+    nonce leads the data of the first frame, its length field is the size of the nonce.
+
+    Sequenced messages set ``Protocol.SEQUENCE`` in the type and add a second word:
+
+        | 0000 0000 | 0000 0000 0000 | 0000 0000 0000 |
+        |  SERIAL   |     INDEX      |     TOTAL      |
+
+    The serial tells consecutive messages from the same sender apart.
     """
 
+    @staticmethod
+    def is_payload(option: bytes) -> bool:
+        return option[1] == 0
+
     @staticmethod
     def is_start(option: bytes) -> bool:
         return option[OPTION_HEADER_SIZE] & Status.START != 0
@@ -109,41 +269,289 @@ class Shifter:
 
     @staticmethod
     def get_type(option: bytes) -> int:
-        return option[OPTION_HEADER_SIZE] & 0x0f
+        return option[OPTION_HEADER_SIZE] & 0x07
+
+    @staticmethod
+    def is_sequenced(option: bytes) -> bool:
+        return option[OPTION_HEADER_SIZE] & Protocol.SEQUENCE != 0
+
+    @staticmethod
+    def get_serial(option: bytes) -> int:
+        return option[OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE]
+
+    @staticmethod
+    def get_index(option: bytes) -> int:
+        start = OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE
+        return (option[start + 1] << 4) | (option[start + 2] >> 4)
+
+    @staticmethod
+    def get_total(option: bytes) -> int:
+        start = OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE
+        return ((option[start + 2] & 0x0f) << 8) | option[start + 3]
+
+    @staticmethod
+    def get_codec(option: bytes) -> int:
+        return option[OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE - 1] >> CODEC_POSITION
+
+    @staticmethod
+    def get_message_type(data: List[bytes]) -> int:
+        """
+        Type of the payload in a complete message, the nonce comes first
+        """
+        return Shifter.get_type(data[-1])
+
+    @staticmethod
+    def seal(data: bytes, sender_id: int, /, secret: Secret, nonce: bytes) -> bytes:
+        """
+        Encrypts the data of a message, the sender is authenticated along with it
+        """
+        return cipher(secret).encrypt(nonce, data, (sender_id & 0xffff).to_bytes(4, byteorder='big', signed=False))
 
     @staticmethod
     def encode_message(
             data: bytes,
             sender_id: int,
             /,
-            secret: bytes,
+            secret: Secret,
             bytes_per_option: BPO = 16,
-    ) -> List[bytes]:
-        import os
-        from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+            serial: Optional[int] = None,
+            _type: int = MessageType.DATA,
+            nonce: Optional[bytes] = None,
+            codec: int = 0,
+            payload: bool = False,
+            explicit: bool = False,
+    ) -> List[memoryview]:
+        """
+        Giving a serial number for the message enables sequenced framing
+
+        Giving a nonce means both sides derive it on their own and it is left out of the message,
+        unless it is ``explicit``.
 
+        Payload frames carry up to ``bytes_per_option`` bytes of data each.
+        """
         _id = sender_id & 0xffff
 
-        nonce = os.urandom(12)
-        nonce_data = Utils.encode(nonce, _type=MessageType.ENCRYPTION, _id=_id, size=min([12, bytes_per_option]))
+        implicit = nonce is not None and not explicit
+        if nonce is None:
+            nonce = os.urandom(NONCE_SIZE)
+
+        raw_bytes = Shifter.seal(data, _id, secret=secret, nonce=nonce)
+        return Shifter.encode_sealed(
+            raw_bytes,
+            _id,
+            nonce=None if implicit else nonce,
+            bytes_per_option=bytes_per_option,
+            serial=serial,
+            _type=_type,
+            codec=codec,
+            payload=payload,
+        )
+
+    @staticmethod
+    def encode_sealed(
+            raw_bytes: bytes,
+            sender_id: int,
+            /,
+            nonce: Optional[bytes],
+            bytes_per_option: BPO = 16,
+            serial: Optional[int] = None,
+            _type: int = MessageType.DATA,
+            codec: int = 0,
+            payload: bool = False,
+    ) -> List[memoryview]:
+        """
+        Fragments of data encrypted already, led by the nonce unless it is None
+        """
+        _id = sender_id & 0xffff
 
-        cip = ChaCha20Poly1305(secret)
-        raw_bytes = cip.encrypt(nonce, data, _id.to_bytes(4, byteorder='big', signed=False))
-        encoded_data = Utils.encode(raw_bytes, _type=MessageType.DATA, _id=_id, size=bytes_per_option)
+        implicit = nonce is None
+        nonce_size = min([NONCE_SIZE, bytes_per_option])
 
-        return Utils.set_start_end(nonce_data + encoded_data)
+        if payload:
+            stream = raw_bytes if implicit else nonce + raw_bytes
+            total = Utils.parts(len(stream), size=bytes_per_option)
+            if serial is not None and total > SEQUENCE_MAX:
+                raise ValueError("Message too long for sequencing")
+            return Utils.set_start_end(Utils.encode_frames(
+                stream,
+                _type=_type,
+                _id=_id,
+                size=bytes_per_option,
+                sequence=(serial, 0, total) if serial is not None else None,
+                codec=codec,
+                nonce_size=0 if implicit else NONCE_SIZE,
+            ))
+
+        sequenced = serial is not None
+        nonce_parts = 0 if implicit else Utils.parts(len(nonce), size=nonce_size)
+        data_parts = Utils.parts(len(raw_bytes), size=bytes_per_option)
+        if sequenced:
+            total = nonce_parts + data_parts
+            if total > SEQUENCE_MAX:
+                raise ValueError("Message too long for sequencing")
+            nonce_sequence = serial, 0, total
+            data_sequence = serial, nonce_parts, total
+        else:
+            nonce_sequence = data_sequence = None
+
+        # All options of the message are written into a single buffer, packets get views into it
+        nonce_option = Utils.option_size(nonce_size, sequenced)
+        data_option = Utils.option_size(bytes_per_option, sequenced)
+        nonce_length = nonce_parts * nonce_option
+        buffer = bytearray(nonce_length + data_parts * data_option)
+        if not implicit:
+            Utils.encode_into(
+                buffer,
+                0,
+                nonce,
+                _type=MessageType.ENCRYPTION,
+                _id=_id,
+                size=nonce_size,
+                sequence=nonce_sequence,
+            )
+        Utils.encode_into(
+            buffer,
+            nonce_length,
+            raw_bytes,
+            _type=_type,
+            _id=_id,
+            size=bytes_per_option,
+            sequence=data_sequence,
+            codec=codec,
+        )
+
+        view = memoryview(buffer)
+        options = [view[i:i + nonce_option] for i in range(0, nonce_length, nonce_option)]
+        options += [view[i:i + data_option] for i in range(nonce_length, len(buffer), data_option)]
+        return Utils.set_start_end(options)
 
     @staticmethod
-    def decode_message(data: List[bytes], /, secret: bytes) -> bytes:
-        from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
-        from cryptography.exceptions import InvalidTag
+    def encode_stripes(
+            data: bytes,
+            sender_id: int,
+            /,
+            secret: Secret,
+            stripes: List[Tuple[float, int, bool]],
+            serial: int,
+            _type: int = MessageType.DATA,
+            nonce: Optional[bytes] = None,
+            codec: int = 0,
+            explicit: bool = False,
+    ) -> List[List[memoryview]]:
+        """
+        Sequenced message spread over several carriers, returns the fragments for every stripe
+
+        Every stripe is the weight of a carrier, its data bytes per fragment and whether it takes
+        payload frames. The encrypted data is split in proportion to the weights into consecutive
+        runs of fragments that share the indexes of the message, so the receiver reassembles them
+        no matter which carrier they came over. The nonce is a single option leading the first stripe
+        that has data, left out as in ``encode_message``.
+        """
+        _id = sender_id & 0xffff
+
+        implicit = nonce is not None and not explicit
+        if nonce is None:
+            nonce = os.urandom(NONCE_SIZE)
 
+        raw_bytes = Shifter.seal(data, _id, secret=secret, nonce=nonce)
+
+        weights = [max(weight, 0.) for weight, _, _ in stripes]
+        if sum(weights) == 0:
+            weights = [1.] * len(stripes)
+        bounds = [0]
+        for share in accumulate(weights):
+            bounds.append(round(len(raw_bytes) * share / sum(weights)))
+        bounds[-1] = len(raw_bytes)
+        counts = [Utils.parts(end - start, size=size) for start, end, (_, size, _) in zip(bounds, bounds[1:], stripes)]
+        nonce_parts = 0 if implicit else 1
+        total = nonce_parts + sum(counts)
+        if total > SEQUENCE_MAX:
+            raise ValueError("Message too long for sequencing")
+
+        parts = []
+        index = nonce_parts
+        for start, end, count, (_, size, payload) in zip(bounds, bounds[1:], counts, stripes):
+            if payload:
+                frames = Utils.encode_frames(
+                    raw_bytes[start:end],
+                    _type=_type,
+                    _id=_id,
+                    size=size,
+                    sequence=(serial, index, total),
+                    codec=codec,
+                )
+            else:
+                option = Utils.option_size(size, True)
+                buffer = bytearray(count * option)
+                Utils.encode_into(
+                    buffer,
+                    0,
+                    raw_bytes[start:end],
+                    _type=_type,
+                    _id=_id,
+                    size=size,
+                    sequence=(serial, index, total),
+                    codec=codec,
+                )
+                view = memoryview(buffer)
+                frames = [view[i:i + option] for i in range(0, len(buffer), option)]
+            parts.append(frames)
+            index += count
+
+        if not implicit:
+            buffer = bytearray(Utils.option_size(NONCE_SIZE, True))
+            Utils.encode_into(
+                buffer,
+                0,
+                nonce,
+                _type=MessageType.ENCRYPTION,
+                _id=_id,
+                size=NONCE_SIZE,
+                sequence=(serial, 0, total),
+            )
+            next(frames for frames in parts if frames).insert(0, memoryview(buffer))
+        Utils.set_start_end([frame for frames in parts for frame in frames])
+        return parts
+
+    @staticmethod
+    def has_nonce(data: List[bytes]) -> bool:
+        if Shifter.is_payload(data[0]):
+            return data[0][OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE - 1] & LENGTH_MASK != 0
+        return Shifter.get_type(data[0]) == MessageType.ENCRYPTION
+
+    @staticmethod
+    def get_nonce(data: List[bytes]) -> bytes:
+        """
+        Nonce leading a complete message, empty if it was left out
+        """
+        if Shifter.is_payload(data[0]):
+            count = data[0][OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE - 1] & LENGTH_MASK
+            return Utils.decode(data[:1])[:count]
+        count = 0
+        while count < len(data) and Shifter.get_type(data[count]) == MessageType.ENCRYPTION:
+            count += 1
+        return Utils.decode(data[:count])
+
+    @staticmethod
+    def decode_message(data: List[bytes], /, secret: Secret, nonce: Optional[bytes] = None) -> bytes:
         _id = Shifter.get_id(data[0])
-        nonce = Utils.decode([part for part in data if Shifter.get_type(part) == MessageType.ENCRYPTION])
-        data = Utils.decode([part for part in data if Shifter.get_type(part) == MessageType.DATA]).rstrip(b'\x00')
+        if Shifter.is_payload(data[0]):
+            # The nonce leads the data
+            stream = Utils.decode(data)
+            count = data[0][OPTION_HEADER_SIZE + CUSTOM_HEADER_SIZE - 1] & LENGTH_MASK
+            if nonce is None:
+                nonce = stream[:count]
+            data = stream[count:]
+        else:
+            # The nonce parts come first
+            count = 0
+            while count < len(data) and Shifter.get_type(data[count]) == MessageType.ENCRYPTION:
+                count += 1
+            if nonce is None:
+                nonce = Utils.decode(data[:count])
+            data = Utils.decode(data[count:])
 
-        cip = ChaCha20Poly1305(secret)
         try:
-            return cip.decrypt(nonce, data, _id.to_bytes(4, byteorder='big', signed=False))
+            return cipher(secret).decrypt(nonce, data, _id.to_bytes(4, byteorder='big', signed=False))
         except InvalidTag:
-            raise ValueError("Failed to verify")
+            raise VerificationError("Failed to verify")
@@ -0,0 +1,182 @@
+"""
+Runtime metrics of a messager
+
+    m.stats()['packets_received']
+    m.metrics.serve(9464)  # Prometheus text on http://127.0.0.1:9464/metrics
+
+Every messager keeps a registry of counters, gauges and histograms. Counters and histograms are
+plain numbers bumped on the hot path without locks like the other counters of the messager, so
+increments from several threads at once may now and then get lost. Counters and gauges can read a
+value kept elsewhere instead, like the size of the reassembly cache, which costs nothing until the
+metrics are collected.
+"""
+import bisect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+PREFIX = 'packet_buddy_'
+LATENCY_BUCKETS = (.0005, .001, .005, .01, .05, .1, .5, 1., 5.)
+FRAGMENT_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter:
+    __slots__ = ['name', 'description', 'value', 'read']
+
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str, read: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.description = description
+        self.value = 0
+        self.read = read
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+    def get(self) -> float:
+        return self.read() if self.read is not None else self.value
+
+
+class Gauge(Counter):
+    __slots__ = []
+
+    kind = 'gauge'
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Histogram:
+    """
+    Observations counted into buckets by their upper bound, the last bucket takes everything above
+    """
+    __slots__ = ['name', 'description', 'bounds', 'counts', 'sum', 'count']
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get(self) -> Dict[str, Union[float, Dict[float, int]]]:
+        """
+        Count, sum and the cumulative count of every bucket
+        """
+        buckets = dict()
+        total = 0
+        for bound, n in zip(self.bounds + (float('inf'),), self.counts):
+            total += n
+            buckets[bound] = total
+        return dict(count=self.count, sum=self.sum, buckets=buckets)
+
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """
+    Metrics of a messager by name, the labels are added to every metric when exposed
+    """
+
+    def __init__(self, labels: Optional[Dict[str, str]] = None):
+        self.metrics: Dict[str, Metric] = dict()
+        self.labels = labels or dict()
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    def add(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} exists")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str, read: Optional[Callable[[], float]] = None) -> Counter:
+        return self.add(Counter(name, description, read))
+
+    def gauge(self, name: str, description: str, read: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.add(Gauge(name, description, read))
+
+    def histogram(self, name: str, description: str, bounds: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.add(Histogram(name, description, bounds))
+
+    def stats(self) -> Dict[str, Union[float, Dict]]:
+        """
+        Current value of every metric, histograms give their count, sum and cumulative buckets
+        """
+        return {name: metric.get() for name, metric in self.metrics.items()}
+
+    def exposition(self) -> str:
+        """
+        Metrics in the Prometheus text format
+        """
+        labels = ','.join(f'{k}="{v}"' for k, v in self.labels.items())
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            name = PREFIX + metric.name
+            if metric.kind == 'counter':
+                name += '_total'
+            lines.append(f'# HELP {name} {metric.description}')
+            lines.append(f'# TYPE {name} {metric.kind}')
+            if metric.kind != 'histogram':
+                lines.append(f'{name}{{{labels}}} {_number(metric.get())}')
+                continue
+            values = metric.get()
+            for bound, n in values['buckets'].items():
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{name}_bucket{{{labels + "," if labels else ""}{le}}} {n}')
+            lines.append(f'{name}_sum{{{labels}}} {_number(values["sum"])}')
+            lines.append(f'{name}_count{{{labels}}} {values["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+        """
+        Serves the metrics over HTTP from a daemon thread, on localhost unless told otherwise
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.close()
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+        return self.server
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+__all__ = ['Registry', 'Counter', 'Gauge', 'Histogram']
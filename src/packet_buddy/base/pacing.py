@@ -0,0 +1,111 @@
+import asyncio
+import time
+from itertools import islice
+from threading import Lock
+from typing import List, Iterator, Optional, AsyncIterator
+
+from .utils import PACKET_MAX
+
+
+class TokenBucket:
+    __slots__ = ['rate', 'capacity', 'tokens', 'updated']
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        return max(0., (min(amount, self.capacity) - self.tokens) / self.rate)
+
+
+class Pacer:
+    """
+    Token bucket pacing for outgoing packets
+
+    Limits both packets and bytes per second, a limit of None disables that bucket. Packets are
+    handed out in batches of as many packets as the buckets allow at the moment and the pacer sleeps
+    only when nothing can be sent.
+    """
+
+    def __init__(
+            self,
+            packets_per_second: Optional[float] = None,
+            bytes_per_second: Optional[float] = None,
+            burst: int = 1,
+            burst_bytes: int = PACKET_MAX,
+    ):
+        self.packets = TokenBucket(packets_per_second, burst) if packets_per_second else None
+        self.bytes = TokenBucket(bytes_per_second, burst_bytes) if bytes_per_second else None
+        self.lock = Lock()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.packets is None and self.bytes is None
+
+    def take(self, packets: List[bytes], start: int = 0) -> int:
+        """
+        Consumes tokens for as many packets from the start index onwards as possible
+
+        Returns the number of packets that can be sent right away.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.packets is not None:
+                self.packets.refill(now)
+            if self.bytes is not None:
+                self.bytes.refill(now)
+            count = 0
+            for p in islice(packets, start, None):
+                size = min(len(p), self.bytes.capacity) if self.bytes is not None else 0
+                if self.packets is not None and self.packets.tokens < 1:
+                    break
+                if self.bytes is not None and self.bytes.tokens < size:
+                    break
+                if self.packets is not None:
+                    self.packets.tokens -= 1
+                if self.bytes is not None:
+                    self.bytes.tokens -= size
+                count += 1
+            return count
+
+    def delay(self, packet: bytes) -> float:
+        with self.lock:
+            return max(
+                self.packets.wait_time(1) if self.packets is not None else 0.,
+                self.bytes.wait_time(len(packet)) if self.bytes is not None else 0.,
+            )
+
+    def batches(self, packets: List[bytes]) -> Iterator[List[bytes]]:
+        if self.unlimited:
+            yield packets
+            return
+        i = 0
+        while i < len(packets):
+            count = self.take(packets, i)
+            if count == 0:
+                time.sleep(self.delay(packets[i]))
+            else:
+                yield packets[i:i + count]
+                i += count
+
+    async def abatches(self, packets: List[bytes]) -> AsyncIterator[List[bytes]]:
+        if self.unlimited:
+            yield packets
+            return
+        i = 0
+        while i < len(packets):
+            count = self.take(packets, i)
+            if count == 0:
+                await asyncio.sleep(self.delay(packets[i]))
+            else:
+                yield packets[i:i + count]
+                i += count
+
+
+__all__ = ['Pacer']
@@ -0,0 +1,187 @@
+"""
+Struct based IPv4/ICMP/UDP packet building
+
+The headers for a single target are precomputed once into a template together with the partial
+ones' complement sum of their constant fields. Building a packet only packs the fields that change
+per packet (length and checksum) and folds the variable part into the template sum (RFC 1624).
+
+The output is byte-identical to the scapy equivalents for the same target.
+"""
+import socket
+import struct
+from functools import lru_cache
+
+IP_HEADER_SIZE = 20
+ICMP_HEADER_SIZE = 8
+UDP_HEADER_SIZE = 8
+
+IP_VERSION = 4
+IP_TTL = 64
+IP_ID = 1  # scapy default
+
+ICMP_ECHO_REQUEST = 8
+ICMP_DEST_UNREACHABLE = 3
+ICMP_PORT_UNREACHABLE = 3
+
+IP_MTU = getattr(socket, 'IP_MTU', 14)  # Linux value, missing from older Pythons
+DEFAULT_MTU = 1500
+
+_IP = struct.Struct('!BBHHHBBH4s4s')
+_ICMP = struct.Struct('!BBHHH')
+_UDP = struct.Struct('!HHHH')
+_ICMP_TYPE = struct.Struct('!BBH')
+
+
+def ones_sum(data: bytes) -> int:
+    """
+    Ones' complement sum of the data as 16-bit big endian words
+
+    Uses the fact that 2^16 = 1 (mod 0xffff) to do the whole sum in a single big int operation.
+    """
+    if len(data) & 1:
+        data = bytes(data) + b'\x00'
+    value = int.from_bytes(data, byteorder='big', signed=False)
+    s = value % 0xffff
+    if s == 0 and value != 0:
+        return 0xffff
+    return s
+
+
+def fold(s: int) -> int:
+    while s >> 16:
+        s = (s & 0xffff) + (s >> 16)
+    return s
+
+
+def checksum(s: int) -> int:
+    return ~fold(s) & 0xffff
+
+
+@lru_cache(maxsize=256)
+def path_mtu(target: str) -> int:
+    """
+    MTU of the route to the target as known by the kernel, Ethernet's if it can not tell
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            s.connect((target, 9))
+            return s.getsockopt(socket.IPPROTO_IP, IP_MTU)
+        except OSError:
+            return DEFAULT_MTU
+
+
+@lru_cache(maxsize=256)
+def source_address(target: str) -> str:
+    """
+    Source address the kernel would route the target from
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            s.connect((target, 9))
+            return s.getsockname()[0]
+        except OSError:
+            return '0.0.0.0'
+
+
+class IPTemplate:
+    """
+    Precomputed IPv4 header for a single target and protocol
+    """
+    __slots__ = ['src', 'dst', 'protocol', 'partial']
+
+    def __init__(self, target: str, protocol: int):
+        self.src = socket.inet_aton(source_address(target))
+        self.dst = socket.inet_aton(target)
+        self.protocol = protocol
+        # Everything except version/ihl, total length and checksum
+        self.partial = ones_sum(_IP.pack(0, 0, 0, IP_ID, 0, IP_TTL, protocol, 0, self.src, self.dst))
+
+    def header(self, options: bytes, payload_length: int) -> bytes:
+        length = len(options)
+        ihl = (IP_HEADER_SIZE + length) >> 2
+        total = IP_HEADER_SIZE + length + payload_length
+        s = self.partial + (((IP_VERSION << 4) | ihl) << 8) + total
+        if length:
+            s += ones_sum(options)
+        return _IP.pack(
+            (IP_VERSION << 4) | ihl,
+            0,
+            total,
+            IP_ID,
+            0,
+            IP_TTL,
+            self.protocol,
+            checksum(s),
+            self.src,
+            self.dst,
+        ) + options
+
+    def pseudo_sum(self, length: int) -> int:
+        return ones_sum(self.src + self.dst) + self.protocol + length
+
+
+@lru_cache(maxsize=256)
+def ip_template(target: str, protocol: int) -> IPTemplate:
+    return IPTemplate(target, protocol)
+
+
+@lru_cache(maxsize=256)
+def udp_header(target: str, sport: int, dport: int) -> bytes:
+    """
+    Empty UDP datagram, constant for a target as the payload is carried in the IP options
+    """
+    t = ip_template(target, socket.IPPROTO_UDP)
+    s = t.pseudo_sum(UDP_HEADER_SIZE) + sport + dport + UDP_HEADER_SIZE
+    return _UDP.pack(sport, dport, UDP_HEADER_SIZE, checksum(s) or 0xffff)
+
+
+@lru_cache(maxsize=16)
+def icmp_header(_type: int, code: int) -> bytes:
+    """
+    Empty ICMP message, constant as the payload is carried in the IP options
+    """
+    return _ICMP.pack(_type, code, checksum((_type << 8) | code), 0, 0)
+
+
+def option_udp(target: str, options: bytes, sport: int, dport: int) -> bytes:
+    return ip_template(target, socket.IPPROTO_UDP).header(options, UDP_HEADER_SIZE) + udp_header(target, sport, dport)
+
+
+def option_icmp(target: str, options: bytes, _type: int, code: int) -> bytes:
+    return ip_template(target, socket.IPPROTO_ICMP).header(options, ICMP_HEADER_SIZE) + icmp_header(_type, code)
+
+
+def payload_icmp(target: str, payload: bytes, _type: int = ICMP_ECHO_REQUEST, code: int = 0) -> bytes:
+    s = (_type << 8) + code + ones_sum(payload)
+    return ip_template(target, socket.IPPROTO_ICMP).header(
+        b'',
+        ICMP_HEADER_SIZE + len(payload)
+    ) + _ICMP.pack(_type, code, checksum(s), 0, 0) + payload
+
+
+def frame_icmp(target: str, frame: bytes, _type: int = ICMP_ECHO_REQUEST, code: int = 0) -> bytes:
+    """
+    ICMP message whose identifier and sequence fields are the first four bytes of the frame
+    """
+    s = (_type << 8) + code + ones_sum(frame)
+    return ip_template(target, socket.IPPROTO_ICMP).header(
+        b'',
+        _ICMP_TYPE.size + len(frame)
+    ) + _ICMP_TYPE.pack(_type, code, checksum(s)) + frame
+
+
+__all__ = [
+    'IP_HEADER_SIZE',
+    'ICMP_HEADER_SIZE',
+    'UDP_HEADER_SIZE',
+    'ICMP_ECHO_REQUEST',
+    'ICMP_DEST_UNREACHABLE',
+    'ICMP_PORT_UNREACHABLE',
+    'ones_sum',
+    'checksum',
+    'option_udp',
+    'option_icmp',
+    'payload_icmp',
+    'frame_icmp',
+    'path_mtu',
+]
@@ -0,0 +1,131 @@
+"""
+Staged receive pipeline
+
+    reader  ->  workers  ->  dispatcher
+
+The reader only reads packets and reassembles them so that it keeps up with the socket. Completed
+messages are decrypted, decompressed and parsed by a pool of worker threads or processes, and a
+single dispatcher thread hands them to the callback in the order they were completed, so a slow
+callback no longer stops the reads.
+
+The reader and the dispatcher are joined by a bounded queue. When it is full the reader either drops
+the message, or waits for room and leaves it to the kernel to drop packets once the socket buffer
+fills up, which the messager reports as ``overflowed``.
+
+Errors opening a message or in the callback are logged and the dispatcher goes on with the next one.
+"""
+import logging
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from queue import Queue
+from threading import Thread
+from typing import Any, Callable, List, Optional, Tuple, Type
+
+from .compression import Compressor
+from .interface import BaseModel, PayloadCodec
+from .ip_utils import Shifter, VerificationError
+
+log = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=64)
+def _parser(codec: PayloadCodec, payload_type: Type[BaseModel]) -> Callable[[bytes], BaseModel]:
+    # Keyed by the codec the messager was configured with, worker processes get a copy per message
+    return codec.parser(payload_type)
+
+
+def open_message(
+        fragments: List[bytes],
+        key: bytes,
+        nonce: Optional[bytes],
+        compressor: Compressor,
+        codec: Optional[PayloadCodec] = None,
+        payload_type: Optional[Type[BaseModel]] = None,
+) -> Tuple[bytes, Optional[BaseModel]]:
+    """
+    Decrypts and decompresses a message, and parses the payload if a payload type is given
+
+    Everything it needs is passed in so that it runs in worker processes too.
+    """
+    data = Shifter.decode_message(fragments, secret=key, nonce=nonce)
+    data = compressor.decompress(Shifter.get_codec(fragments[-1]), data)
+    if payload_type is None:
+        return data, None
+    return data, _parser(codec, payload_type)(data)
+
+
+class Pipeline:
+    """
+    Worker pool and dispatcher behind the reader of a messager
+    """
+    QUEUE_SIZE = 1024
+
+    def __init__(
+            self,
+            messager: Any,
+            callback: Callable[[Any], Any],
+            workers: int = 4,
+            processes: bool = False,
+            queue_size: int = QUEUE_SIZE,
+            block: bool = False,
+    ):
+        self.messager = messager
+        self.callback = callback
+        self.block = block
+        self.pool: Executor = ProcessPoolExecutor(workers) if processes else ThreadPoolExecutor(workers, 'decode')
+        self.queue: 'Queue[Optional[Tuple[Future, Tuple[str, int], Any, int]]]' = Queue(queue_size)
+        self.dispatcher = Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, fragments: List[bytes], addr: Tuple[str, int]):
+        """
+        Queues a reassembled message for opening, called by the reader
+        """
+        m = self.messager
+        if not self.block and self.queue.full():
+            m.dropped += 1
+            return
+        try:
+            keys = m.keys(fragments, addr)
+        except ValueError:
+            m.invalid += 1
+            return
+        if keys is None:
+            return
+        key, nonce, session, counter = keys
+        parse = (m.payload_codec, m._message_type) if not m.lazy else ()
+        future = self.pool.submit(open_message, fragments, key, nonce, m.compressor, *parse)
+        self.queue.put((future, addr, session, counter))
+
+    def dispatch(self):
+        m = self.messager
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            future, addr, session, counter = item
+            try:
+                data, payload = future.result()
+            except ValueError as e:
+                m.invalid += 1
+                if isinstance(e, VerificationError):
+                    m.unverified.inc()
+                continue
+            except Exception:
+                m.invalid += 1
+                log.exception("Failed to open a message from %s", addr[0])
+                continue
+            try:
+                message = m.opened(data, addr, session, counter, payload)
+                if message is not None:
+                    self.callback(message)
+            except Exception:
+                log.exception("Callback failed on a message from %s", addr[0])
+
+    def close(self):
+        self.queue.put(None)
+        self.dispatcher.join()
+        self.pool.shutdown()
+
+
+__all__ = ['Pipeline']
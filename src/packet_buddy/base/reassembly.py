@@ -0,0 +1,239 @@
+import time
+from collections import OrderedDict
+from typing import Tuple, List, Optional
+
+from .ip_utils import Shifter
+from .metrics import Histogram
+from .reliability import received
+
+PeerKey = Tuple[int, str, int]
+TransactionKey = Tuple[int, str, int, int]
+
+UNSEQUENCED = -1  # Serial in the key of unsequenced transactions, one at a time per peer
+SERIAL_SPAN = 0x100
+
+
+class Transaction:
+    """
+    Fragments of a single message from one sender
+
+    Sequenced transactions preallocate a slot per fragment and fill them by index, unsequenced ones
+    append in arrival order.
+    """
+    __slots__ = ['serial', 'fragments', 'missing', 'size', 'started', 'updated', 'last', 'unacked', 'due']
+
+    def __init__(self, serial: int = 0, total: int = 0):
+        self.serial = serial
+        self.fragments: List[Optional[bytes]] = [None] * total
+        self.missing = total
+        self.size = 0
+        self.started = self.updated = time.monotonic()
+        # Acknowledgement state, see Reassembler.acknowledgement
+        self.last = -1
+        self.unacked = 0
+        self.due = False
+
+
+class Reassembler:
+    """
+    Collects fragments into messages keyed by sender id, address and serial
+
+    Sequenced fragments may arrive in any order and duplicates are ignored, the message is complete
+    once every index is present. Messages with different serials are reassembled independently, so
+    a sender may have up to half the serials in flight at once. Unsequenced fragments have to arrive
+    in order from start to end, one message per sender at a time.
+
+    Completed messages are remembered until they expire so that late duplicates are not mistaken for
+    a new message. Serials wrap around, the highest serial seen from every sender marks the ones half
+    the serials behind it as free for new messages and forgets what is left of them.
+
+    Transactions are kept in order of last activity. As every transaction has the same timeout the
+    front of the cache is always the next one to expire and the least recently used one, so both
+    expiry and eviction only ever look at the front.
+    """
+    MAX_TRANSACTIONS = 1024
+    MAX_BYTES = 1 << 22
+
+    def __init__(
+            self,
+            _id: int,
+            timeout: float = 5.,
+            max_transactions: int = MAX_TRANSACTIONS,
+            max_bytes: int = MAX_BYTES,
+    ):
+        self.id = _id
+        self.timeout = timeout
+        self.max_transactions = max_transactions
+        self.max_bytes = max_bytes
+        self.cache: 'OrderedDict[TransactionKey, Transaction]' = OrderedDict()
+        self.completed: 'OrderedDict[TransactionKey, Transaction]' = OrderedDict()
+        self.heads: 'OrderedDict[PeerKey, Transaction]' = OrderedDict()
+        self.buffered = 0
+        self.duplicates = 0
+        self.expired = 0
+        self.evicted = 0
+        # Seconds from the first to the last fragment of complete messages, see metrics
+        self.timing: Optional[Histogram] = None
+
+    def add(self, option: memoryview, addr: Tuple[str, int], now: Optional[float] = None) -> Optional[List[bytes]]:
+        """
+        Adds a received option, returns the ordered fragments if it completed a message
+
+        Transactions expire by the monotonic clock unless the time the option was received is given.
+        """
+        sender = Shifter.get_id(option)
+        if sender == self.id:
+            return None
+        if now is None:
+            now = time.monotonic()
+        self.expire(now)
+        if Shifter.is_sequenced(option):
+            return self._add_sequenced((sender, *addr), option, now)
+        else:
+            return self._add_ordered((sender, *addr, UNSEQUENCED), option, now)
+
+    def _add_sequenced(self, peer: PeerKey, option: memoryview, now: float) -> Optional[List[bytes]]:
+        serial = Shifter.get_serial(option)
+        index = Shifter.get_index(option)
+        total = Shifter.get_total(option)
+        if index >= total:
+            return None
+        self._advance(peer, serial, now)
+        tid = (*peer, serial)
+        if tid in self.completed:
+            self.duplicates += 1
+            return None
+        t = self.cache.get(tid)
+        if t is None or len(t.fragments) != total:
+            t = self._open(tid, serial, total)
+        elif t.fragments[index] is not None:
+            self.duplicates += 1
+            t.due = True
+            return None
+        t.fragments[index] = self._store(tid, t, option, now)
+        t.missing -= 1
+        t.unacked += 1
+        t.due = t.due or index != t.last + 1 or Shifter.is_end(option)
+        t.last = index
+        if t.missing == 0:
+            done = self.completed[tid] = Transaction(serial)
+            done.updated = now
+            return self._complete(tid, now)
+        self._limit()
+        return None
+
+    def _advance(self, peer: PeerKey, serial: int, now: float):
+        """
+        Moves the highest serial of the sender forward and frees the serials it left behind
+        """
+        head = self.heads.get(peer)
+        if head is None:
+            head = self.heads[peer] = Transaction(serial)
+        ahead = (serial - head.serial) % SERIAL_SPAN
+        if 0 < ahead < SERIAL_SPAN // 2:
+            for k in range(1, ahead + 1):
+                stale = (*peer, (head.serial + k + SERIAL_SPAN // 2) % SERIAL_SPAN)
+                self.completed.pop(stale, None)
+                if stale in self.cache:
+                    self._remove(stale)
+                    self.evicted += 1
+            head.serial = serial
+        head.updated = now
+        self.heads.move_to_end(peer)
+
+    def acknowledgement(self, option: memoryview, addr: Tuple[str, int], every: int) -> Optional[List[Tuple[int, int]]]:
+        """
+        Received index ranges of the sequenced message the option belonged to if it is to be acknowledged
+
+        Messages are acknowledged every few fragments and right away on the last fragment, on gaps,
+        on duplicates and once complete.
+        """
+        sender = Shifter.get_id(option)
+        if sender == self.id:
+            return None
+        tid = (sender, *addr, Shifter.get_serial(option))
+        if tid in self.completed:
+            return [(0, Shifter.get_total(option))]
+        t = self.cache.get(tid)
+        if t is None or not (t.due or t.unacked >= every):
+            return None
+        t.due = False
+        t.unacked = 0
+        return received(t.fragments)
+
+    def _add_ordered(self, tid: TransactionKey, option: memoryview, now: float) -> Optional[List[bytes]]:
+        if Shifter.is_start(option):
+            t = self._open(tid)
+        else:
+            t = self.cache.get(tid)
+            if t is None:
+                return None
+        t.fragments.append(self._store(tid, t, option, now))
+        if Shifter.is_end(option):
+            return self._complete(tid, now)
+        self._limit()
+        return None
+
+    def _open(self, tid: TransactionKey, serial: int = 0, total: int = 0) -> Transaction:
+        if tid in self.cache:
+            self._remove(tid)
+        t = self.cache[tid] = Transaction(serial, total)
+        return t
+
+    def _store(self, tid: TransactionKey, t: Transaction, option: memoryview, now: float) -> bytes:
+        data = bytes(option)
+        if t.size == 0:
+            t.started = now
+        t.size += len(data)
+        t.updated = now
+        self.buffered += len(data)
+        self.cache.move_to_end(tid)
+        return data
+
+    def _complete(self, tid: TransactionKey, now: float) -> List[bytes]:
+        t = self._remove(tid)
+        if self.timing is not None:
+            self.timing.observe(now - t.started)
+        return t.fragments
+
+    def _remove(self, tid: TransactionKey) -> Transaction:
+        t = self.cache.pop(tid)
+        self.buffered -= t.size
+        return t
+
+    def _limit(self):
+        """
+        Evicts least recently active transactions until within the limits
+        """
+        while self.cache and (len(self.cache) > self.max_transactions or self.buffered > self.max_bytes):
+            _, t = self.cache.popitem(last=False)
+            self.buffered -= t.size
+            self.evicted += 1
+        while len(self.completed) > self.max_transactions:
+            self.completed.popitem(last=False)
+        while len(self.heads) > self.max_transactions:
+            self.heads.popitem(last=False)
+
+    def expire(self, now: Optional[float] = None):
+        if now is None:
+            now = time.monotonic()
+        deadline = now - self.timeout
+        while self.cache:
+            tid, t = next(iter(self.cache.items()))
+            if t.updated >= deadline:
+                break
+            self._remove(tid)
+            self.expired += 1
+        while self.completed:
+            tid, t = next(iter(self.completed.items()))
+            if t.updated >= deadline:
+                break
+            del self.completed[tid]
+        while self.heads:
+            peer, t = next(iter(self.heads.items()))
+            if t.updated >= deadline:
+                break
+            del self.heads[peer]
+
+
+__all__ = ['Reassembler']
@@ -0,0 +1,510 @@
+"""
+Selective acknowledgements and retransmission of lost fragments
+
+Receivers acknowledge sequenced messages with single unsequenced frames of the ``ACK`` type:
+
+    SENDER(16) | SERIAL(8) | TAG(64) | START(12) END(12) | START(12) END(12) | ...
+
+naming the sender and serial of the message followed by the half open ranges of fragment indexes
+received so far. Acknowledgements are not encrypted but carry a truncated HMAC-SHA256 tag over the id
+of the peer acknowledging and the rest of the frame, keyed with a key derived from the secret, as a
+forged one would stop the sender from retransmitting what was lost. The tag is cut short to leave
+room for ranges in an IP option. It does not tell apart acknowledgements of messages with the same
+serial, so a recorded one can be replayed once the serial comes round again.
+
+Senders keep a window of fragments in flight per peer. A fragment is lost once a fragment sent
+after it is acknowledged or when nothing is acknowledged within the retransmission timeout derived
+from the round trip time (RFC 6298), and only lost fragments are sent again. Before the timeout the
+newest fragment in flight is sent again once as a probe, its acknowledgement shows what else was
+lost at the tail of a message (RFC 8985). The window follows the
+congestion control of RFC 5681, see ``Path``.
+"""
+import hmac
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .ip_utils import Utils, Shifter, MessageType, VerificationError, OPTION_MAX, OPTION_HEADER_SIZE, CUSTOM_HEADER_SIZE
+from .pacing import Pacer, TokenBucket
+
+Ranges = List[Tuple[int, int]]
+Target = Tuple[str, int]
+
+_ACK = struct.Struct('!HB')
+ACK_TAG_SIZE = 8
+ACK_HEADER_SIZE = _ACK.size + ACK_TAG_SIZE
+RANGE_SIZE = 3
+ACK_RANGES_MAX = (OPTION_MAX - OPTION_HEADER_SIZE - CUSTOM_HEADER_SIZE - ACK_HEADER_SIZE) // RANGE_SIZE
+_ACK_LABEL = b'packet-buddy acknowledgement'
+ACK_EVERY = 4
+
+INITIAL_RTO = 1.
+MIN_RTO = .2
+MAX_RTO = 60.
+MIN_PROBE = .01
+
+INITIAL_WINDOW = 4
+MIN_WINDOW = ACK_EVERY  # Smaller windows wait for the retransmission timer to get acknowledged
+DECREASE = .5
+PACING_GAIN = 1.25  # Room for the window to grow within a round trip
+PACING_BURST = 2
+
+UNSENT = 0
+IN_FLIGHT = 1
+LOST = 2
+ACKED = 3
+
+
+def received(fragments: List[Optional[bytes]]) -> Ranges:
+    """
+    Ranges of the indexes that hold a fragment
+    """
+    ranges = []
+    start = None
+    for i, f in enumerate(fragments):
+        if f is not None and start is None:
+            start = i
+        elif f is None and start is not None:
+            ranges.append((start, i))
+            start = None
+    if start is not None:
+        ranges.append((start, len(fragments)))
+    return ranges
+
+
+def ack_key(secret: bytes) -> bytes:
+    """
+    Key of the acknowledgement tags, kept apart from the key encrypting messages
+    """
+    return hmac.digest(secret, _ACK_LABEL, 'sha256')
+
+
+def _ack_tag(key: bytes, sender_id: int, data: bytes) -> bytes:
+    return hmac.digest(key, (sender_id & 0xffff).to_bytes(4, byteorder='big') + data, 'sha256')[:ACK_TAG_SIZE]
+
+
+def encode_ack(
+        sender_id: int,
+        peer: int,
+        serial: int,
+        ranges: Ranges,
+        key: bytes,
+        payload: bool = False,
+) -> memoryview:
+    header = _ACK.pack(peer & 0xffff, serial & 0xff)
+    body = bytearray()
+    for start, end in ranges:
+        body += ((start << 12) | end).to_bytes(RANGE_SIZE, byteorder='big')
+    _id = sender_id & 0xffff
+    data = header + _ack_tag(key, _id, header + body) + body
+    if payload:
+        frames = Utils.encode_frames(data, _type=MessageType.ACK, _id=_id, size=len(data))
+    else:
+        # IP options come in whole words
+        size = (len(data) + 3) & ~3
+        buffer = bytearray(Utils.option_size(size, False))
+        Utils.encode_into(buffer, 0, data, _type=MessageType.ACK, _id=_id, size=size)
+        frames = [memoryview(buffer)]
+    return Utils.set_start_end(frames)[0]
+
+
+def decode_ack(frame: bytes, key: bytes) -> Tuple[int, int, Ranges]:
+    """
+    Sender and serial of the acknowledged message and the ranges received
+
+    Raises VerificationError if the tag does not match.
+    """
+    data = Utils.decode([frame])
+    if len(data) < ACK_HEADER_SIZE:
+        raise ValueError("Malformed acknowledgement")
+    tag = data[_ACK.size:ACK_HEADER_SIZE]
+    if not hmac.compare_digest(tag, _ack_tag(key, Shifter.get_id(frame), data[:_ACK.size] + data[ACK_HEADER_SIZE:])):
+        raise VerificationError("Acknowledgement failed to verify")
+    peer, serial = _ACK.unpack_from(data)
+    ranges = []
+    for i in range(ACK_HEADER_SIZE, len(data) - RANGE_SIZE + 1, RANGE_SIZE):
+        word = int.from_bytes(data[i:i + RANGE_SIZE], byteorder='big')
+        ranges.append((word >> 12, word & 0xfff))
+    return peer, serial, ranges
+
+
+class Path:
+    """
+    Round trip time, congestion window and fragments in flight to a single peer
+
+    The window grows by a fragment for every acknowledged fragment below the slow start threshold and
+    by a fragment per window above it. Losses halve it at most once per round trip and a timeout
+    drops it to the minimum. Fragments are paced at a window per round trip so that a full
+    window does not leave as a single burst.
+    """
+    __slots__ = [
+        'srtt',
+        'rttvar',
+        'rto',
+        'inflight',
+        'window',
+        'threshold',
+        'maximum',
+        'recovery',
+        'bucket',
+        'losses',
+    ]
+
+    def __init__(self, maximum: int = INITIAL_WINDOW):
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.
+        self.rto = INITIAL_RTO
+        self.inflight = 0
+        self.maximum = maximum
+        self.window = float(min(INITIAL_WINDOW, maximum))
+        self.threshold = float(maximum)
+        self.recovery = 0.
+        self.bucket = TokenBucket(1., PACING_BURST)
+        self.losses = 0
+
+    @property
+    def rate(self) -> Optional[float]:
+        """
+        Fragments per second, unknown until the first round trip time sample
+        """
+        if not self.srtt:
+            return None
+        return self.window / self.srtt
+
+    def acked(self, count: int):
+        # A window that is not used up says nothing about the capacity (RFC 7661)
+        if self.inflight + count < self.window / 2:
+            return
+        if self.window < self.threshold:
+            self.window += count
+        else:
+            self.window += count / self.window
+        self.window = min(self.window, self.maximum)
+
+    def congested(self, now: float):
+        if now < self.recovery:
+            return
+        self.window = max(self.window * DECREASE, MIN_WINDOW)
+        self.threshold = self.window
+        self.recovery = now + (self.srtt if self.srtt is not None else self.rto)
+        self.losses += 1
+
+    def timeout(self):
+        self.threshold = max(self.window * DECREASE, MIN_WINDOW)
+        self.window = MIN_WINDOW
+        self.losses += 1
+        self.backoff()
+
+    def budget(self, now: float) -> int:
+        """
+        Fragments that may be sent right now
+        """
+        budget = int(self.window) - self.inflight
+        rate = self.rate
+        if rate is None or budget <= 0:
+            return budget
+        self.bucket.rate = rate * PACING_GAIN
+        self.bucket.refill(now)
+        return min(budget, int(self.bucket.tokens))
+
+    def spend(self, count: int):
+        if self.srtt:
+            self.bucket.tokens -= count
+
+    def delay(self) -> float:
+        """
+        Time until pacing allows the next fragment
+        """
+        return self.bucket.wait_time(1) if self.srtt else 0.
+
+    def sample(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = .75 * self.rttvar + .25 * abs(self.srtt - rtt)
+            self.srtt = .875 * self.srtt + .125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+
+    def backoff(self):
+        self.rto = min(self.rto * 2, MAX_RTO)
+
+    def probe(self) -> float:
+        """
+        Time without acknowledgements after which the tail is probed
+        """
+        if self.srtt is None:
+            return self.rto
+        return min(max(2 * self.srtt, MIN_PROBE), self.rto)
+
+
+class Delivery:
+    """
+    Packets of an outgoing message and the state of every fragment
+    """
+    __slots__ = [
+        'packets',
+        'target',
+        'serial',
+        'state',
+        'stamps',
+        'sent',
+        'resent',
+        'lost',
+        'next',
+        'base',
+        'remaining',
+        'timeouts',
+        'deadline',
+        'probed',
+        'delivered',
+        'done',
+    ]
+
+    def __init__(self, packets: List[bytes], target: Target, serial: int):
+        self.packets = packets
+        self.target = target
+        self.serial = serial
+        self.state = bytearray(len(packets))
+        self.stamps = [0] * len(packets)
+        self.sent = [0.] * len(packets)
+        self.resent = bytearray(len(packets))
+        self.lost: Set[int] = set()
+        self.next = 0
+        self.base = 0
+        self.remaining = len(packets)
+        self.timeouts = 0
+        self.deadline: Optional[float] = None
+        self.probed = False
+        self.delivered = False
+        self.done = threading.Event()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Blocks until every fragment is acknowledged or the delivery gave up, returns whether it was delivered
+        """
+        self.done.wait(timeout)
+        return self.delivered
+
+
+class Retransmitter:
+    """
+    Sends messages within the congestion window of every peer and retransmits what was lost
+
+    All sending, acknowledgements included, happens on a single background thread so that neither
+    the receive path nor the senders ever wait for the pacer.
+    """
+    WINDOW = 64  # Largest congestion window
+    RETRIES = 8
+
+    def __init__(
+            self,
+            send: Callable[[List[bytes], Target], None],
+            pacer: Pacer,
+            window: int = WINDOW,
+            retries: int = RETRIES,
+    ):
+        self.send = send
+        self.pacer = pacer
+        self.window = window
+        self.retries = retries
+        self.condition = threading.Condition()
+        self.deliveries: 'OrderedDict[Tuple[str, int], Delivery]' = OrderedDict()
+        self.paths: Dict[str, Path] = dict()
+        self.replies: List[Tuple[bytes, Target]] = []
+        self.stamp = 0
+        self.retransmitted = 0
+        self.delivered = 0
+        self.failed = 0
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+
+    def path(self, peer: str) -> Path:
+        p = self.paths.get(peer)
+        if p is None:
+            p = self.paths[peer] = Path(self.window)
+        return p
+
+    def add(self, packets: List[bytes], target: Target, serial: int) -> Delivery:
+        d = Delivery(packets, target, serial)
+        with self.condition:
+            old = self.deliveries.pop((target[0], serial), None)
+            if old is not None:
+                self._finish(old, False)
+            self.deliveries[(target[0], serial)] = d
+            self.path(target[0])
+            self._start()
+            self.condition.notify()
+        return d
+
+    def reply(self, packet: bytes, target: Target):
+        with self.condition:
+            self.replies.append((packet, target))
+            self._start()
+            self.condition.notify()
+
+    def acknowledge(self, peer: str, serial: int, ranges: Ranges):
+        with self.condition:
+            d = self.deliveries.get((peer, serial))
+            if d is None:
+                return
+            path = self.paths[peer]
+            newest = -1
+            acked = 0
+            for start, end in ranges:
+                for i in range(start, min(end, len(d.packets))):
+                    state = d.state[i]
+                    if state == IN_FLIGHT:
+                        path.inflight -= 1
+                    elif state == LOST:
+                        d.lost.discard(i)
+                    else:
+                        continue
+                    d.state[i] = ACKED
+                    d.remaining -= 1
+                    acked += 1
+                    if newest < 0 or d.stamps[i] > d.stamps[newest]:
+                        newest = i
+            if newest < 0:
+                return
+            now = time.monotonic()
+            # Karn's algorithm, the time of a retransmitted fragment is ambiguous
+            if not d.resent[newest] and d.sent[newest]:
+                path.sample(now - d.sent[newest])
+            path.acked(acked)
+            if d.remaining == 0:
+                self._finish(d, True)
+            else:
+                stamp = d.stamps[newest]
+                lost = len(d.lost)
+                for i in range(d.base, d.next):
+                    if d.state[i] == IN_FLIGHT and d.stamps[i] < stamp:
+                        d.state[i] = LOST
+                        d.lost.add(i)
+                        path.inflight -= 1
+                if len(d.lost) > lost:
+                    path.congested(now)
+                while d.base < d.next and d.state[d.base] == ACKED:
+                    d.base += 1
+                d.timeouts = 0
+                d.probed = False
+                d.deadline = now + path.probe()
+            self.condition.notify()
+
+    def _finish(self, d: Delivery, delivered: bool):
+        self.deliveries.pop((d.target[0], d.serial), None)
+        path = self.paths[d.target[0]]
+        for i in range(d.base, d.next):
+            if d.state[i] == IN_FLIGHT:
+                path.inflight -= 1
+        d.delivered = delivered
+        if delivered:
+            self.delivered += 1
+        else:
+            self.failed += 1
+        d.done.set()
+
+    def _schedule(self, now: float) -> Tuple[List[Tuple[Delivery, List[int]]], Optional[float]]:
+        """
+        Fragments to send now and the time until the next timeout or pacing allows more
+        """
+        sends = []
+        wait = None
+        for d in list(self.deliveries.values()):
+            path = self.paths[d.target[0]]
+            if d.deadline is not None and now >= d.deadline:
+                flight = [i for i in range(d.base, d.next) if d.state[i] == IN_FLIGHT]
+                d.deadline = None
+                if flight and not d.probed:
+                    d.probed = True
+                    flight = [max(flight, key=d.stamps.__getitem__)]
+                elif flight:
+                    d.timeouts += 1
+                    if d.timeouts > self.retries:
+                        self._finish(d, False)
+                        continue
+                    path.timeout()
+                for i in flight:
+                    d.state[i] = LOST
+                    d.lost.add(i)
+                path.inflight -= len(flight)
+            budget = path.budget(now)
+            if budget <= 0 < int(path.window) - path.inflight and (d.lost or d.next < len(d.packets)):
+                delay = path.delay()
+                wait = delay if wait is None else min(wait, delay)
+            indexes = sorted(d.lost)[:max(budget, 0)]
+            budget -= len(indexes)
+            d.lost.difference_update(indexes)
+            for i in indexes:
+                d.resent[i] = 1
+            self.retransmitted += len(indexes)
+            while budget > 0 and d.next < len(d.packets):
+                indexes.append(d.next)
+                d.next += 1
+                budget -= 1
+            for i in indexes:
+                self.stamp += 1
+                d.stamps[i] = self.stamp
+                d.state[i] = IN_FLIGHT
+            path.inflight += len(indexes)
+            path.spend(len(indexes))
+            if indexes:
+                sends.append((d, indexes))
+                if d.deadline is None:
+                    d.deadline = now + (path.rto if d.probed else path.probe())
+            elif d.deadline is None and d.next > d.base:
+                # A window that shrank below the fragments in flight holds back the probe, the
+                # fragments still in flight time out on their own
+                d.deadline = now + path.rto
+            if d.deadline is not None:
+                wait = d.deadline - now if wait is None else min(wait, d.deadline - now)
+        return sends, wait
+
+    def _start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+                replies, self.replies = self.replies, []
+                sends, wait = self._schedule(time.monotonic())
+                if not replies and not sends:
+                    self.condition.wait(wait)
+                    continue
+            for packet, target in replies:
+                for batch in self.pacer.batches([packet]):
+                    self.send(batch, target)
+            for d, indexes in sends:
+                packets = [d.packets[i] for i in indexes]
+                sent = 0
+                for batch in self.pacer.batches(packets):
+                    now = time.monotonic()
+                    with self.condition:
+                        for i in indexes[sent:sent + len(batch)]:
+                            d.sent[i] = now
+                    sent += len(batch)
+                    self.send(batch, d.target)
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            for d in list(self.deliveries.values()):
+                self._finish(d, False)
+            self.condition.notify()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+
+__all__ = [
+    'Retransmitter',
+    'Delivery',
+    'Path',
+]
@@ -0,0 +1,253 @@
+"""
+X25519 session handshake
+
+The initiator sends an ``EC_PUB_REQ`` with an ephemeral public key and the responder answers with an
+``EC_CON_REQ`` carrying its own, both encrypted with the shared static secret so only holders of the
+secret can take part. Both sides derive the session key with HKDF using the static secret as salt.
+
+Sessions are stored per peer address and sender id, the last peer seen on an address is the one new
+messages to that address are encrypted for.
+
+Handshakes carry the message counter of the sender, which keeps growing across restarts. Every peer's
+last handshake counter is remembered for good and handshakes that are not newer are dropped, so a
+recorded request can not be replayed to replace a live session with one nobody holds the key of.
+
+HKDF also yields a salt per direction. With implicit nonces the nonce of a message is the salt of the
+sending side followed by the per peer message counter, of which only the low byte travels as the
+serial of the sequence word. The receiver rebuilds the full counter from the highest one it has
+accepted and keeps a window of recently accepted counters to drop replays. After losing more than
+half a serial span in a row the receiver rebuilds the wrong counter and the messages fail to verify,
+so every ``RESYNC`` messages the nonce travels along and tells the receiver the full counter again.
+"""
+import time
+from threading import Lock
+from typing import Dict, Tuple, Optional, List, Any
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+from cryptography.hazmat.primitives.ciphers.aead import ChaCha20Poly1305
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+PUBLIC_KEY_SIZE = 32
+KEY_SIZE = 32
+SALT_SIZE = 4
+COUNTER_SIZE = 8
+SESSION_INFO = b'packet_buddy session'
+
+PeerKey = Tuple[str, int]
+
+
+def public_bytes(key: X25519PrivateKey) -> bytes:
+    return key.public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw,
+    )
+
+
+class Session:
+    __slots__ = ['key', 'cipher', 'expires', 'send_salt', 'receive_salt', 'highest', 'window']
+
+    REPLAY_WINDOW = 64
+    SERIAL_BITS = 8
+    RESYNC = 64
+
+    def __init__(self, key: bytes, lifetime: float, send_salt: bytes = b'', receive_salt: bytes = b''):
+        self.key = key
+        self.cipher = ChaCha20Poly1305(key)
+        self.expires = time.monotonic() + lifetime
+        self.send_salt = send_salt
+        self.receive_salt = receive_salt
+        self.highest = -1
+        self.window = 0
+
+    def send_nonce(self, counter: int) -> bytes:
+        return self.send_salt + counter.to_bytes(COUNTER_SIZE, byteorder='big')
+
+    def receive_nonce(self, counter: int) -> bytes:
+        return self.receive_salt + counter.to_bytes(COUNTER_SIZE, byteorder='big')
+
+    def counter(self, nonce: bytes) -> Optional[int]:
+        """
+        Counter of a nonce the peer derived from it, None for a random nonce
+        """
+        if len(nonce) != SALT_SIZE + COUNTER_SIZE or nonce[:SALT_SIZE] != self.receive_salt:
+            return None
+        return int.from_bytes(nonce[SALT_SIZE:], byteorder='big')
+
+    def expand(self, serial: int) -> int:
+        """
+        Full counter closest to the highest accepted one that ends in the serial
+        """
+        span = 1 << Session.SERIAL_BITS
+        base = max(self.highest, 0)
+        counter = (base & ~(span - 1)) | serial
+        if counter > base + span // 2 and counter >= span:
+            counter -= span
+        elif counter < base - span // 2:
+            counter += span
+        return counter
+
+    def fresh(self, counter: int) -> bool:
+        """
+        Whether the counter has not been accepted yet and is recent enough to tell
+        """
+        if counter > self.highest:
+            return True
+        offset = self.highest - counter
+        return offset < Session.REPLAY_WINDOW and not self.window >> offset & 1
+
+    def accept(self, counter: int):
+        """
+        Marks the counter as seen, only call after the message authenticated
+        """
+        if counter > self.highest:
+            shift = counter - self.highest
+            self.window = (self.window << shift | 1) & ((1 << Session.REPLAY_WINDOW) - 1)
+            self.highest = counter
+        else:
+            self.window |= 1 << (self.highest - counter)
+
+
+class Handshake:
+    """
+    Handshake in progress, messages to the peer are queued until it completes
+    """
+    __slots__ = ['key', 'queue', 'started']
+
+    def __init__(self):
+        self.key = X25519PrivateKey.generate()
+        self.queue: List[Any] = list()
+        self.started = time.monotonic()
+
+
+class SessionTable:
+    LIFETIME = 3600.
+    HANDSHAKE_TIMEOUT = 5.
+
+    def __init__(self, _id: int, secret: bytes, lifetime: float = LIFETIME):
+        self.id = _id
+        self.secret = secret
+        self.lifetime = lifetime
+        self.sessions: Dict[PeerKey, Session] = dict()
+        self.routes: Dict[str, int] = dict()
+        self.pending: Dict[str, Handshake] = dict()
+        self.handshakes: Dict[PeerKey, int] = dict()
+        self.lock = Lock()
+
+    def derive(self, key: X25519PrivateKey, peer_public: bytes, initiator: int, responder: int) -> Session:
+        if len(peer_public) != PUBLIC_KEY_SIZE:
+            raise ValueError("Invalid public key")
+        shared = key.exchange(X25519PublicKey.from_public_bytes(peer_public))
+        material = HKDF(
+            algorithm=hashes.SHA256(),
+            length=KEY_SIZE + 2 * SALT_SIZE,
+            salt=self.secret,
+            info=SESSION_INFO + initiator.to_bytes(2, byteorder='big') + responder.to_bytes(2, byteorder='big'),
+        ).derive(shared)
+        # Both directions share the key, distinct salts keep their counter nonces apart
+        initiator_salt = material[KEY_SIZE:KEY_SIZE + SALT_SIZE]
+        responder_salt = material[KEY_SIZE + SALT_SIZE:]
+        if self.id == initiator:
+            return Session(material[:KEY_SIZE], self.lifetime, initiator_salt, responder_salt)
+        return Session(material[:KEY_SIZE], self.lifetime, responder_salt, initiator_salt)
+
+    def get(self, ip: str, peer: int) -> Optional[Session]:
+        s = self.sessions.get((ip, peer))
+        if s is not None and s.expires < time.monotonic():
+            del self.sessions[(ip, peer)]
+            return None
+        return s
+
+    def route(self, ip: str) -> Optional[Session]:
+        """
+        Session to use for messages sent to the address
+        """
+        peer = self.routes.get(ip)
+        if peer is None:
+            return None
+        return self.get(ip, peer)
+
+    def replayed(self, ip: str, peer: int, counter: int) -> bool:
+        """
+        Whether a handshake is not newer than the last one of the peer
+        """
+        return counter <= self.handshakes.get((ip, peer), -1)
+
+    def establish(self, ip: str, peer: int, session: Session, counter: int = -1):
+        # The handshake tells from which counter on the peer continues
+        session.highest = counter
+        self.sessions[(ip, peer)] = session
+        self.routes[ip] = peer
+        if counter > self.handshakes.get((ip, peer), -1):
+            self.handshakes[(ip, peer)] = counter
+
+    def enqueue(self, ip: str, message: Any) -> Tuple[Optional[Handshake], bool]:
+        """
+        Queues the message if there is no session with the address yet
+
+        Returns the handshake the message was queued on, or None if a session exists, and whether a
+        request needs to be sent for the handshake.
+        """
+        with self.lock:
+            if self.route(ip) is not None:
+                return None, False
+            h = self.pending.get(ip)
+            new = h is None or time.monotonic() - h.started > SessionTable.HANDSHAKE_TIMEOUT
+            if new:
+                # Retries use a fresh key but keep the queued messages
+                fresh = Handshake()
+                if h is not None:
+                    fresh.queue = h.queue
+                h = self.pending[ip] = fresh
+            h.queue.append(message)
+            return h, new
+
+    def respond(self, ip: str, peer: int, peer_public: bytes, counter: int = -1) -> Tuple[Optional[bytes], List[Any]]:
+        """
+        Answers a request, returns our public key and the messages that were waiting for a session
+
+        If both sides start a handshake at the same time the request of the lower id wins. Replayed
+        requests get no answer, see ``replayed``.
+        """
+        key = X25519PrivateKey.generate()
+        session = self.derive(key, peer_public, peer, self.id)
+        with self.lock:
+            if self.replayed(ip, peer, counter):
+                return None, []
+            h = self.pending.get(ip)
+            if h is not None and self.id < peer:
+                return None, []
+            self.establish(ip, peer, session, counter)
+            queue = self.pending.pop(ip).queue if h is not None else []
+        return public_bytes(key), queue
+
+    def complete(self, ip: str, peer: int, peer_public: bytes, counter: int = -1) -> List[Any]:
+        """
+        Finishes our own request, returns the messages that were waiting for the session
+        """
+        with self.lock:
+            if self.replayed(ip, peer, counter):
+                return []
+            h = self.pending.pop(ip, None)
+            if h is None:
+                return []
+            self.establish(ip, peer, self.derive(h.key, peer_public, self.id, peer), counter)
+            return h.queue
+
+    def rotate(self, ip: Optional[str] = None):
+        """
+        Drops sessions so that the next message starts a new handshake
+        """
+        if ip is None:
+            self.sessions.clear()
+            self.routes.clear()
+        else:
+            self.routes.pop(ip, None)
+            for k in [k for k in self.sessions if k[0] == ip]:
+                del self.sessions[k]
+
+
+__all__ = [
+    'SessionTable',
+    'public_bytes',
+]
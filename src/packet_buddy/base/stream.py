@@ -0,0 +1,242 @@
+"""
+Streams of independently authenticated chunks
+
+Payloads too large for a single message are cut into chunks of a fixed size and every chunk is sent
+as a ``STREAM`` message of its own. The nonce of a chunk is the id of the stream followed by the
+index of the chunk and a flag on the last one, as in the STREAM construction of Hoang, Reyhanitabar,
+Rogaway and Vizár. Chunks that were reordered, moved between streams or cut off at the end fail to
+verify. The nonce travels in front of the chunk like any other nonce.
+
+Stream ids start with the time the stream was sent in seconds and end in random bytes. Receivers
+refuse streams older than ``max_age`` and remember the ids of finished streams for twice as long, so
+a replayed stream is either remembered or too old to open again. Peers need clocks that agree within
+``max_age``.
+
+Senders encrypt and frame the chunks ahead of sending them on a thread pool. Receivers verify every
+chunk as soon as it is reassembled and write the stream out in order, holding on to at most a window
+of chunks that arrived early, so neither side keeps more than a few chunks in memory.
+"""
+import os
+import time
+from abc import abstractmethod, ABCMeta
+from collections import OrderedDict
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, Optional, Tuple, Union
+
+STREAM_ID_SIZE = 7
+TIME_SIZE = 4
+INDEX_SIZE = 4
+CHUNK_SIZE = 1 << 16
+LAST = 1
+
+StreamKey = Tuple[str, int, bytes]
+Source = Union[BinaryIO, Iterable[bytes]]
+
+
+def new_stream() -> bytes:
+    return int(time.time()).to_bytes(TIME_SIZE, byteorder='big') + os.urandom(STREAM_ID_SIZE - TIME_SIZE)
+
+
+def stream_time(stream: bytes) -> int:
+    """
+    Seconds since the epoch when the stream was sent
+    """
+    return int.from_bytes(stream[:TIME_SIZE], byteorder='big')
+
+
+def stream_nonce(stream: bytes, index: int, last: bool) -> bytes:
+    return stream + index.to_bytes(INDEX_SIZE, byteorder='big') + (LAST if last else 0).to_bytes(1, byteorder='big')
+
+
+def parse_nonce(nonce: bytes) -> Tuple[bytes, int, bool]:
+    """
+    Stream id, index of the chunk and whether it is the last one
+    """
+    index = int.from_bytes(nonce[STREAM_ID_SIZE:STREAM_ID_SIZE + INDEX_SIZE], byteorder='big')
+    return nonce[:STREAM_ID_SIZE], index, nonce[STREAM_ID_SIZE + INDEX_SIZE] == LAST
+
+
+def chunks(source: Source, size: int) -> Iterator[Tuple[bytes, bool]]:
+    """
+    Chunks of the given size from a binary file or an iterable of bytes, and whether it is the last
+
+    The source is read one chunk ahead to know which one is the last, an empty source gives a single
+    empty chunk so that the receiver still sees the stream end.
+    """
+    if hasattr(source, 'read'):
+        blocks = iter(lambda: source.read(size), b'')
+    else:
+        blocks = iter(source)
+    pending = bytearray()
+    current = None
+    for block in blocks:
+        pending += block
+        while len(pending) >= size:
+            if current is not None:
+                yield current, False
+            current = bytes(pending[:size])
+            del pending[:size]
+    if pending:
+        if current is not None:
+            yield current, False
+        current = bytes(pending)
+    yield (current if current is not None else b''), True
+
+
+class StreamSink(metaclass=ABCMeta):
+    """
+    Where a received stream is written to
+
+    Chunks are written in order, ``close`` is called once the last chunk was written and ``abort``
+    instead if the stream failed.
+    """
+
+    @abstractmethod
+    def write(self, data: bytes):
+        pass
+
+    def close(self):
+        pass
+
+    def abort(self):
+        self.close()
+
+
+class FileSink(StreamSink):
+    """
+    Writes to a temporary file next to the path and moves it there once the stream completed
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.partial = path + '.part'
+        self.file = open(self.partial, 'wb')
+
+    def write(self, data: bytes):
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+        os.replace(self.partial, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.unlink(self.partial)
+
+
+class Incoming:
+    __slots__ = ['sink', 'next', 'last', 'early', 'updated']
+
+    def __init__(self, sink: StreamSink, now: float):
+        self.sink = sink
+        self.next = 0
+        self.last = -1
+        self.early: Dict[int, bytes] = dict()
+        self.updated = now
+
+
+class StreamTable:
+    """
+    Streams being received, per peer address, sender and stream id
+
+    The opener is called with these for the first chunk of every stream and gives the sink for it.
+    Streams fail when more than ``window`` chunks arrive ahead of the next one, when nothing arrived
+    for ``timeout`` seconds or when more than ``max_streams`` are open, the least recently active
+    one goes first. Streams sent more than ``max_age`` seconds ago or ahead are refused as ``stale``.
+    Finished streams are remembered for twice that so that replayed chunks do not open them again.
+    """
+    WINDOW = 16
+    TIMEOUT = 30.
+    MAX_STREAMS = 64
+    MAX_AGE = 600.
+
+    def __init__(
+            self,
+            opener: Callable[[Tuple[str, int], int, bytes], StreamSink],
+            window: int = WINDOW,
+            timeout: float = TIMEOUT,
+            max_streams: int = MAX_STREAMS,
+            max_age: float = MAX_AGE,
+    ):
+        self.opener = opener
+        self.window = window
+        self.timeout = timeout
+        self.max_streams = max_streams
+        self.max_age = max_age
+        self.streams: 'OrderedDict[StreamKey, Incoming]' = OrderedDict()
+        self.finished: 'OrderedDict[StreamKey, float]' = OrderedDict()
+        self.completed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.stale = 0
+
+    def add(self, addr: Tuple[str, int], sender: int, nonce: bytes, data: bytes):
+        """
+        Takes a verified chunk, writes it and whatever it was holding up out
+        """
+        now = time.monotonic()
+        self.expire(now)
+        stream, index, last = parse_nonce(nonce)
+        key = (addr[0], sender, stream)
+        if key in self.finished:
+            self.duplicates += 1
+            return
+        s = self.streams.get(key)
+        if s is None:
+            if abs(time.time() - stream_time(stream)) > self.max_age:
+                self.stale += 1
+                return
+            s = self.streams[key] = Incoming(self.opener(addr, sender, stream), now)
+            while len(self.streams) > self.max_streams:
+                self.fail(next(iter(self.streams)))
+        if index < s.next or index in s.early:
+            self.duplicates += 1
+            return
+        s.updated = now
+        self.streams.move_to_end(key)
+        if last:
+            s.last = index
+        if index != s.next:
+            s.early[index] = data
+            if len(s.early) > self.window:
+                self.fail(key)
+            return
+        s.sink.write(data)
+        s.next += 1
+        while s.next in s.early:
+            s.sink.write(s.early.pop(s.next))
+            s.next += 1
+        if s.next - 1 == s.last:
+            del self.streams[key]
+            self.finished[key] = now
+            self.completed += 1
+            s.sink.close()
+
+    def fail(self, key: StreamKey):
+        s = self.streams.pop(key)
+        self.finished[key] = time.monotonic()
+        self.failed += 1
+        s.sink.abort()
+
+    def expire(self, now: Optional[float] = None):
+        if now is None:
+            now = time.monotonic()
+        deadline = now - self.timeout
+        while self.streams:
+            key, s = next(iter(self.streams.items()))
+            if s.updated >= deadline:
+                break
+            self.fail(key)
+        # By now a replay would be refused as stale
+        forget = now - max(self.timeout, 2 * self.max_age)
+        while self.finished:
+            key, updated = next(iter(self.finished.items()))
+            if updated >= forget:
+                break
+            del self.finished[key]
+
+    def close(self):
+        while self.streams:
+            self.fail(next(iter(self.streams)))
+
+
+__all__ = ['StreamSink', 'FileSink', 'StreamTable', 'CHUNK_SIZE']
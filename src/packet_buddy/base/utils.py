@@ -1,8 +1,126 @@
+import socket
+import struct
+import weakref
+from contextlib import contextmanager
+from threading import Lock, RLock, local
+from typing import Optional, Dict, Iterator, List, Tuple
+
 PACKET_MAX = 65535
 
 
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40)  # Linux value, missing from older Pythons
+_DROPS = struct.Struct('=I')
+ANCILLARY_SIZE = socket.CMSG_SPACE(_DROPS.size)
+
+
 def make_socket(protocol: int):
-    import socket
     s = socket.socket(socket.AF_INET, socket.SOCK_RAW, protocol)
     s.setsockopt(socket.SOL_IP, socket.IP_HDRINCL, 1)
     return s
+
+
+def report_overflow(s: socket.socket) -> bool:
+    """
+    Makes the kernel attach the count of packets it dropped on the socket to every packet read
+    """
+    try:
+        s.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+        return True
+    except OSError:
+        return False
+
+
+def overflow(ancillary: List[Tuple[int, int, bytes]]) -> Optional[int]:
+    """
+    Packets dropped on the socket so far as reported with a packet, see ``report_overflow``
+    """
+    for level, kind, data in ancillary:
+        if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= _DROPS.size:
+            return _DROPS.unpack_from(data)[0]
+    return None
+
+
+class BufferPool:
+    """
+    Preallocated receive buffers reused for every batch of packets
+    """
+    __slots__ = ['buffers', 'views', 'sizes', 'addresses']
+
+    def __init__(self, count: int, size: int = PACKET_MAX):
+        self.buffers = [bytearray(size) for _ in range(count)]
+        self.views = [memoryview(b) for b in self.buffers]
+        self.sizes = [0] * count
+        self.addresses = [None] * count
+
+
+class _ThreadSockets(dict):
+    """
+    Sockets of a single thread by protocol, ``owned`` outlives it so that a finalizer can close them
+    """
+
+    def __init__(self):
+        super(_ThreadSockets, self).__init__()
+        self.owned: List[socket.socket] = []
+
+
+class SocketPool:
+    """
+    Long lived raw send sockets, one per carrier protocol or one per carrier protocol and thread
+
+    Shared sockets are guarded by a lock so that a batch of packets from one thread is not
+    interleaved with packets from another. The sockets of a thread are closed once the thread
+    exits and its locals are gone, the pool lock is reentrant as that may happen while it is held.
+    """
+
+    def __init__(self, per_thread: bool = False, sndbuf: Optional[int] = None):
+        self.per_thread = per_thread
+        self.sndbuf = sndbuf
+        self.lock = RLock()
+        self.local = local()
+        self.shared: Dict[int, socket.socket] = dict()
+        self.locks: Dict[int, Lock] = dict()
+        self.sockets: List[socket.socket] = list()
+
+    def _new(self, protocol: int) -> socket.socket:
+        s = make_socket(protocol)
+        if self.sndbuf is not None:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        self.sockets.append(s)
+        return s
+
+    def _release(self, sockets: List[socket.socket]):
+        with self.lock:
+            for s in sockets:
+                if s in self.sockets:
+                    self.sockets.remove(s)
+                    s.close()
+
+    @contextmanager
+    def acquire(self, protocol: int) -> Iterator[socket.socket]:
+        if self.per_thread:
+            sockets = getattr(self.local, 'sockets', None)
+            if sockets is None:
+                sockets = self.local.sockets = _ThreadSockets()
+                weakref.finalize(sockets, self._release, sockets.owned)
+            if protocol not in sockets:
+                with self.lock:
+                    sockets[protocol] = self._new(protocol)
+                sockets.owned.append(sockets[protocol])
+            yield sockets[protocol]
+        else:
+            with self.lock:
+                if protocol not in self.shared:
+                    self.locks[protocol] = Lock()
+                    self.shared[protocol] = self._new(protocol)
+                s, lock = self.shared[protocol], self.locks[protocol]
+            with lock:
+                yield s
+
+    def close(self):
+        with self.lock:
+            for s in self.sockets:
+                s.close()
+            self.sockets.clear()
+            self.shared.clear()
+            self.locks.clear()
+            self.local = local()
@@ -1,7 +1,13 @@
+import os
+
 from ..base import IPMessager, Data, Message
 
 m = IPMessager[Data](69, b'super duper secret key! Encrypt!', 16, protocol='icmp-pl')
 
+# Prometheus metrics on localhost, e.g. METRICS_PORT=9464
+if os.environ.get('METRICS_PORT'):
+    m.metrics.serve(int(os.environ['METRICS_PORT']))
+
 
 def on_message(message: Message):
     m.message[Data(sender="server", topic="server reply", content=message.payload.content)] >> message.target
@@ -0,0 +1,76 @@
+import asyncio
+import secrets
+import selectors
+from asyncio import selector_events
+
+import pytest
+
+from packet_buddy.base import AsyncIPMessager, Data, Pacer, StreamSink, message
+
+SECRET = b'super duper secret key! Encrypt!'
+TIMEOUT = 10
+COUNT = 5
+
+
+async def exchange():
+    async with AsyncIPMessager[Data](2, SECRET, 1024, 'icmp-pl') as rx, \
+            AsyncIPMessager[Data](1, SECRET, 1024, 'icmp-pl', sndbuf=4096) as tx:
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        ticker = asyncio.create_task(tick())
+        # Messages of several packets through a small send buffer, the loop keeps running meanwhile
+        await asyncio.gather(*(
+            tx.message[message('a', 'b', f'{i:04}' + secrets.token_hex(2048))] >> ('127.0.0.1', 0) for i in range(COUNT)
+        ))
+        received = set()
+        async for m in rx:
+            received.add(m.payload.content[:4])
+            if len(received) == COUNT:
+                break
+        ticker.cancel()
+        return received, ticks
+
+
+@pytest.mark.parametrize('native', [True, False])
+def test_send_does_not_block_loop(monkeypatch, native):
+    if not native:
+        # The fallback for Python before 3.11
+        for cls in (selector_events.BaseSelectorEventLoop, asyncio.AbstractEventLoop):
+            monkeypatch.delattr(cls, 'sock_sendto', raising=False)
+    loop = asyncio.SelectorEventLoop(selectors.DefaultSelector())
+    try:
+        received, ticks = loop.run_until_complete(asyncio.wait_for(exchange(), TIMEOUT))
+    finally:
+        loop.close()
+    assert received == {f'{i:04}' for i in range(COUNT)}
+    assert ticks > 0
+
+
+class Sink(StreamSink):
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data: bytes):
+        self.data += data
+
+
+async def stream(source: bytes) -> bytes:
+    sinks = []
+    opener = lambda *_: sinks.append(Sink()) or sinks[-1]
+    async with AsyncIPMessager[Data](2, SECRET, 1024, 'icmp-pl', streams=opener) as rx, \
+            AsyncIPMessager[Data](1, SECRET, 1024, 'icmp-pl', pacer=Pacer(packets_per_second=500, burst=4)) as tx:
+        await tx.stream([source], ('127.0.0.1', 0), chunk_size=1000, workers=2)
+        while not rx.incoming.completed:
+            await asyncio.sleep(.01)
+        return bytes(sinks[0].data)
+
+
+def test_stream():
+    source = secrets.token_bytes(5500)
+    assert asyncio.run(asyncio.wait_for(stream(source), TIMEOUT)) == source
@@ -0,0 +1,114 @@
+from enum import Enum, IntEnum
+from typing import List, Optional
+
+import pytest
+from pydantic import BaseModel, Field, validator
+
+from packet_buddy.base import Data
+from packet_buddy.base.binary import BINARY, MARKER, supported
+from packet_buddy.base.interface import JSON
+
+
+class Level(IntEnum):
+    LOW = 1
+    HIGH = 2
+
+
+class Colour(str, Enum):
+    RED = 'red'
+    BLUE = 'blue'
+
+
+class Size(Enum):
+    SMALL = 1
+    LARGE = 10
+
+
+class Name(str):
+    pass
+
+
+class Count(int):
+    pass
+
+
+class Point(BaseModel):
+    x: float
+    y: float
+
+
+class Reading(BaseModel):
+    sensor: str
+    value: int
+    ok: bool
+    ratio: float
+    raw: bytes
+    note: Optional[str] = None
+    tags: List[str] = []
+    points: List[Point] = []
+    level: Level = Level.LOW
+    colour: Colour = Colour.RED
+    size: Optional[Size] = None
+    name: Name = Name('')
+    count: Count = Count(0)
+    unit: str = Field('c', alias='u')
+
+    class Config:
+        allow_population_by_field_name = True
+
+    @validator('sensor')
+    def lower(cls, v):
+        return v.lower()
+
+
+def round_trip(payload: BaseModel) -> BaseModel:
+    data = BINARY.encode(payload)
+    assert data[0] == MARKER
+    return BINARY.parser(type(payload))(data)
+
+
+@pytest.mark.parametrize('payload', [
+    Reading(sensor='a', value=-5, ok=True, ratio=.5, raw=b'\x00ab', u='k'),
+    Reading(
+        sensor='Probe-7', value=1 << 40, ok=False, ratio=-1e9, raw=b'', note='n', tags=['x', ''],
+        points=[Point(x=1, y=2)], level=Level.HIGH, colour=Colour.BLUE, size=Size.LARGE,
+        name=Name('n'), count=Count(3),
+    ),
+])
+def test_round_trip_matches_json(payload):
+    assert supported(Reading) is not None
+    decoded = round_trip(payload)
+    assert decoded == payload
+    assert decoded == JSON.parser(Reading)(JSON.encode(payload))
+    assert isinstance(decoded.level, Level) and isinstance(decoded.colour, Colour)
+
+
+def test_validators_run_on_decode():
+    payload = Reading.construct(sensor='LOUD', value=1, ok=True, ratio=0., raw=b'', note=None, tags=[], points=[],
+                                level=Level.LOW, colour=Colour.RED, size=None, name=Name(''), count=Count(0), unit='c')
+    assert round_trip(payload).sensor == 'loud'
+
+
+def test_invalid_values_are_rejected():
+    payload = Reading.construct(sensor='a', value=1, ok=True, ratio=0., raw=b'', note=None, tags=[], points=[],
+                                level=7, colour=Colour.RED, size=None, name=Name(''), count=Count(0), unit='c')
+    with pytest.raises(ValueError):
+        round_trip(payload)
+
+
+def test_data_round_trip():
+    payload = Data(sender='a', topic='b', content='hello')
+    assert round_trip(payload) == payload
+
+
+def test_json_payloads_still_decode():
+    payload = Reading(sensor='a', value=1, ok=True, ratio=0., raw=b'x')
+    assert BINARY.parser(Reading)(JSON.encode(payload)) == payload
+
+
+def test_malformed_payload():
+    data = BINARY.encode(Reading(sensor='a', value=1, ok=True, ratio=0., raw=b'x'))
+    with pytest.raises(ValueError):
+        BINARY.parser(Reading)(data[:-3])
+    with pytest.raises(ValueError):
+        BINARY.parser(Reading)(data + b'\x00')
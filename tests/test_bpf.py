@@ -0,0 +1,111 @@
+import os
+from typing import List
+
+import pytest
+
+from packet_buddy.base.bpf import (
+    Instruction, BPF_LD, BPF_LDX, BPF_ALU, BPF_JMP, BPF_RET, BPF_B, BPF_K, BPF_ABS, BPF_IND, BPF_MSH,
+    BPF_AND, BPF_JEQ, BPF_JGT, BPF_JSET, ACCEPT, REJECT,
+)
+from packet_buddy.base.ip import PROTO_FUNC_MAP, PROTO_FILTER_MAP, PROTO_BPF_MAP, PAYLOAD_CARRIERS
+from packet_buddy.base.ip_utils import Shifter, Protocol, TIMESTAMP_OPTION, OPTION_HEADER_SIZE
+from packet_buddy.base.packets import IP_HEADER_SIZE, ICMP_HEADER_SIZE, ICMP_ECHO_REQUEST
+
+SECRET = b'super duper secret key! Encrypt!'
+TARGET = '127.0.0.1'
+
+
+def run(program: List[Instruction], packet: bytes) -> int:
+    """
+    Classic BPF as the kernel runs it on a raw socket, a load past the end of the packet rejects it
+    """
+    a = x = pc = 0
+    while True:
+        code, jt, jf, k = program[pc]
+        pc += 1
+        if code in (BPF_LD | BPF_B | BPF_ABS, BPF_LD | BPF_B | BPF_IND, BPF_LDX | BPF_B | BPF_MSH):
+            offset = k + x if code == BPF_LD | BPF_B | BPF_IND else k
+            if offset >= len(packet):
+                return REJECT
+            if code == BPF_LDX | BPF_B | BPF_MSH:
+                x = (packet[offset] & 0x0f) << 2
+            else:
+                a = packet[offset]
+        elif code == BPF_ALU | BPF_AND | BPF_K:
+            a &= k
+        elif code in (BPF_JMP | BPF_JEQ | BPF_K, BPF_JMP | BPF_JGT | BPF_K, BPF_JMP | BPF_JSET | BPF_K):
+            taken = {BPF_JEQ: a == k, BPF_JGT: a > k, BPF_JSET: a & k != 0}[code & 0xf0]
+            pc += jt if taken else jf
+        elif code == BPF_RET | BPF_K:
+            return k
+        else:
+            raise ValueError(f'Unexpected instruction {code:#x}')
+
+
+def packet(carrier: str) -> bytearray:
+    frame = next(iter(Shifter.encode_message(
+        os.urandom(100), 1, secret=SECRET, bytes_per_option=16, payload=carrier in PAYLOAD_CARRIERS,
+    )))
+    return bytearray(PROTO_FUNC_MAP[carrier](TARGET, bytes(frame)))
+
+
+def prelude(carrier: str) -> int:
+    if carrier in PAYLOAD_CARRIERS:
+        return IP_HEADER_SIZE + ICMP_HEADER_SIZE - OPTION_HEADER_SIZE
+    return IP_HEADER_SIZE
+
+
+def no_option(carrier: str, p: bytearray) -> bytearray:
+    if carrier in PAYLOAD_CARRIERS:
+        p[prelude(carrier):prelude(carrier) + OPTION_HEADER_SIZE] = b'\x00\x01\x00\x01'
+        return p
+    return bytearray([0x45]) + p[1:IP_HEADER_SIZE] + p[(p[0] & 0x0f) << 2:]
+
+
+def other_option(carrier: str, p: bytearray) -> bytearray:
+    p[prelude(carrier)] = 0x07
+    return p
+
+
+def no_prefix(carrier: str, p: bytearray) -> bytearray:
+    p[prelude(carrier) + OPTION_HEADER_SIZE] &= ~Protocol.PREFIX & 0xff
+    return p
+
+
+def reply(carrier: str, p: bytearray) -> bytearray:
+    p[IP_HEADER_SIZE] = 0
+    return p
+
+
+def short(carrier: str, p: bytearray) -> bytearray:
+    return p[:prelude(carrier) + OPTION_HEADER_SIZE]
+
+
+@pytest.mark.parametrize('carrier', sorted(PROTO_BPF_MAP))
+def test_accepts_frames(carrier):
+    p = packet(carrier)
+    assert p[prelude(carrier)] == TIMESTAMP_OPTION
+    assert run(PROTO_BPF_MAP[carrier](), bytes(p)) == ACCEPT
+    assert PROTO_FILTER_MAP[carrier](bytes(p))
+
+
+@pytest.mark.parametrize('mangle', [no_option, other_option, no_prefix, short])
+@pytest.mark.parametrize('carrier', sorted(PROTO_BPF_MAP))
+def test_drops_foreign_packets(carrier, mangle):
+    p = bytes(mangle(carrier, packet(carrier)))
+    assert run(PROTO_BPF_MAP[carrier](), p) == REJECT
+    assert not PROTO_FILTER_MAP[carrier](p)
+
+
+def test_drops_echo_replies():
+    p = packet('icmp-pl')
+    assert p[IP_HEADER_SIZE] == ICMP_ECHO_REQUEST
+    p = bytes(reply('icmp-pl', p))
+    assert run(PROTO_BPF_MAP['icmp-pl'](), p) == REJECT
+    assert not PROTO_FILTER_MAP['icmp-pl'](p)
+
+
+def test_option_program_ignores_payload_prelude():
+    # A payload frame behind a plain IP header has no options for the option program to find
+    p = bytes(packet('icmp-pl'))
+    assert run(PROTO_BPF_MAP['ip-icmp'](), p) == REJECT
@@ -0,0 +1,53 @@
+import os
+import struct
+
+import pytest
+
+from packet_buddy.base.capture import Capture, CaptureDecoder, LINKTYPE_RAW, np
+from packet_buddy.base.ip import PROTO_FUNC_MAP
+from packet_buddy.base.ip_utils import Shifter
+
+SECRET = b'super duper secret key! Encrypt!'
+TARGET = '127.0.0.1'
+
+
+def record(packet: bytes) -> bytes:
+    return struct.pack('<IIII', 0, 0, len(packet), len(packet)) + packet
+
+
+@pytest.mark.parametrize('vectorized', [False, True] if np is not None else [False])
+def test_frames_stay_within_packet(tmp_path, vectorized):
+    frame = bytes(next(iter(Shifter.encode_message(b'x' * 100, 1, secret=SECRET, bytes_per_option=32))))
+    packet = bytearray(PROTO_FUNC_MAP['ip-icmp'](TARGET, frame))
+    # An option length past the end of the packet, the next record follows right after
+    packet[21] = 0xff
+    path = tmp_path / 'capture.pcap'
+    path.write_bytes(
+        struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 0xffff, LINKTYPE_RAW)
+        + record(bytes(packet)) * 2
+    )
+    decoder = CaptureDecoder(SECRET, vectorized=vectorized)
+    with Capture(str(path)) as capture:
+        found = list(decoder.locate(capture))
+    assert len(found) == 2
+    _, ip, _, end = found[0]
+    assert end == ip + len(packet)
+
+
+@pytest.mark.parametrize('vectorized', [False, True] if np is not None else [False])
+def test_conversations_with_same_serial(tmp_path, vectorized):
+    sent = {target: os.urandom(200) for target in ('10.0.0.2', '10.0.0.3')}
+    packets = [
+        [
+            PROTO_FUNC_MAP['ip-udp'](target, bytes(f))
+            for f in Shifter.encode_message(data, 1, secret=SECRET, bytes_per_option=16, serial=7)
+        ]
+        for target, data in sent.items()
+    ]
+    path = tmp_path / 'capture.pcap'
+    path.write_bytes(
+        struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 0xffff, LINKTYPE_RAW)
+        + b''.join(record(p) for pair in zip(*packets) for p in pair)
+    )
+    received = {m.target: m.data for m in CaptureDecoder(SECRET, vectorized=vectorized).messages(str(path))}
+    assert received == sent
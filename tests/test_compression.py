@@ -0,0 +1,31 @@
+import pytest
+
+from packet_buddy.base.compression import Codec, Compressor, DECOMPRESSED_MAX, train
+
+BPO = 1400
+
+
+@pytest.mark.parametrize('dictionary', [None, train([b'status ok temperature reading'] * 4)])
+def test_largest_payload_round_trips(dictionary):
+    c = Compressor(True, dictionary)
+    data = b'a' * DECOMPRESSED_MAX
+    codec, compressed = c.compress(data, BPO)
+    assert codec != Codec.NONE
+    assert c.decompress(codec, compressed) == data
+
+
+def test_larger_payloads_are_sent_uncompressed():
+    c = Compressor(True)
+    data = b'a' * (DECOMPRESSED_MAX + 1)
+    assert c.compress(data, BPO) == (Codec.NONE, data)
+    assert c.skipped == 1
+    assert c.decompress(Codec.NONE, data) == data
+
+
+def test_receivers_refuse_larger_payloads():
+    c = Compressor(True)
+    # What an older sender would have sent
+    z = c._compressor(Codec.ZLIB)
+    compressed = z.compress(b'a' * (DECOMPRESSED_MAX + 1)) + z.flush()
+    with pytest.raises(ValueError):
+        c.decompress(Codec.ZLIB, compressed)
@@ -0,0 +1,90 @@
+import heapq
+import time
+from collections import deque
+
+import pytest
+
+from packet_buddy.base.reliability import Path, DECREASE, MIN_WINDOW
+
+CAPACITY = 500.
+DELAY = .02
+QUEUE = 16
+STEP = .001
+
+
+def bottleneck(seconds: float):
+    """
+    Sends as much as the path allows through a link forwarding CAPACITY packets per second
+
+    Runs on a simulated clock. Packets that find the queue of the link full are lost, which the
+    sender learns a round trip later from the acknowledgements of the packets behind them.
+    Returns the path, the packets sent and lost in the second half of the run and the window
+    before and after every loss.
+    """
+    path = Path(64)
+    start = now = path.bucket.updated
+    departures = deque()
+    events = []
+    sent = lost = 0
+    halved = []
+    while now - start < seconds:
+        while events and events[0][0] <= now:
+            _, stamp, dropped = heapq.heappop(events)
+            path.inflight -= 1
+            if dropped:
+                before, recovering = path.window, now < path.recovery
+                path.congested(now)
+                if not recovering:
+                    halved.append((before, path.window))
+            else:
+                path.sample(now - stamp)
+                path.acked(1)
+        while departures and departures[0] <= now:
+            departures.popleft()
+        budget = path.budget(now)
+        settled = now - start >= seconds / 2
+        for _ in range(max(budget, 0)):
+            sent += settled
+            if len(departures) >= QUEUE:
+                lost += settled
+                heapq.heappush(events, (now + 2 * DELAY, now, True))
+            else:
+                departure = max(now, departures[-1] if departures else now) + 1 / CAPACITY
+                departures.append(departure)
+                heapq.heappush(events, (departure + 2 * DELAY, now, False))
+        path.inflight += max(budget, 0)
+        path.spend(max(budget, 0))
+        now += STEP
+    return path, sent, lost, halved
+
+
+def test_rate_converges_below_bottleneck():
+    seconds = 10.
+    path, sent, lost, _ = bottleneck(seconds)
+    rate = sent / (seconds / 2)
+    # Probes the capacity now and then but stays just below it instead of overflowing the queue
+    assert .8 * CAPACITY < rate < 1.05 * CAPACITY
+    assert (sent - lost) / (seconds / 2) <= CAPACITY
+    assert 0 < lost < .02 * sent
+    assert path.rate == pytest.approx(CAPACITY, rel=.5)
+
+
+def test_window_halves_on_loss():
+    _, _, _, halved = bottleneck(5.)
+    assert halved
+    for before, after in halved:
+        assert after == pytest.approx(max(before * DECREASE, MIN_WINDOW))
+
+
+def test_losses_halve_once_per_round_trip():
+    path = Path(64)
+    path.sample(.1)
+    path.window = 32.
+    now = time.monotonic()
+    path.congested(now)
+    path.congested(now + .05)
+    assert path.window == 16.
+    path.congested(now + .2)
+    assert path.window == 8.
+    path.timeout()
+    assert path.window == MIN_WINDOW
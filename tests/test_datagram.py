@@ -0,0 +1,134 @@
+import socket
+import threading
+import time
+
+from packet_buddy.base import DatagramMessager, Data, message
+from packet_buddy.base.interface import PayloadCodec
+from packet_buddy.base.ip_utils import Shifter
+from packet_buddy.base.session import Session
+
+SECRET = b'super duper secret key! Encrypt!'
+OTHER = b'some other secret key! Encrypt!!'
+TIMEOUT = 5
+
+
+def wait(condition, timeout: float = TIMEOUT) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(.001)
+    return condition()
+
+
+def test_bad_frame_does_not_stop_receiver():
+    rx = DatagramMessager[Data](2, SECRET, ('127.0.0.3', 0))
+    tx = DatagramMessager[Data](1, SECRET, ('127.0.0.2', 0))
+    received = []
+    receiver = threading.Thread(target=rx.receive, args=(lambda m: received.append(m.payload.content),), daemon=True)
+    receiver.start()
+    try:
+        # A well formed frame sealed with the wrong secret fails to verify
+        forged = Shifter.encode_message(b'forged', 1, secret=OTHER, bytes_per_option=1024, serial=0, payload=True)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.bind(('127.0.0.2', 0))
+            for frame in forged:
+                s.sendto(bytes(frame), rx.address)
+        assert wait(lambda: rx.invalid == 1)
+        assert rx.stats()['failed_verification'] == 1
+
+        m = tx.message[message('a', 'b', 'hello')]
+        m.target = rx.address
+        tx.send(m)
+        assert wait(lambda: received == ['hello'])
+        assert receiver.is_alive()
+    finally:
+        tx.close()
+        rx.close()
+
+
+def test_raising_callback_does_not_stop_dispatcher(caplog):
+    rx = DatagramMessager[Data](2, SECRET, ('127.0.0.3', 0))
+    tx = DatagramMessager[Data](1, SECRET, ('127.0.0.2', 0))
+    received = []
+
+    def callback(m):
+        if m.payload.content == 'boom':
+            raise RuntimeError(m.payload.content)
+        received.append(m.payload.content)
+
+    threading.Thread(target=rx.receive, args=(callback,), kwargs=dict(workers=2), daemon=True).start()
+    try:
+        for content in ('boom', 'hello'):
+            m = tx.message[message('a', 'b', content)]
+            m.target = rx.address
+            tx.send(m)
+        assert wait(lambda: received == ['hello'])
+        assert 'Callback failed' in caplog.text
+    finally:
+        tx.close()
+        rx.close()
+
+
+def test_receiver_catches_up_after_long_gap():
+    options = dict(sessions=True, implicit_nonce=True)
+    rx = DatagramMessager[Data](2, SECRET, ('127.0.0.3', 0), **options)
+    tx = DatagramMessager[Data](1, SECRET, ('127.0.0.2', 0), **options)
+    received = []
+    threading.Thread(target=rx.receive, args=(lambda m: received.append(m.payload.content),), daemon=True).start()
+    threading.Thread(target=tx.receive, args=(lambda m: None,), daemon=True).start()
+
+    def send(content: str):
+        m = tx.message[message('a', 'b', content)]
+        m.target = rx.address
+        tx.send(m)
+        time.sleep(.001)
+
+    try:
+        send('first')
+        assert wait(lambda: received == ['first'])
+        # Messages lost on the way, more than half a serial span
+        for _ in range(200):
+            tx.next_counter(rx.address[0])
+        contents = [str(i) for i in range(2 * Session.RESYNC)]
+        for content in contents:
+            send(content)
+        tail = contents[-Session.RESYNC:]
+        assert wait(lambda: received[-len(tail):] == tail)
+    finally:
+        tx.close()
+        rx.close()
+
+
+class Prefixed(PayloadCodec):
+    """
+    JSON behind a prefix only the configured instance knows
+    """
+
+    def __init__(self, prefix: bytes):
+        self.prefix = prefix
+
+    def encode(self, payload):
+        return self.prefix + super(Prefixed, self).encode(payload)
+
+    def parser(self, payload_type):
+        parse = super(Prefixed, self).parser(payload_type)
+        return lambda data: parse(bytes(data)[len(self.prefix):])
+
+
+def test_workers_parse_with_configured_codec():
+    rx = DatagramMessager[Data](2, SECRET, ('127.0.0.3', 0), payload_codec=Prefixed(b'v1:'))
+    tx = DatagramMessager[Data](1, SECRET, ('127.0.0.2', 0), payload_codec=Prefixed(b'v1:'))
+    received = []
+    receiver = threading.Thread(
+        target=rx.receive, args=(lambda m: received.append(m.payload.content),), kwargs=dict(workers=2), daemon=True,
+    )
+    receiver.start()
+    try:
+        m = tx.message[message('a', 'b', 'hello')]
+        m.target = rx.address
+        tx.send(m)
+        assert wait(lambda: received == ['hello'])
+    finally:
+        tx.close()
+        rx.close()
+    receiver.join(TIMEOUT)
+    assert not any(t.name.endswith('(dispatch)') for t in threading.enumerate())
@@ -0,0 +1,41 @@
+import threading
+
+import pytest
+
+from packet_buddy.base import IPMessager, Data, ip
+from packet_buddy.base.ip_utils import LENGTH_MASK
+
+SECRET = b'super duper secret key! Encrypt!'
+
+
+def test_payload_carriers_take_any_bpo():
+    # Payload frames do not use the length byte of an option
+    with IPMessager[Data](1, SECRET, 64, 'icmp-pl'):
+        pass
+
+
+@pytest.mark.parametrize('protocol', ['ip-icmp', 'ip-udp'])
+def test_option_carriers_limit_bpo(protocol):
+    with pytest.raises(ValueError):
+        IPMessager[Data](1, SECRET, LENGTH_MASK + 1, protocol, sequenced=False)
+
+
+@pytest.mark.parametrize('protocol', ['ip-icmp', 'ip-udp'])
+def test_large_options_default_to_unsequenced(protocol):
+    with IPMessager[Data](1, SECRET, 32, protocol) as m:
+        assert not m.sequenced
+    with IPMessager[Data](1, SECRET, 28, protocol) as m:
+        assert m.sequenced
+    with pytest.raises(ValueError):
+        IPMessager[Data](1, SECRET, 32, protocol, sequenced=True)
+
+
+def test_receive_closes_pipeline(monkeypatch):
+    def fail(_):
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(ip, 'report_overflow', fail)
+    with IPMessager[Data](1, SECRET, 16, 'icmp-pl') as m:
+        with pytest.raises(KeyboardInterrupt):
+            m.receive(lambda _: None, workers=2)
+    assert not any(t.name.endswith('(dispatch)') for t in threading.enumerate())
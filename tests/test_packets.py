@@ -0,0 +1,41 @@
+import os
+from typing import List, Optional, get_args
+
+import pytest
+
+from packet_buddy.base.ip import PROTO_FUNC_MAP, SCAPY_FUNC_MAP, PAYLOAD_CARRIERS
+from packet_buddy.base.ip_utils import Shifter, BPO, SEQUENCED_BPO_MAX
+
+SECRET = b'super duper secret key! Encrypt!'
+TARGETS = ['127.0.0.1', '127.3.4.5', '10.1.2.3', '192.168.255.254', '8.8.8.8']
+SIZES = [1, 50, 333]
+
+
+def frames(carrier: str, bpo: int, size: int, serial: Optional[int]) -> List[bytes]:
+    return [
+        bytes(f) for f in Shifter.encode_message(
+            os.urandom(size), 3,
+            secret=SECRET,
+            bytes_per_option=bpo,
+            serial=serial,
+            payload=carrier in PAYLOAD_CARRIERS,
+        )
+    ]
+
+
+@pytest.mark.parametrize('target', TARGETS)
+@pytest.mark.parametrize('bpo', get_args(BPO))
+@pytest.mark.parametrize('carrier', sorted(PROTO_FUNC_MAP))
+def test_matches_scapy(carrier, bpo, target):
+    for size in SIZES:
+        for serial in (None, 0xab):
+            if serial is not None and carrier not in PAYLOAD_CARRIERS and bpo > SEQUENCED_BPO_MAX:
+                continue
+            for f in frames(carrier, bpo, size, serial):
+                assert PROTO_FUNC_MAP[carrier](target, f) == SCAPY_FUNC_MAP[carrier](target, f)
+
+
+@pytest.mark.parametrize('target', TARGETS)
+def test_full_payload_frames_match_scapy(target):
+    for f in frames('icmp-pl', 1400, 4000, 1):
+        assert PROTO_FUNC_MAP['icmp-pl'](target, f) == SCAPY_FUNC_MAP['icmp-pl'](target, f)
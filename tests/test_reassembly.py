@@ -0,0 +1,124 @@
+import random
+import string
+from collections import Counter
+
+import pytest
+
+from packet_buddy.base import IPMessager, Data, message, Pacer
+from packet_buddy.base.interface import Target
+from packet_buddy.base.ip_utils import Shifter
+from packet_buddy.base.reassembly import Reassembler
+
+SECRET = b'super duper secret key! Encrypt!'
+SENDERS = 4
+ADDR = ('10.0.0.1', 0)
+
+
+def fragments(size: int, serial: int, sender: int = 1):
+    return [bytes(f) for f in Shifter.encode_message(bytes(size), sender, secret=SECRET, bytes_per_option=16, serial=serial)]
+
+
+def test_fragments_are_placed_by_index():
+    r = Reassembler(0)
+    parts = fragments(100, 1)
+    order = [3, 0, len(parts) - 1, *range(1, len(parts) - 1)]
+    order = list(dict.fromkeys(order))
+    assert all(r.add(memoryview(parts[i]), ADDR, now=0.) is None for i in order[:-1])
+    assert r.add(memoryview(parts[order[-1]]), ADDR, now=0.) == parts
+    assert (len(r.cache), r.buffered) == (0, 0)
+
+
+def test_duplicates_are_dropped():
+    r = Reassembler(0)
+    parts = fragments(100, 1)
+    r.add(memoryview(parts[0]), ADDR, now=0.)
+    r.add(memoryview(parts[0]), ADDR, now=0.)
+    assert r.duplicates == 1
+    assert r.buffered == len(parts[0])
+    for p in parts[1:]:
+        r.add(memoryview(p), ADDR, now=0.)
+    # Late duplicates of a completed message do not open it again
+    assert r.add(memoryview(parts[0]), ADDR, now=0.) is None
+    assert r.duplicates == 2
+    assert not r.cache
+
+
+def test_changed_total_reopens_transaction():
+    r = Reassembler(0)
+    old = fragments(100, 1)
+    new = fragments(200, 1)
+    assert len(old) != len(new)
+    for p in old[:-1]:
+        r.add(memoryview(p), ADDR, now=0.)
+    # The sender started over with a different message under the same serial
+    results = [r.add(memoryview(p), ADDR, now=0.) for p in new]
+    assert results[-1] == new
+    assert r.add(memoryview(old[-1]), ADDR, now=0.) is None
+    assert (len(r.cache), r.buffered) == (0, 0)
+
+
+@pytest.mark.parametrize('protocol, bpo, count', [('icmp-pl', 0, 400), ('ip-udp', 24, 200)])
+def test_interleaved_messages_arrive_once(protocol, bpo, count):
+    rng = random.Random(1)
+    options = dict(pacer=Pacer(), mtu=1500)
+    rx = IPMessager[Data](0, SECRET, bpo, protocol, **options)
+    senders = [IPMessager[Data](i, SECRET, bpo, protocol, **options) for i in range(1, SENDERS + 1)]
+    timeline = []
+    contents = []
+    fragmented = 0
+    for i in range(count):
+        tx = senders[i % SENDERS]
+        content = f'{i:06}' + ''.join(rng.choices(string.ascii_letters, k=rng.randint(0, 3000)))
+        contents.append(content)
+        m = tx.message[message('a', 'b', content)]
+        m.target = Target(('10.0.0.2', 0))
+        packets = tx.packets(m)
+        fragmented += len(packets) > 1
+        packets += rng.sample(packets, len(packets) // 4)
+        # Scattered over the fragments of the 25 messages per sender around it
+        timeline += [(i + rng.uniform(0, 25 * SENDERS), bytes(p)) for p in packets]
+    timeline.sort(key=lambda e: e[0])
+    received = []
+    for _, p in timeline:
+        m = rx.handle(memoryview(p), ('10.0.0.1', 0))
+        if m is not None:
+            received.append(m.payload.content)
+    assert fragmented > count // 2
+    assert Counter(received) == Counter(contents)
+    assert rx.reassembler.evicted == 0
+
+
+def test_transactions_expire():
+    r = Reassembler(0, timeout=5.)
+    parts = fragments(100, 1)
+    other = fragments(100, 2)[0]
+    r.add(memoryview(parts[0]), ADDR, now=0.)
+    r.add(memoryview(other), ADDR, now=4.)
+    r.expire(6.)
+    assert r.expired == 1
+    assert list(r.cache) == [(1, *ADDR, 2)]
+    assert r.buffered == len(other)
+    # What is left of the expired message no longer completes it
+    assert all(r.add(memoryview(p), ADDR, now=6.) is None for p in parts[1:])
+
+
+def test_least_recently_active_is_evicted_at_max_transactions():
+    r = Reassembler(0, max_transactions=2)
+    first = [fragments(100, serial)[0] for serial in range(3)]
+    r.add(memoryview(first[0]), ADDR, now=0.)
+    r.add(memoryview(first[1]), ADDR, now=1.)
+    # Activity on serial 0 makes serial 1 the least recently active
+    r.add(memoryview(fragments(100, 0)[1]), ADDR, now=2.)
+    r.add(memoryview(first[2]), ADDR, now=3.)
+    assert r.evicted == 1
+    assert [tid[-1] for tid in r.cache] == [0, 2]
+
+
+def test_least_recently_active_is_evicted_at_max_bytes():
+    size = len(fragments(100, 0)[0])
+    r = Reassembler(0, max_bytes=3 * size)
+    for serial in range(4):
+        r.add(memoryview(fragments(100, serial)[0]), ADDR, now=float(serial))
+    assert r.evicted == 1
+    assert [tid[-1] for tid in r.cache] == [1, 2, 3]
+    assert r.buffered == 3 * size
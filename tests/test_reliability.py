@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import pytest
+
+from packet_buddy.base import DatagramMessager, Data, Pacer, message
+from packet_buddy.base.ip_utils import VerificationError
+from packet_buddy.base.reliability import (
+    Path, Retransmitter, encode_ack, decode_ack, ack_key, received, ACK_RANGES_MAX, INITIAL_RTO, MIN_RTO, MAX_RTO,
+)
+
+SECRET = b'super duper secret key! Encrypt!'
+OTHER = b'some other secret key! Encrypt!!'
+TARGET = ('10.0.0.2', 0)
+SERIAL = 7
+TIMEOUT = 5
+
+
+@pytest.mark.parametrize('payload', [False, True])
+def test_ack_round_trip(payload):
+    ranges = [(i * 8, i * 8 + 4) for i in range(ACK_RANGES_MAX)]
+    frame = encode_ack(2, 1, 200, ranges, ack_key(SECRET), payload=payload)
+    assert decode_ack(bytes(frame), ack_key(SECRET)) == (1, 200, ranges)
+
+
+@pytest.mark.parametrize('payload', [False, True])
+def test_forged_ack_is_rejected(payload):
+    frame = encode_ack(99, 1, 7, [(0, 4095)], ack_key(OTHER), payload=payload)
+    with pytest.raises(VerificationError):
+        decode_ack(bytes(frame), ack_key(SECRET))
+
+
+def test_ack_is_bound_to_sender():
+    frame = bytearray(encode_ack(2, 1, 7, [(0, 4)], ack_key(SECRET)))
+    # The sender id sits in the middle two bytes of the frame header word
+    frame[5:7] = (3).to_bytes(2, byteorder='big')
+    with pytest.raises(VerificationError):
+        decode_ack(bytes(frame), ack_key(SECRET))
+
+
+class Link:
+    """
+    Acknowledges what arrives right away, dropping the first transmission of some fragments
+    """
+
+    def __init__(self, r: Retransmitter, count: int, drop=(), forever: bool = False):
+        self.r = r
+        self.arrived: List[Optional[bytes]] = [None] * count
+        self.drop = set(drop)
+        self.forever = forever
+        self.sent: List[int] = []
+        self.times: List[float] = []
+
+    def send(self, packets: List[bytes], target):
+        for p in packets:
+            i = int(p)
+            self.sent.append(i)
+            self.times.append(time.monotonic())
+            if self.forever or i in self.drop:
+                self.drop.discard(i)
+                continue
+            self.arrived[i] = p
+            self.r.acknowledge(target[0], SERIAL, received(self.arrived))
+
+
+def link(count: int, **kwargs) -> Tuple[Retransmitter, Link]:
+    r = Retransmitter(lambda packets, target: l.send(packets, target), Pacer(), retries=3)
+    l = Link(r, count, **kwargs)
+    return r, l
+
+
+def test_only_missing_fragments_are_resent():
+    r, l = link(16, drop={2, 9, 15})
+    try:
+        d = r.add([b'%d' % i for i in range(16)], TARGET, SERIAL)
+        assert d.wait(TIMEOUT)
+        assert sorted(l.sent) == sorted([*range(16), 2, 9, 15])
+        assert r.retransmitted == 3
+        assert (r.delivered, r.failed) == (1, 0)
+    finally:
+        r.close()
+    assert r.thread is None
+
+
+def test_rto_backs_off_and_gives_up():
+    r, l = link(1, forever=True)
+    path = r.path(TARGET[0])
+    path.rto = .05
+    try:
+        d = r.add([b'0'], TARGET, SERIAL)
+        assert not d.wait(TIMEOUT)
+        assert d.done.is_set()
+        # Sent, probed once and then retransmitted on every timeout until it gave up
+        assert len(l.sent) == 2 + r.retries
+        assert path.rto == pytest.approx(.05 * 2 ** r.retries)
+        gaps = [b - a for a, b in zip(l.times[1:], l.times[2:])]
+        assert all(b > a for a, b in zip(gaps, gaps[1:]))
+        assert (r.delivered, r.failed) == (0, 1)
+    finally:
+        r.close()
+
+
+def test_rto_follows_rfc6298():
+    path = Path()
+    assert path.rto == INITIAL_RTO
+    path.sample(.3)
+    assert (path.srtt, path.rttvar) == (.3, .15)
+    assert path.rto == pytest.approx(.3 + 4 * .15)
+    path.sample(.1)
+    assert path.rttvar == pytest.approx(.75 * .15 + .25 * .2)
+    assert path.srtt == pytest.approx(.875 * .3 + .125 * .1)
+    assert path.rto == pytest.approx(path.srtt + 4 * path.rttvar)
+    path.sample(.001)
+    path.sample(.001)
+    assert path.rto >= MIN_RTO
+    for _ in range(16):
+        path.backoff()
+    assert path.rto == MAX_RTO
+
+
+def test_deliver_over_lossy_link():
+    rx = DatagramMessager[Data](2, SECRET, ('127.0.0.3', 0), reliable=True, mtu=1500)
+    tx = DatagramMessager[Data](1, SECRET, ('127.0.0.2', 0), reliable=True, mtu=1500)
+    send = tx.retransmitter.send
+    seen = set()
+    dropped = []
+
+    def lossy(packets, target):
+        # Every fifth new packet is lost the first time it is sent
+        for p in packets:
+            p = bytes(p)
+            if p not in seen and len(seen) % 5 == 4:
+                dropped.append(p)
+            else:
+                send([p], target)
+            seen.add(p)
+
+    tx.retransmitter.send = lossy
+    received = []
+    for m, callback in ((rx, lambda m: received.append(m.payload.content)), (tx, lambda _: None)):
+        threading.Thread(target=m.receive, args=(callback,), daemon=True).start()
+    try:
+        content = os.urandom(20000).hex()
+        m = tx.message[message('a', 'b', content)]
+        m.target = rx.address
+        tx.deliver(m, TIMEOUT)
+        assert dropped and tx.retransmitter.retransmitted >= len(dropped)
+        # The receiver acknowledges before it hands the message on
+        deadline = time.monotonic() + TIMEOUT
+        while not received and time.monotonic() < deadline:
+            time.sleep(.001)
+        assert received == [content]
+    finally:
+        tx.close()
+        rx.close()
@@ -0,0 +1,35 @@
+from packet_buddy.base.session import SessionTable, public_bytes
+
+SECRET = b'super duper secret key! Encrypt!'
+A = '10.0.0.1'
+B = '10.0.0.2'
+
+
+def handshake(a: SessionTable, b: SessionTable, counter: int):
+    h, new = a.enqueue(B, 'queued')
+    assert new
+    reply, _ = b.respond(A, a.id, public_bytes(h.key), counter)
+    assert reply is not None
+    assert a.complete(B, b.id, reply, counter) == ['queued']
+    assert a.route(B).key == b.route(A).key
+
+
+def test_replayed_request_keeps_session():
+    a, b = SessionTable(1, SECRET), SessionTable(2, SECRET)
+    handshake(a, b, 100)
+    live = b.route(A)
+    recorded = public_bytes(SessionTable(1, SECRET).enqueue(B, None)[0].key)
+    for counter in (100, 99):
+        assert b.replayed(A, 1, counter)
+        assert b.respond(A, 1, recorded, counter) == (None, [])
+    assert b.route(A) is live
+
+
+def test_newer_request_replaces_session():
+    a, b = SessionTable(1, SECRET), SessionTable(2, SECRET)
+    handshake(a, b, 100)
+    live = b.route(A)
+    # A restarted peer starts over with a newer counter
+    a = SessionTable(1, SECRET)
+    handshake(a, b, 200)
+    assert b.route(A) is not live
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+
+import pytest
+
+from packet_buddy.base import DatagramMessager, Data
+from packet_buddy.base.stream import StreamSink, StreamTable, chunks, new_stream, stream_nonce, TIME_SIZE
+
+SECRET = b'super duper secret key! Encrypt!'
+ADDR = ('10.0.0.1', 0)
+TIMEOUT = 5
+
+
+class Sink(StreamSink):
+    def __init__(self):
+        self.data = b''
+        self.closed = False
+        self.aborted = False
+
+    def write(self, data: bytes):
+        self.data += data
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        self.aborted = True
+
+
+def table(**kwargs):
+    sinks = []
+    return StreamTable(lambda *_: sinks.append(Sink()) or sinks[-1], **kwargs), sinks
+
+
+def send(t: StreamTable, stream: bytes, parts, order, sender: int = 1):
+    for index in order:
+        t.add(ADDR, sender, stream_nonce(stream, index, index == len(parts) - 1), parts[index])
+
+
+def test_sink_must_write():
+    with pytest.raises(TypeError):
+        StreamSink()
+
+
+def test_replayed_stream_is_not_reopened(monkeypatch):
+    t, sinks = table(timeout=1.)
+    stream = new_stream()
+    t.add(ADDR, 1, stream_nonce(stream, 0, True), b'chunk')
+    assert sinks[0].closed and sinks[0].data == b'chunk'
+    # Long after the stream went idle
+    later = time.monotonic() + 60
+    monkeypatch.setattr(time, 'monotonic', lambda: later)
+    t.add(ADDR, 1, stream_nonce(stream, 0, True), b'chunk')
+    assert len(sinks) == 1
+    assert t.duplicates == 1
+
+
+def test_stale_stream_is_refused():
+    t, sinks = table()
+    old = int(time.time() - 2 * StreamTable.MAX_AGE).to_bytes(TIME_SIZE, byteorder='big')
+    stream = old + new_stream()[TIME_SIZE:]
+    t.add(ADDR, 1, stream_nonce(stream, 0, True), b'chunk')
+    assert not sinks
+    assert t.stale == 1
+
+
+def test_reordered_chunks_arrive_in_order():
+    t, sinks = table()
+    parts = [bytes([i]) * 10 for i in range(8)]
+    send(t, new_stream(), parts, [3, 0, 7, 1, 1, 5, 2, 6, 4])
+    assert sinks[0].data == b''.join(parts)
+    assert sinks[0].closed
+    assert (t.completed, t.failed, t.duplicates) == (1, 0, 1)
+    assert not t.streams
+
+
+def test_stream_fails_when_window_overflows():
+    t, sinks = table(window=2)
+    send(t, new_stream(), [b'x'] * 8, [1, 2, 3])
+    assert sinks[0].aborted and not sinks[0].closed
+    assert t.failed == 1
+    assert not t.streams
+
+
+def test_truncated_stream_is_aborted_after_timeout(monkeypatch):
+    t, sinks = table(timeout=1.)
+    send(t, new_stream(), [b'x'] * 4, [0, 1, 2])
+    assert not sinks[0].aborted
+    later = time.monotonic() + 2
+    monkeypatch.setattr(time, 'monotonic', lambda: later)
+    t.expire()
+    assert sinks[0].aborted and not sinks[0].closed
+    assert t.failed == 1
+
+
+def test_least_recently_active_stream_is_evicted():
+    t, sinks = table(max_streams=2)
+    streams = [new_stream() for _ in range(3)]
+    for stream in streams[:2]:
+        send(t, stream, [b'x'] * 2, [0])
+    # The first stream goes on, the second is the least recently active one by now
+    send(t, streams[0], [b'x'] * 3, [1])
+    send(t, streams[2], [b'x'] * 2, [0])
+    assert [s.aborted for s in sinks] == [False, True, False]
+    assert t.failed == 1
+    assert len(t.streams) == 2
+
+
+def test_empty_source_is_a_single_last_chunk():
+    assert list(chunks([], 16)) == [(b'', True)]
+    t, sinks = table()
+    send(t, new_stream(), [b''], [0])
+    assert sinks[0].closed and sinks[0].data == b''
+    assert t.completed == 1
+
+
+@pytest.mark.parametrize('size', [0, 100, 50000])
+def test_stream_over_datagrams(size):
+    source = os.urandom(size)
+    sinks = []
+    rx = DatagramMessager[Data](2, SECRET, ('127.0.0.3', 0), streams=lambda *_: sinks.append(Sink()) or sinks[-1])
+    tx = DatagramMessager[Data](1, SECRET, ('127.0.0.2', 0))
+    threading.Thread(target=rx.receive, args=(lambda _: None,), daemon=True).start()
+    try:
+        tx.stream([source], rx.address, chunk_size=4096)
+        deadline = time.monotonic() + TIMEOUT
+        while not rx.incoming.completed and time.monotonic() < deadline:
+            time.sleep(.001)
+        assert rx.incoming.completed == 1
+        assert sinks[0].data == source
+    finally:
+        tx.close()
+        rx.close()
@@ -0,0 +1,61 @@
+import gc
+import socket
+import threading
+
+import pytest
+
+from packet_buddy.base.utils import SocketPool
+
+
+def test_thread_sockets_close_when_thread_exits():
+    pool = SocketPool(per_thread=True)
+    opened = []
+
+    def send():
+        with pool.acquire(socket.IPPROTO_ICMP) as s:
+            opened.append(s)
+
+    for _ in range(8):
+        t = threading.Thread(target=send)
+        t.start()
+        t.join()
+    gc.collect()
+    assert len(opened) == 8
+    assert not pool.sockets
+    assert all(s.fileno() == -1 for s in opened)
+    pool.close()
+
+
+def test_thread_keeps_its_socket():
+    pool = SocketPool(per_thread=True)
+    with pool.acquire(socket.IPPROTO_ICMP) as a, pool.acquire(socket.IPPROTO_ICMP) as b:
+        assert a is b
+    assert pool.sockets == [a]
+    pool.close()
+    assert a.fileno() == -1
+
+
+@pytest.mark.parametrize('per_thread', [False, True])
+def test_close_while_acquiring(per_thread):
+    pool = SocketPool(per_thread=per_thread)
+    errors = []
+    stop = threading.Event()
+
+    def send():
+        try:
+            while not stop.is_set():
+                with pool.acquire(socket.IPPROTO_ICMP):
+                    pass
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=send) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for _ in range(200):
+        pool.close()
+    stop.set()
+    for t in threads:
+        t.join()
+    pool.close()
+    assert not errors